@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale
+from .models import Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, SalesRollup, StockAlert
 
 # Register your models here.
 admin.site.register(Ingredient)
@@ -7,4 +7,6 @@ admin.site.register(Recipe)
 admin.site.register(RecipeIngredient)
 admin.site.register(ProductionRecord)
 admin.site.register(Product)
-admin.site.register(Sale)
\ No newline at end of file
+admin.site.register(Sale)
+admin.site.register(SalesRollup)
+admin.site.register(StockAlert)
@@ -0,0 +1,410 @@
+"""
+Performance scenarios run by ``manage.py benchmark``.
+
+Each scenario seeds its own data into the throwaway database the command
+creates and returns (label, value) rows for the report.
+"""
+import datetime
+import threading
+import time
+import tracemalloc
+from decimal import Decimal
+
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, reset_queries
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import Ingredient, Recipe, RecipeIngredient, Product, Sale, SalesRollup
+from .planning import allocate
+from .synthetic import generate
+
+SCENARIOS = {}
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+def measure(func, repeat):
+    """Run func repeat times, returning (seconds per run, queries per run)"""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - started
+    return elapsed / repeat, len(queries) / repeat
+
+
+def profile(request, repeat):
+    """
+    Call request() repeat times with the response cache cleared, returning
+    (latencies in ms, queries per call, peak KiB allocated by one extra traced call)
+    """
+    latencies = []
+    queries = 0
+    for _ in range(repeat):
+        cache.clear()
+        # The query log is capped, so start each call from an empty one
+        reset_queries()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries += len(captured)
+        assert response.status_code < 400, (response.status_code, response.data)
+    cache.clear()
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return np.array(latencies), queries / repeat, peak / 1024
+
+
+def seed_products(count, ingredients_per_recipe=5, prepared=1_000_000):
+    ingredients = Ingredient.objects.bulk_create([
+        Ingredient(name=f'Ingredient {n}', quantity=1_000_000, unit='g', cost_per_unit=Decimal('0.01'))
+        for n in range(ingredients_per_recipe)
+    ])
+    recipes = Recipe.objects.bulk_create([
+        Recipe(name=f'Recipe {n}', prepared_quantity=prepared) for n in range(count)
+    ])
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, quantity=10)
+        for recipe in recipes for ingredient in ingredients
+    ])
+    Recipe.objects.refresh_stock_figures()
+    return Product.objects.bulk_create([
+        Product(recipe=recipe, name=recipe.name, price=Decimal('3.00')) for recipe in recipes
+    ])
+
+
+@scenario
+def checkout(orders=30, lines=10):
+    """A multi-line order posted one sale at a time versus one checkout request"""
+    client = APIClient()
+    cart = [
+        {'product': product.pk, 'quantity': 1, 'unit_price': '3.00'}
+        for product in seed_products(lines)
+    ]
+
+    def per_line():
+        for item in cart:
+            client.post('/api/sales/', item, format='json')
+
+    def bulk():
+        client.post('/api/sales/checkout/', {'items': cart}, format='json')
+
+    rows = []
+    for label, func in (('per-line POST /api/sales/', per_line), ('POST /api/sales/checkout/', bulk)):
+        seconds, queries = measure(func, orders)
+        rows.append((f'{label} orders/s', f'{1 / seconds:.1f}'))
+        rows.append((f'{label} queries/order', f'{queries:.0f}'))
+    return rows
+
+
+@scenario
+def contention(terminals=8, sales_per_terminal=50):
+    """Several terminals selling the last portions of one recipe at once"""
+    [product] = seed_products(1, prepared=terminals * sales_per_terminal // 2)
+    counts = {'sold': 0, 'rejected': 0, 'retries': 0}
+    lock = threading.Lock()
+
+    def terminal():
+        try:
+            for _ in range(sales_per_terminal):
+                while True:
+                    try:
+                        Sale.objects.create(product_id=product.pk, quantity=1, unit_price=product.price)
+                        outcome = 'sold'
+                    except ValidationError:
+                        outcome = 'rejected'
+                    except OperationalError:
+                        outcome = 'retries'
+                    with lock:
+                        counts[outcome] += 1
+                    if outcome != 'retries':
+                        break
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=terminal) for _ in range(terminals)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    remaining = Recipe.objects.get(pk=product.recipe_id).prepared_quantity
+    return [
+        ('terminals', terminals),
+        ('sales/s', f"{(counts['sold'] + counts['rejected']) / elapsed:.1f}"),
+        ('sold / rejected / busy retries', f"{counts['sold']} / {counts['rejected']} / {counts['retries']}"),
+        ('prepared portions left (must be 0)', remaining),
+    ]
+
+
+@scenario
+def optimizer(recipes=300, ingredients=300, per_recipe=12, runs=20):
+    """Joint allocation over a random recipe x ingredient matrix (pure NumPy, no database)"""
+    rng = np.random.default_rng(0)
+    requirements = np.zeros((recipes, ingredients))
+    for row in requirements:
+        row[rng.choice(ingredients, per_recipe, replace=False)] = rng.uniform(1, 50, per_recipe)
+    stock = rng.uniform(100, 5000, ingredients)
+    targets = rng.integers(0, 200, recipes).astype(float)
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        portions = allocate(requirements, stock, targets)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return [
+        ('matrix', f'{recipes} recipes x {ingredients} ingredients'),
+        ('median ms', f'{timings[len(timings) // 2] * 1000:.1f}'),
+        ('max ms', f'{timings[-1] * 1000:.1f}'),
+        ('feasible', bool((portions @ requirements <= stock + 1e-6).all())),
+        ('portions planned / targeted', f'{portions.sum():.0f} / {targets.sum():.0f}'),
+    ]
+
+
+@scenario
+def forecast(products=500, days=365, repeat=10):
+    """Fitting the demand forecast over a year of daily rollups, then serving it from the cache"""
+    product_rows = seed_products(products)
+    rng = np.random.default_rng(0)
+    today = timezone.localdate()
+    midnights = [
+        timezone.make_aware(datetime.datetime.combine(today - datetime.timedelta(days=offset), datetime.time.min))
+        for offset in range(1, days + 1)
+    ]
+    sold = rng.poisson(rng.uniform(1, 40, (products, 1)), (products, days))
+    SalesRollup.objects.bulk_create(
+        (
+            SalesRollup(
+                granularity=SalesRollup.DAY, bucket=bucket, product=product, revenue=Decimal(int(count) * 3),
+                cost=0, profit=0, transactions=int(count), items_sold=int(count),
+            )
+            for product, row in zip(product_rows, sold.tolist())
+            for bucket, count in zip(midnights, row) if count
+        ),
+        batch_size=5000,
+    )
+    client = APIClient()
+
+    def request():
+        return client.get('/api/products/forecast/', {'days': 7})
+
+    cold, queries, peak = profile(request, repeat)
+    request()
+    warm, _ = measure(request, repeat)
+    return [
+        ('history', f'{products} products x {days} days'),
+        ('fit p50 ms', f'{np.percentile(cold, 50):.1f}'),
+        ('fit queries', f'{queries:.0f}'),
+        ('fit peak KiB', f'{peak:.0f}'),
+        ('cached ms', f'{warm * 1000:.1f}'),
+    ]
+
+
+@scenario
+def time_ranges(rows=1_000_000, products=50, days=365, batch=50_000):
+    """Report-style date range queries over a large Sale table: EXPLAIN and timings"""
+    product_ids = [product.pk for product in seed_products(products)]
+    rng = np.random.default_rng(0)
+    end = timezone.now()
+    seeding = time.perf_counter()
+    for offset in range(0, rows, batch):
+        size = min(batch, rows - offset)
+        seconds = rng.uniform(0, days * 86400, size)
+        picks = rng.integers(0, products, size)
+        Sale.objects.bulk_create(
+            (
+                Sale(product_id=product_ids[pick], quantity=1, unit_price=Decimal('3.00'),
+                     timestamp=end - datetime.timedelta(seconds=float(second)))
+                for pick, second in zip(picks.tolist(), seconds.tolist())
+            ),
+            batch_size=5000,
+        )
+    Sale.objects.capture_costs()
+    seeding = time.perf_counter() - seeding
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    last_day = timezone.localdate()
+    first_day = last_day - datetime.timedelta(days=30)
+    queries = {
+        'timestamp__date range (old report)': Sale.objects.filter(
+            timestamp__date__gte=first_day, timestamp__date__lte=last_day
+        ),
+        'half-open range (Sale.on_dates)': Sale.objects.on_dates(first_day, last_day),
+        'one product, half-open range': Sale.objects.on_dates(first_day, last_day).filter(product_id=product_ids[0]),
+    }
+
+    results = [('rows seeded', f'{rows} in {seeding:.0f}s')]
+    for label, queryset in queries.items():
+        queryset = queryset.order_by()
+        plan = queryset.values('quantity').explain().splitlines()
+        seconds, _ = measure(lambda: list(queryset.summarize(TruncDay('timestamp'))), 3)
+        results.append((f'{label} ms', f'{seconds * 1000:.1f}'))
+        results.append((f'{label} plan', plan[-1].strip()))
+    return results
+
+
+@scenario
+def write_load(terminals=8, orders=40, readers=2):
+    """POS terminals checking out while dashboards read: stock SQLite settings versus the tuned ones"""
+    if connection.vendor != 'sqlite':
+        return [('skipped', 'compares SQLite settings only')]
+    cart = [{'product': product.pk, 'quantity': 1} for product in seed_products(3)]
+    tuned = connection.settings_dict['OPTIONS']
+    stock_options = {'init_command': 'PRAGMA journal_mode=DELETE;PRAGMA synchronous=FULL;'}
+
+    def run(options):
+        connection.settings_dict['OPTIONS'] = options
+        # Reconnect alone so the journal mode switch takes effect on the file
+        connection.close()
+        connection.ensure_connection()
+        counts = {'orders': 0, 'locked': 0, 'reads': 0, 'read errors': 0}
+        lock = threading.Lock()
+        writing = threading.Event()
+        writing.set()
+
+        def count(outcome):
+            with lock:
+                counts[outcome] += 1
+
+        def terminal():
+            try:
+                for _ in range(orders):
+                    while True:
+                        try:
+                            Sale.objects.checkout(cart)
+                        except OperationalError:
+                            count('locked')
+                            continue
+                        count('orders')
+                        break
+            finally:
+                connection.close()
+
+        def dashboard():
+            try:
+                while writing.is_set():
+                    try:
+                        list(SalesRollup.objects.filter(granularity=SalesRollup.DAY).values('bucket').annotate(Sum('revenue')))
+                        count('reads')
+                    except OperationalError:
+                        count('read errors')
+            finally:
+                connection.close()
+
+        writers = [threading.Thread(target=terminal) for _ in range(terminals)]
+        watchers = [threading.Thread(target=dashboard) for _ in range(readers)]
+        started = time.perf_counter()
+        for thread in writers + watchers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        writing.clear()
+        for thread in watchers:
+            thread.join()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            mode = cursor.fetchone()[0]
+        return mode, counts, elapsed
+
+    rows = [('terminals x orders, dashboard readers', f'{terminals} x {orders}, {readers}')]
+    try:
+        for label, options in (('stock', stock_options), ('tuned', tuned)):
+            mode, counts, elapsed = run(options)
+            rows += [
+                (f'{label} ({mode}) orders/s', f"{counts['orders'] / elapsed:.1f}"),
+                (f'{label} "database is locked" retries', counts['locked']),
+                (f'{label} dashboard reads/s (errors)', f"{counts['reads'] / elapsed:.1f} ({counts['read errors']})"),
+            ]
+    finally:
+        connection.settings_dict['OPTIONS'] = tuned
+        connection.close()
+    return rows
+
+
+@scenario
+def endpoints(ingredients=2000, recipes=300, sales=200_000, repeat=30):
+    """The real endpoints over a generated catalog and sales history: latency percentiles, queries and memory"""
+    generate(ingredients=ingredients, recipes=recipes, sales=sales)
+    client = APIClient()
+    today = timezone.localdate()
+    month_ago = (today - datetime.timedelta(days=30)).isoformat()
+    year_ago = (today - datetime.timedelta(days=365)).isoformat()
+    recipe = Recipe.objects.order_by('-max_portions').first()
+    Recipe.objects.filter(pk=recipe.pk).update(prepared_quantity=1_000_000)
+    products = list(Product.objects.filter(recipe=recipe).values_list('pk', flat=True)[:1]) * 3
+    cart = [{'product': pk, 'quantity': 1} for pk in products]
+
+    requests = {
+        'GET ingredients': lambda: client.get('/api/ingredients/'),
+        'GET recipes': lambda: client.get('/api/recipes/'),
+        'GET products': lambda: client.get('/api/products/'),
+        'GET sales': lambda: client.get('/api/sales/'),
+        'GET production-records': lambda: client.get('/api/production-records/'),
+        'GET report (30 days by day)': lambda: client.get(
+            '/api/sales/report/', {'period': 'day', 'start_date': month_ago, 'end_date': today.isoformat()}
+        ),
+        'GET report (year by month)': lambda: client.get(
+            '/api/sales/report/', {'period': 'month', 'start_date': year_ago, 'end_date': today.isoformat()}
+        ),
+        'GET dashboard': lambda: client.get('/api/sales/dashboard/'),
+        'GET forecast': lambda: client.get('/api/products/forecast/'),
+        'POST prepare': lambda: client.post(f'/api/recipes/{recipe.pk}/prepare/', {'quantity': 0.01}, format='json'),
+        'POST sale': lambda: client.post('/api/sales/', {**cart[0], 'unit_price': '3.00'}, format='json'),
+        'POST checkout (3 lines)': lambda: client.post('/api/sales/checkout/', {'items': cart}, format='json'),
+    }
+
+    rows = [('data', f'{ingredients} ingredients, {recipes} recipes, {sales} sales')]
+    for label, request in requests.items():
+        latencies, queries, peak = profile(request, repeat)
+        rows += [
+            (f'{label} p50 ms', f'{np.percentile(latencies, 50):.1f}'),
+            (f'{label} p95 ms', f'{np.percentile(latencies, 95):.1f}'),
+            (f'{label} p99 ms', f'{np.percentile(latencies, 99):.1f}'),
+            (f'{label} queries', f'{queries:.0f}'),
+            (f'{label} peak KiB', f'{peak:.0f}'),
+        ]
+    return rows
+
+
+@scenario
+def export(sizes=(10_000, 100_000)):
+    """Peak memory streaming the sales export, which should not grow with the number of rows"""
+    [product] = seed_products(1)
+    client = APIClient()
+    rows = []
+    seeded = 0
+    for size in sizes:
+        Sale.objects.bulk_create(
+            (Sale(product=product, quantity=1, unit_price=product.price).capture_costs() for _ in range(size - seeded)),
+            batch_size=5000,
+        )
+        seeded = size
+        for format in ('csv', 'ndjson'):
+            tracemalloc.start()
+            started = time.perf_counter()
+            response = client.get('/api/sales/export/', {'format': format})
+            written = sum(len(chunk) for chunk in response.streaming_content)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append((f'{size} rows {format}: peak KiB / MB written / s', f'{peak / 1024:.0f} / {written / 1e6:.1f} / {elapsed:.2f}'))
+    return rows
@@ -0,0 +1,109 @@
+"""
+Table versions and change-log entries, written once per request.
+
+Writes only note which tables and rows they touched. The notes are written
+together in one short transaction when the request ends (or straight away
+outside a request): the change-log lock row first, then the touched
+version rows, then the log entries. Every writer takes those locks in the
+same order and only after its data has committed, so bookkeeping can never
+deadlock with data writes, and log entry ids are handed out in commit
+order, so a sync token never passes an entry that is still uncommitted.
+
+A note from a write that was later rolled back is still written; that only
+costs a spare version bump or a row a client reads again.
+"""
+import contextlib
+import contextvars
+
+from django.db import connection, transaction
+
+# The TableVersion row every flush locks first
+LOCK = 'api.ChangeLogEntry'
+
+_pending = contextvars.ContextVar('pending_bookkeeping', default=None)
+
+
+class _Pending:
+    def __init__(self):
+        self.tables = set()
+        self.rows = {}  # {(label, pk): deleted}, the last note per row winning
+        self.events = []  # [(model, pks, deleted)] for live streams
+
+    def __bool__(self):
+        return bool(self.tables or self.rows or self.events)
+
+
+@contextlib.contextmanager
+def _notes():
+    """The current request's pending notes, or a batch of its own written straight away"""
+    pending = _pending.get()
+    if pending is not None:
+        yield pending
+        return
+    pending = _Pending()
+    yield pending
+    _flush(pending)
+
+
+def bump(*tables):
+    """Advance the version of each model class given"""
+    with _notes() as pending:
+        pending.tables.update(table._meta.label for table in tables)
+
+
+def log(table, pks, deleted=False):
+    """Note rows of table as saved or deleted for sync clients and live streams"""
+    from .models import ChangeLogEntry
+
+    label = table._meta.label
+    with _notes() as pending:
+        if label in ChangeLogEntry.SYNCED:
+            pending.rows.update(((label, pk), deleted) for pk in pks)
+        pending.events.append((table, list(pks), deleted))
+
+
+@contextlib.contextmanager
+def deferred():
+    """Collect bookkeeping inside the block and write it once when the block ends"""
+    if _pending.get() is not None:
+        yield
+        return
+    pending = _Pending()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        # Inside a transaction that already failed nothing more can be written
+        if not (connection.in_atomic_block and connection.needs_rollback):
+            _flush(pending)
+
+
+def _flush(pending):
+    from . import events
+    from .models import ChangeLogEntry, TableVersion
+
+    if not pending:
+        return
+    with transaction.atomic():
+        TableVersion.objects.advance([LOCK])
+        if pending.tables:
+            TableVersion.objects.advance(sorted(pending.tables))
+        if pending.rows:
+            ChangeLogEntry.objects.bulk_create([
+                ChangeLogEntry(table=label, object_id=pk, deleted=deleted)
+                for (label, pk), deleted in pending.rows.items()
+            ])
+    for table, pks, deleted in pending.events:
+        events.publish_changes(table, pks, deleted)
+
+
+class DeferredBookkeepingMiddleware:
+    """Write each request's table versions and change-log entries in one go at the end"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deferred():
+            return self.get_response(request)
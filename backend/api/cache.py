@@ -0,0 +1,97 @@
+"""
+Read-through cache for catalog list and detail responses.
+
+Cached pages are keyed by endpoint namespace, a per-namespace generation
+number and the absolute request URL. Changing a model bumps the generation
+of every namespace that displays it, which orphans all of that namespace's
+pages at once without scanning keys; orphans simply expire.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+# Which cached endpoints show data from each model
+DEPENDENCIES = {
+    'api.Ingredient': ('ingredients', 'recipes', 'products'),
+    'api.Recipe': ('recipes', 'products'),
+    'api.RecipeIngredient': ('recipes', 'products'),
+    'api.Product': ('products',),
+    'api.Sale': ('recipes', 'products'),
+    'api.ProductionRecord': ('recipes', 'products'),
+}
+
+PREFIX = 'catalog-cache'
+
+
+def _generation_key(namespace):
+    return f'{PREFIX}:generation:{namespace}'
+
+
+def _page_key(namespace, generation, path):
+    return f'{PREFIX}:{namespace}:{generation}:{hashlib.md5(path.encode()).hexdigest()}'
+
+
+def _count(outcome):
+    try:
+        cache.incr(f'{PREFIX}:{outcome}')
+    except ValueError:
+        cache.set(f'{PREFIX}:{outcome}', 1, timeout=None)
+
+
+def _bump(namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_generation_key(namespace))
+        except ValueError:
+            # Start from the clock so a lost counter never reuses old keys
+            cache.set(_generation_key(namespace), time.time_ns(), timeout=None)
+
+
+def invalidate(model):
+    """Drop every cached page that shows rows of model"""
+    namespaces = DEPENDENCIES.get(model._meta.label, ())
+    if namespaces:
+        # Once now for this process, and again after commit so a concurrent
+        # reader cannot re-cache rows from before the transaction finished
+        _bump(namespaces)
+        transaction.on_commit(lambda: _bump(namespaces))
+
+
+def stats():
+    hits, misses = (cache.get(f'{PREFIX}:{outcome}', 0) for outcome in ('hits', 'misses'))
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+class CachedResponseMixin:
+    """Serve list and retrieve responses through the catalog cache"""
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(request, super().retrieve, *args, **kwargs)
+
+    def _cached(self, request, view, *args, **kwargs):
+        generation = cache.get(_generation_key(self.cache_namespace), 0)
+        # Pagination links and image URLs are absolute, so the host is part of the key
+        key = _page_key(self.cache_namespace, generation, request.build_absolute_uri())
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _count('misses')
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,100 @@
+"""
+In-process fan-out of committed changes to server-sent event streams.
+
+Writers publish from request threads once their transaction commits; each
+open /api/events/ stream owns a bounded asyncio queue on the server's
+event loop. Run the app under an ASGI server (uvicorn) as one process for
+every terminal to share a broker. Events are hints only: clients catch up
+through /api/sync/ whenever they (re)connect or are told to resync.
+"""
+import asyncio
+import itertools
+import json
+import threading
+
+from django.db import transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Ingredient, ProductionRecord, Sale, StockAlert
+from .serializers import IngredientSerializer, ProductionRecordSerializer, SaleSerializer, StockAlertSerializer
+
+HEARTBEAT_SECONDS = 15
+QUEUE_SIZE = 100
+
+# Tables pushed to clients: label -> (event name, queryset, serializer)
+FEEDS = {
+    'api.StockAlert': ('stock_alert', StockAlert.objects.select_related('ingredient'), StockAlertSerializer),
+    'api.Sale': ('sale', Sale.objects.select_related('product__recipe'), SaleSerializer),
+    'api.ProductionRecord': ('production', ProductionRecord.objects.select_related('recipe'), ProductionRecordSerializer),
+    'api.Ingredient': ('ingredient', Ingredient.objects.all(), IngredientSerializer),
+}
+
+
+def _format(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, cls=JSONEncoder)}\n\n"
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()  # (event loop, queue) per open stream
+        self._ids = itertools.count(1)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event, data):
+        """Send an event to every open stream; safe to call from any thread"""
+        message = _format(next(self._ids), event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, message)
+            except RuntimeError:
+                # The stream's loop has shut down
+                pass
+
+    def _deliver(self, queue, message):
+        if queue.full():
+            # A stream this far behind is told to resync instead of being sent stale rows
+            while not queue.empty():
+                queue.get_nowait()
+            message = _format(next(self._ids), 'resync', {})
+        queue.put_nowait(message)
+
+    async def subscribe(self):
+        """Yield formatted events as they arrive, or None after each quiet heartbeat interval"""
+        queue = asyncio.Queue(QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+broker = Broker()
+
+
+def publish_changes(table, pks, deleted=False):
+    """Push rows of a FEEDS table to open streams after the current transaction commits"""
+    label = table._meta.label
+    if label not in FEEDS or not broker.has_subscribers():
+        return
+    pks = list(pks)
+    transaction.on_commit(lambda: _publish(label, pks, deleted))
+
+
+def _publish(label, pks, deleted):
+    event, queryset, serializer = FEEDS[label]
+    if deleted:
+        broker.publish(event, {'updated': [], 'deleted': pks})
+    else:
+        broker.publish(event, {'updated': serializer(queryset.filter(pk__in=pks), many=True).data, 'deleted': []})
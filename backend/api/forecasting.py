@@ -0,0 +1,135 @@
+"""
+Per-product daily demand forecasts from the daily sales rollups.
+
+History is loaded as one product x day matrix and every product is fitted
+at once: a day-of-week profile, left flat until there are a few weeks of
+data, times a simple exponential smoothing of the deseasonalised series.
+The smoothed level is a single weighted sum over days (one matrix
+product) rather than a loop per product.
+"""
+import datetime
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Product, SalesRollup, TableVersion
+
+# Observations of a weekday needed before it gets its own factor
+MIN_WEEKS = 3
+CACHE_TIMEOUT = 24 * 3600
+
+
+def fit(sales, weekdays, alpha, min_weeks=MIN_WEEKS):
+    """
+    Fit every row of sales (products x days) at once; weekdays gives each
+    column's day of the week. Days before a product's first sale are
+    ignored. Returns (level, profile): the smoothed deseasonalised daily
+    level per product and its (products x 7) weekday factors, averaging 1.
+    """
+    products, days = sales.shape
+    first = np.where(sales.any(axis=1), (sales > 0).argmax(axis=1), days)
+    observed = np.arange(days) >= first[:, None]
+
+    onehot = np.eye(7)[weekdays]
+    totals = (sales * observed) @ onehot
+    counts = observed @ onehot
+    daily_mean = totals.sum(axis=1) / np.maximum(counts.sum(axis=1), 1)
+    profile = np.divide(
+        totals / np.maximum(counts, 1), daily_mean[:, None],
+        out=np.ones((products, 7)), where=(counts >= min_weeks) & (daily_mean[:, None] > 0),
+    )
+    # A weekday that never sells still keeps a sliver of demand, so no division by 0
+    profile = np.maximum(profile, 1e-3)
+    profile /= profile.mean(axis=1, keepdims=True)
+
+    deseasonalised = np.where(observed, sales / profile[:, weekdays], 0.0)
+    # Seed each series with its first observed week
+    first_week = observed & (np.arange(days) < first[:, None] + 7)
+    seed = deseasonalised.sum(axis=1, where=first_week) / np.maximum(first_week.sum(axis=1), 1)
+    decay = (1 - alpha) ** np.arange(days - 1, -1, -1)
+    level = alpha * deseasonalised @ decay + (1 - alpha) ** observed.sum(axis=1) * seed
+    return level, profile
+
+
+class Forecast:
+    """Fitted daily demand for each active product"""
+
+    def __init__(self, product_ids, recipe_ids, names, level, profile):
+        self.product_ids = list(product_ids)
+        self.recipe_ids = list(recipe_ids)
+        self.names = list(names)
+        self.level = level  # shape (products,)
+        self.profile = profile  # shape (products, 7)
+
+    @classmethod
+    def load(cls, history, alpha, today=None):
+        """Fit on the `history` whole days before today: one query for products, one for the sales matrix"""
+        today = today or timezone.localdate()
+        start = today - datetime.timedelta(days=history)
+        products = list(Product.objects.filter(is_active=True).order_by('pk').values_list('pk', 'recipe_id', 'name'))
+        index = {pk: i for i, (pk, _, _) in enumerate(products)}
+        rows = list(
+            SalesRollup.objects
+            .filter(
+                granularity=SalesRollup.DAY, product__is_active=True,
+                bucket__gte=_midnight(start), bucket__lt=_midnight(today),
+            )
+            # As text: converting a datetime per row costs more than the rest of
+            # the fit, and a year has only 365 distinct buckets to parse
+            .annotate(day=Cast('bucket', CharField()))
+            .values_list('product_id', 'day', 'items_sold')
+        )
+
+        sales = np.zeros((len(products), history))
+        if rows:
+            product_ids, buckets, sold = zip(*rows)
+            offsets = {bucket: _day_offset(bucket, start) for bucket in set(buckets)}
+            np.add.at(sales, ([index[pk] for pk in product_ids], [offsets[bucket] for bucket in buckets]), sold)
+        weekdays = (start.weekday() + np.arange(history)) % 7
+        level, profile = fit(sales, weekdays, alpha)
+        return cls(*(zip(*products) if products else ((), (), ())), level, profile)
+
+    @classmethod
+    def cached(cls, history, alpha):
+        """load(), reused until a sale or product changes or the day rolls over"""
+        versions = TableVersion.objects.current([SalesRollup, Product])
+        key = '|'.join([
+            timezone.localdate().isoformat(), str(history), repr(alpha),
+            *(f'{label}={version}' for label, version in sorted(versions.items())),
+        ])
+        key = f'forecast:{hashlib.md5(key.encode()).hexdigest()}'
+        forecast = cache.get(key)
+        if forecast is None:
+            forecast = cls.load(history, alpha)
+            cache.set(key, forecast, timeout=CACHE_TIMEOUT)
+        return forecast
+
+    def demand(self, dates):
+        """Expected units of each product sold over the given dates"""
+        weekdays = [date.weekday() for date in dates]
+        return self.level * self.profile[:, weekdays].sum(axis=1)
+
+    def demand_by_recipe(self, dates):
+        """{recipe_id: expected portions sold over the given dates}"""
+        recipe_ids = sorted(set(self.recipe_ids))
+        position = {pk: i for i, pk in enumerate(recipe_ids)}
+        totals = np.bincount(
+            [position[pk] for pk in self.recipe_ids], weights=self.demand(dates), minlength=len(recipe_ids)
+        )
+        return dict(zip(recipe_ids, totals.tolist()))
+
+
+def _day_offset(text, start):
+    """Days from start to the local date of a bucket read back as text"""
+    bucket = datetime.datetime.fromisoformat(text)
+    if timezone.is_naive(bucket):
+        bucket = timezone.make_aware(bucket, datetime.timezone.utc)
+    return (timezone.localtime(bucket).date() - start).days
+
+
+def _midnight(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
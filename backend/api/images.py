@@ -0,0 +1,101 @@
+"""
+Resized WebP and JPEG variants of recipe photos.
+
+Uploads are decoded once on a background worker thread and every size is
+cut from that decode, so saving a recipe never waits on Pillow. Variant
+files are named after a hash of their bytes: a new photo gets new names,
+which lets recipe_image serve them as immutable for a year.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY = 'recipe_images/variants'
+# Longest edge in pixels, largest first so each size is cut from the one before
+SIZES = {'large': 1280, 'card': 640, 'thumb': 240}
+# format -> (Pillow format, extension, content type, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+CONTENT_TYPES = {extension: content_type for _, extension, content_type, _ in FORMATS.values()}
+
+_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recipe-images')
+
+
+def schedule(recipe_id):
+    """Generate variants of a recipe's current photo once the surrounding transaction commits"""
+    transaction.on_commit(lambda: _worker.submit(_run, recipe_id))
+
+
+def _run(recipe_id):
+    try:
+        generate(recipe_id)
+    except Exception:
+        logger.exception("image variants failed recipe=%s", recipe_id)
+    finally:
+        # The worker thread holds its own connection; don't keep it between jobs
+        connection.close()
+
+
+def render(source):
+    """{size: (width, height, {format: bytes})} from a single decode of source"""
+    with Image.open(source) as decoded:
+        image = ImageOps.exif_transpose(decoded)
+        if image.mode != 'RGB':
+            # JPEG has no alpha channel, so flatten onto white rather than black
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+
+    variants = {}
+    for size, edge in SIZES.items():
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        encoded = {}
+        for name, (pillow_format, _, _, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, pillow_format, **options)
+            encoded[name] = buffer.getvalue()
+        variants[size] = (image.width, image.height, encoded)
+    return variants
+
+
+def generate(recipe_id):
+    """Write every variant of the recipe's photo and record their paths on the recipe"""
+    from .signals import record_bulk_write
+
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return None
+    source = recipe.image.name
+    with recipe.image.open('rb') as file:
+        rendered = render(file)
+
+    variants = {'source': source}
+    for size, (width, height, encoded) in rendered.items():
+        entry = {'width': width, 'height': height}
+        for name, data in encoded.items():
+            extension = FORMATS[name][1]
+            path = f'{DIRECTORY}/{recipe_id}-{size}.{hashlib.sha256(data).hexdigest()[:16]}.{extension}'
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(data))
+            entry[name] = path
+        variants[size] = entry
+
+    with transaction.atomic():
+        # A photo replaced while this one was processing has its own job queued
+        if not Recipe.objects.filter(pk=recipe_id, image=source).update(image_variants=variants):
+            return None
+        # Queryset updates send no post_save
+        record_bulk_write(Recipe, [recipe_id])
+    return variants
@@ -0,0 +1,207 @@
+"""
+Per-request timing and query metrics.
+
+RequestMetricsMiddleware measures every request without needing DEBUG:
+queries and database time through a connection execute wrapper, time
+spent turning model instances into primitives in serializers using
+TimedSerializerMixin, time spent rendering the response body (JSON
+encoding of serializer output) through a post-render callback, and the
+body size. Each response reports its own figures in a Server-Timing
+header; running totals per view are kept in process and served in
+Prometheus text format by metrics_view.
+"""
+import contextvars
+import logging
+import threading
+import time
+
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _SerializeTimer:
+    """Time spent in the outermost serializer calls of one request, and the queries they ran"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.active = False
+
+
+_serialize_timer = contextvars.ContextVar('serialize_timer', default=None)
+
+
+class _QueryTimer:
+    """Execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds += elapsed
+            self.queries += 1
+            serializing = _serialize_timer.get()
+            if serializing is not None and serializing.active:
+                # Already counted under db, so kept out of serialize
+                serializing.db_seconds += elapsed
+
+
+class TimedSerializerMixin:
+    """Add the time spent in to_representation to the current request's serialize figure"""
+
+    def to_representation(self, instance):
+        timer = _serialize_timer.get()
+        # Nested serializers run inside their parent's timing
+        if timer is None or timer.active:
+            return super().to_representation(instance)
+        timer.active = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timer.seconds += time.perf_counter() - started
+            timer.active = False
+
+
+class MetricsRegistry:
+    """Totals per (view, method, status) and a duration histogram per (view, method)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.totals = {}
+            self.histograms = {}
+
+    def observe(self, view, method, status, duration, queries, db_seconds, serialize_seconds, render_seconds, size):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.totals.setdefault((view, method), [0.0, 0, 0.0, 0.0, 0.0, 0])
+            totals[0] += duration
+            totals[1] += queries
+            totals[2] += db_seconds
+            totals[3] += serialize_seconds
+            totals[4] += render_seconds
+            totals[5] += size
+            counts = self.histograms.setdefault((view, method), [0] * len(DURATION_BUCKETS))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    counts[i] += 1
+
+    def render(self):
+        """The registry in Prometheus text exposition format"""
+        def labels(view, method, **extra):
+            pairs = {'view': view, 'method': method, **extra}
+            return '{' + ','.join(f'{name}="{value}"' for name, value in pairs.items()) + '}'
+
+        with self._lock:
+            lines = [
+                '# HELP bakery_requests_total Requests handled, by view, method and status.',
+                '# TYPE bakery_requests_total counter',
+            ]
+            lines += [
+                f'bakery_requests_total{labels(view, method, status=status)} {count}'
+                for (view, method, status), count in sorted(self.requests.items())
+            ]
+            lines += [
+                '# HELP bakery_request_duration_seconds Time from request to rendered response.',
+                '# TYPE bakery_request_duration_seconds histogram',
+            ]
+            for (view, method), counts in sorted(self.histograms.items()):
+                requests = sum(
+                    count for (v, m, _), count in self.requests.items() if (v, m) == (view, method)
+                )
+                lines += [
+                    f'bakery_request_duration_seconds_bucket{labels(view, method, le=bound)} {count}'
+                    for bound, count in zip(DURATION_BUCKETS, counts)
+                ]
+                lines += [
+                    f'bakery_request_duration_seconds_bucket{labels(view, method, le="+Inf")} {requests}',
+                    f'bakery_request_duration_seconds_sum{labels(view, method)} {self.totals[view, method][0]:.6f}',
+                    f'bakery_request_duration_seconds_count{labels(view, method)} {requests}',
+                ]
+            for index, (name, kind, help_text) in enumerate([
+                ('bakery_db_queries_total', 'counter', 'SQL queries run while handling requests.'),
+                ('bakery_db_seconds_total', 'counter', 'Time spent in SQL queries.'),
+                ('bakery_serialize_seconds_total', 'counter', 'Time spent in serializers, excluding their SQL queries.'),
+                ('bakery_render_seconds_total', 'counter', 'Time spent rendering response bodies.'),
+                ('bakery_response_bytes_total', 'counter', 'Response body bytes sent.'),
+            ], start=1):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [
+                    f'{name}{labels(view, method)} {totals[index]:g}'
+                    for (view, method), totals in sorted(self.totals.items())
+                ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        serializing = _SerializeTimer()
+        token = _serialize_timer.set(serializing)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _serialize_timer.reset(token)
+        duration = time.perf_counter() - started
+
+        serialize_seconds = serializing.seconds - serializing.db_seconds
+        render_seconds = getattr(request, '_render_seconds', 0.0)
+        size = 0 if response.streaming else len(response.content)
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        registry.observe(
+            view, request.method, response.status_code, duration, timer.queries, timer.seconds,
+            serialize_seconds, render_seconds, size,
+        )
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timer.seconds * 1000:.1f};desc="{timer.queries} queries"',
+            f'serialize;dur={serialize_seconds * 1000:.1f}',
+            f'render;dur={render_seconds * 1000:.1f}',
+            f'app;dur={(duration - timer.seconds - serialize_seconds - render_seconds) * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+        logger.debug(
+            "request view=%s method=%s status=%s duration_ms=%.1f queries=%d db_ms=%.1f serialize_ms=%.1f "
+            "render_ms=%.1f bytes=%d",
+            view, request.method, response.status_code, duration * 1000, timer.queries,
+            timer.seconds * 1000, serialize_seconds * 1000, render_seconds * 1000, size,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that step
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._render_seconds = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Sale, TableVersion
+
+
+class Command(BaseCommand):
+    help = (
+        "Capture unit_cost and line totals on sales recorded before they were stored, "
+        "using each recipe's current cost"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Recapture every sale, not just those missing costs")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Sales updated per transaction")
+
+    def handle(self, *args, **options):
+        sales = Sale.objects.all() if options['all'] else Sale.objects.filter(unit_cost__isnull=True)
+        updated = 0
+        last = 0
+        while True:
+            # Short transactions keep the write lock from stalling the tills
+            pks = list(sales.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            # Not written to the change log: history is not synced to terminals
+            with transaction.atomic():
+                updated += sales.filter(pk__gte=pks[0], pk__lte=pks[-1]).capture_costs()
+            last = pks[-1]
+            self.stdout.write(f"{updated} sales")
+        if updated:
+            TableVersion.objects.bump(Sale)
+        self.stdout.write(self.style.SUCCESS(f"Captured costs on {updated} sales"))
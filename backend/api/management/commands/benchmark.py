@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Run performance scenarios against a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})",
+        )
+        parser.add_argument('--json', help="Write the results to this file")
+        parser.add_argument('--baseline', help="Results file from an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        results = {}
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            # A file rather than the in-memory test database, so journal
+            # modes and locking behave as they do in production
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.gettempdir(), f'benchmark-{os.getpid()}.sqlite3'
+            )
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                results[name] = {}
+                for label, value in SCENARIOS[name]():
+                    results[name][label] = str(value)
+                    line = f"  {label:<50} {value}"
+                    previous = baseline.get(name, {}).get(label)
+                    if previous is not None:
+                        line += self._compare(str(value), previous)
+                    self.stdout.write(line)
+                call_command('flush', interactive=False, verbosity=0)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def _compare(self, value, previous):
+        try:
+            value, previous = float(value), float(previous)
+        except ValueError:
+            return f"  (was {previous})" if value != previous else ""
+        if not previous:
+            return f"  (was {previous:g})"
+        change = f"  (was {previous:g}, {(value - previous) / previous:+.0%})"
+        return self.style.WARNING(change) if abs(value - previous) > 0.2 * abs(previous) else change
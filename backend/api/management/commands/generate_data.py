@@ -0,0 +1,35 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Ingredient
+from api.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic bakery catalog and a year of sales for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--sales', type=int, default=1_000_000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help="Delete ALL existing data first")
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        elif Ingredient.objects.exists():
+            raise CommandError("The database already has data; pass --flush to replace it")
+
+        counts = generate(
+            ingredients=options['ingredients'],
+            recipes=options['recipes'],
+            sales=options['sales'],
+            days=options['days'],
+            seed=options['seed'],
+            log=lambda message: self.stdout.write(f"  {message}"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Generated " + ", ".join(f"{count} {label}" for label, count in counts.items())
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.models import SalesRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly and daily sales rollups from the full sale history"
+
+    def handle(self, *args, **options):
+        buckets = SalesRollup.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} sales rollup buckets"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.models import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Checkpoint current stock so point-in-time queries only replay the movements since; "
+        "run daily, e.g. from cron"
+    )
+
+    def handle(self, *args, **options):
+        rows = StockSnapshot.objects.take()
+        self.stdout.write(self.style.SUCCESS(f"Snapshot of {len(rows)} stock rows"))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:13
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_stock_figures(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    RecipeIngredient = apps.get_model('api', 'RecipeIngredient')
+    requirements = RecipeIngredient.objects.filter(recipe=OuterRef('pk')).values('recipe')
+    cost = requirements.annotate(
+        total=Sum(F('quantity') * F('ingredient__cost_per_unit'), output_field=FloatField())
+    ).values('total')
+    portions = requirements.filter(quantity__gt=0).annotate(
+        least=Min(F('ingredient__quantity') / F('quantity'), output_field=FloatField())
+    ).values('least')
+    Recipe.objects.update(
+        cost=Coalesce(Subquery(cost, output_field=FloatField()), 0.0),
+        max_portions=Greatest(Coalesce(Subquery(portions, output_field=FloatField()), 0.0), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_recipeingredient_sub_recipe'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipeingredient',
+            name='sub_recipe',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='cost',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Cost of making this recipe once'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='max_portions',
+            field=models.FloatField(db_index=True, default=0, editable=False, help_text='Portions the current ingredient stock allows'),
+        ),
+        migrations.RunPython(populate_stock_figures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def build_existing_buckets(apps, schema_editor):
+    """Roll up the sales already recorded, so reports read from the buckets start out whole"""
+    Sale = apps.get_model('api', 'Sale')
+    SalesRollup = apps.get_model('api', 'SalesRollup')
+    for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+        buckets = (
+            Sale.objects
+            .annotate(bucket=trunc('timestamp'))
+            .values('bucket', 'product')
+            .annotate(
+                revenue=Sum(F('quantity') * F('unit_price')),
+                cost=Sum(F('quantity') * F('product__recipe__cost'), output_field=FloatField()),
+                transactions=Count('id'),
+                items_sold=Sum('quantity'),
+            )
+            .order_by()
+        )
+        SalesRollup.objects.bulk_create(
+            (
+                SalesRollup(
+                    granularity=granularity,
+                    bucket=row['bucket'],
+                    product_id=row['product'],
+                    revenue=row['revenue'],
+                    cost=row['cost'] or 0,
+                    profit=float(row['revenue']) - (row['cost'] or 0),
+                    transactions=row['transactions'],
+                    items_sold=row['items_sold'],
+                )
+                for row in buckets.iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_recipe_cost_max_portions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day in local time')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.FloatField(default=0, help_text='Cost of goods sold, taken at the time of each sale')),
+                ('profit', models.FloatField(default=0)),
+                ('transactions', models.IntegerField(default=0)),
+                ('items_sold', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+            options={
+                'ordering': ['bucket'],
+                'unique_together': {('granularity', 'bucket', 'product')},
+            },
+        ),
+        migrations.RunPython(build_existing_buckets, migrations.RunPython.noop),
+    ]
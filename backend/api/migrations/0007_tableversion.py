@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:25
+
+from django.db import migrations, models
+
+TRACKED = (
+    'api.Ingredient', 'api.Recipe', 'api.RecipeIngredient',
+    'api.ProductionRecord', 'api.Product', 'api.Sale', 'api.SalesRollup',
+)
+
+
+def create_versions(apps, schema_editor):
+    TableVersion = apps.get_model('api', 'TableVersion')
+    TableVersion.objects.bulk_create([TableVersion(table=label) for label in TRACKED])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_salesrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('table', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_current_low_stock(apps, schema_editor):
+    """Start the alert log from today's state so existing low items are not reported again"""
+    Ingredient = apps.get_model('api', 'Ingredient')
+    StockAlert = apps.get_model('api', 'StockAlert')
+    StockAlert.objects.bulk_create([
+        StockAlert(ingredient=ingredient, kind='low', quantity=ingredient.quantity, min_threshold=ingredient.min_threshold)
+        for ingredient in Ingredient.objects.filter(quantity__lte=models.F('min_threshold'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_changelogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low', 'Dropped to or below threshold'), ('recovered', 'Back above threshold')], max_length=9)),
+                ('quantity', models.FloatField(help_text='Quantity right after the crossing')),
+                ('min_threshold', models.FloatField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('quantity__lte', models.F('min_threshold'))), fields=['name'], name='ingredient_low_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='ingredient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_alerts', to='api.ingredient'),
+        ),
+        migrations.RunPython(record_current_low_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_ingredient_low_stock_stockalert'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productionrecord',
+            index=models.Index(fields=['timestamp'], name='production_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionrecord',
+            index=models.Index(fields=['recipe', 'timestamp'], name='production_recipe_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['timestamp'], name='sale_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['product', 'timestamp'], name='sale_product_timestamp_idx'),
+        ),
+    ]
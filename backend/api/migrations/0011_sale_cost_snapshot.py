@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:53
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def capture_existing_costs(apps, schema_editor):
+    """Fill the new columns on existing sales from each recipe's current cost, so reports stay whole"""
+    Product = apps.get_model('api', 'Product')
+    Sale = apps.get_model('api', 'Sale')
+    recipe_cost = Subquery(Product.objects.filter(pk=OuterRef('product')).values('recipe__cost')[:1])
+    Sale.objects.update(
+        unit_cost=recipe_cost,
+        total_price=F('quantity') * F('unit_price'),
+        total_cost=F('quantity') * recipe_cost,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_time_range_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='total_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='total_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='unit_cost',
+            field=models.FloatField(blank=True, help_text='Recipe cost per portion at time of sale', null=True),
+        ),
+        migrations.RunPython(capture_existing_costs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def snapshot_opening_stock(apps, schema_editor):
+    """The ledger starts empty, so today's stock is the baseline every later movement adds to"""
+    StockSnapshot = apps.get_model('api', 'StockSnapshot')
+    now = django.utils.timezone.now()
+    rows = []
+    for model, quantity_field, cost_field in (('Ingredient', 'quantity', 'cost_per_unit'), ('Recipe', 'prepared_quantity', 'cost')):
+        rows += [
+            StockSnapshot(taken_at=now, table=f'api.{model}', object_id=pk, quantity=quantity, unit_cost=float(cost or 0))
+            for pk, quantity, cost in apps.get_model('api', model).objects.values_list('pk', quantity_field, cost_field)
+        ]
+    StockSnapshot.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(db_index=True)),
+                ('table', models.CharField(max_length=40)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('quantity', models.FloatField()),
+                ('unit_cost', models.FloatField()),
+            ],
+            options={
+                'ordering': ['-taken_at', 'table', 'object_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=40)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('change', models.FloatField()),
+                ('unit_cost', models.FloatField(help_text='Cost per unit when the movement happened')),
+                ('reason', models.CharField(choices=[('opening', 'New item'), ('restock', 'Delivery'), ('import', 'Bulk import'), ('production', 'Used or made in production'), ('sale', 'Sold'), ('adjustment', 'Manual correction'), ('removal', 'Item deleted')], max_length=10)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['timestamp', 'pk'],
+                'indexes': [models.Index(fields=['timestamp'], name='movement_timestamp_idx'), models.Index(fields=['table', 'object_id', 'timestamp'], name='movement_item_time_idx')],
+            },
+        ),
+        migrations.RunPython(snapshot_opening_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def create_lock_row(apps, schema_editor):
+    """The row every bookkeeping flush locks first, so concurrent first writes cannot both create it"""
+    TableVersion = apps.get_model('api', 'TableVersion')
+    TableVersion.objects.get_or_create(table='api.ChangeLogEntry')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_lock_row, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,36 @@
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, FloatField, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncDay, TruncHour
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from decimal import Decimal
 import datetime
 
+class IngredientQuerySet(models.QuerySet):
+    def low_stock(self):
+        """Ingredients at or below their threshold, read from the partial index on that condition"""
+        return self.filter(LOW_STOCK)
+
+
+# Spelled exactly as the partial index condition so the planner can use it
+LOW_STOCK = Q(quantity__lte=F('min_threshold'))
+
+
 class Ingredient(models.Model):
     name = models.CharField(max_length=100, unique=True)
     quantity = models.FloatField(help_text="Available quantity")
     unit = models.CharField(max_length=20)
     min_threshold = models.FloatField(default=0, help_text="Minimum threshold for low stock warning")
     cost_per_unit = models.DecimalField(max_digits=10, decimal_places=5, default=0)
+
+    objects = IngredientQuerySet.as_manager()
     
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Holds only the low rows, so the low-stock list costs O(low items)
+            models.Index(fields=['name'], condition=LOW_STOCK, name='ingredient_low_stock_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.quantity} {self.unit})"
@@ -22,13 +40,35 @@ class Ingredient(models.Model):
         return self.quantity <= self.min_threshold
 
 
+class RecipeQuerySet(models.QuerySet):
+    def refresh_stock_figures(self):
+        """Recompute the stored cost and max_portions columns in a single UPDATE"""
+        requirements = RecipeIngredient.objects.filter(recipe=OuterRef('pk')).values('recipe')
+        cost = requirements.annotate(
+            total=Sum(F('quantity') * F('ingredient__cost_per_unit'), output_field=FloatField())
+        ).values('total')
+        portions = requirements.filter(quantity__gt=0).annotate(
+            least=Min(F('ingredient__quantity') / F('quantity'), output_field=FloatField())
+        ).values('least')
+        return self.update(
+            cost=Coalesce(Subquery(cost, output_field=FloatField()), 0.0),
+            max_portions=Greatest(Coalesce(Subquery(portions, output_field=FloatField()), 0.0), 0.0),
+        )
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=100, unique=True)
     instructions = models.TextField(blank=True)
     preparation_time = models.IntegerField(default=0, help_text="Preparation time in minutes")
     ingredients = models.ManyToManyField(Ingredient, through='RecipeIngredient')
     image = models.ImageField(upload_to='recipe_images/', null=True, blank=True)
+    # Written by api.images: {'source': image name, size: {'width', 'height', format: path}}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     prepared_quantity = models.FloatField(default=0)  # NEW
+    cost = models.FloatField(default=0, db_index=True, editable=False, help_text="Cost of making this recipe once")
+    max_portions = models.FloatField(default=0, db_index=True, editable=False, help_text="Portions the current ingredient stock allows")
+
+    objects = RecipeQuerySet.as_manager()
     
     class Meta:
         ordering = ['name']
@@ -39,56 +79,71 @@ class Recipe(models.Model):
     @property
     def can_make(self):
         """Check if this recipe can be made with current ingredients"""
-        for requirement in self.recipeingredient_set.all():
-            if requirement.ingredient.quantity < requirement.quantity:
-                return False
-        return True
-    
-    @property
-    def max_portions(self):
-        """Calculate maximum portions that can be made with current ingredients"""
-        if not self.recipeingredient_set.exists():
-            return 0.0
-        
-        portions = []
-        for requirement in self.recipeingredient_set.all():
-            if requirement.quantity <= 0:
-                continue
-                
-            available_portions = requirement.ingredient.quantity / requirement.quantity
-            if available_portions > 0:
-                portions.append(available_portions)
-        
-        if not portions:
-            return 0.0
-        
-        return max(0.0, min(portions))
-    
-    @property
-    def cost(self):
-        """Calculate the cost of making this recipe once"""
-        total_cost = 0
-        for requirement in self.recipeingredient_set.all():
-            total_cost += requirement.quantity * float(requirement.ingredient.cost_per_unit)
-        return total_cost
+        return self.max_portions >= 1
+
+
+class RecipeIngredientQuerySet(models.QuerySet):
+    def apply(self, recipe, quantities):
+        """
+        Make a recipe's requirements match {ingredient_id: quantity} with at
+        most one delete, one bulk_update and one bulk_create, then refresh
+        the recipe's stored figures once. Bulk writes send no signals, so
+        the cache, ETag version and change log are updated here.
+        """
+        from .signals import bulk_write, record_bulk_write
+
+        with transaction.atomic(), bulk_write(RecipeIngredient):
+            existing = {row.ingredient_id: row for row in self.filter(recipe=recipe)}
+            removed = [row.pk for ingredient_id, row in existing.items() if ingredient_id not in quantities]
+            changed = []
+            for ingredient_id, quantity in quantities.items():
+                row = existing.get(ingredient_id)
+                if row is not None and row.quantity != quantity:
+                    row.quantity = quantity
+                    changed.append(row)
+            added = [
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id, quantity=quantity)
+                for ingredient_id, quantity in quantities.items() if ingredient_id not in existing
+            ]
+            if not (removed or changed or added):
+                return
+
+            if removed:
+                self.filter(pk__in=removed).delete()
+            if changed:
+                self.bulk_update(changed, ['quantity'])
+            if added:
+                self.bulk_create(added)
+            Recipe.objects.filter(pk=recipe.pk).refresh_stock_figures()
+            record_bulk_write(RecipeIngredient)
+            # Requirements are synced as part of their recipe
+            record_bulk_write(Recipe, [recipe.pk])
 
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     quantity = models.FloatField()
+
+    objects = RecipeIngredientQuerySet.as_manager()
     
     class Meta:
         unique_together = ('recipe', 'ingredient')
     
     def __str__(self):
         return f"{self.recipe}: {self.quantity} {self.ingredient.unit} of {self.ingredient.name}"
-    
-    def save(self, *args, **kwargs):
-        if not self.id: 
-            self.recipe.prepared_quantity += self.quantity
-            self.recipe.save()
-        super().save(*args, **kwargs)
+
+
+class TimestampedQuerySet(models.QuerySet):
+    def on_dates(self, start_date, end_date):
+        """
+        Rows on local calendar dates start_date..end_date inclusive. Filters
+        on a half-open timestamp range rather than timestamp__date, which
+        wraps the column in a function no index can serve.
+        """
+        start = timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min))
+        return self.filter(timestamp__gte=start, timestamp__lt=end)
 
 
 class ProductionRecord(models.Model):
@@ -96,20 +151,26 @@ class ProductionRecord(models.Model):
     quantity = models.FloatField(default=1)
     timestamp = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True)
+
+    objects = TimestampedQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='production_timestamp_idx'),
+            models.Index(fields=['recipe', 'timestamp'], name='production_recipe_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.quantity} {self.recipe.name}(s) on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
     
     def save(self, *args, **kwargs):
-        if not self.id:  # Only on creation
-            print(f"Before production: {self.recipe.name} prepared_quantity = {self.recipe.prepared_quantity}")
-            self.recipe.prepared_quantity += self.quantity
-            self.recipe.save()
-            print(f"After production: {self.recipe.name} prepared_quantity = {self.recipe.prepared_quantity}")
-        super().save(*args, **kwargs)
+        from . import stock
+
+        with transaction.atomic():
+            if not self.id:  # Only on creation
+                stock.add_prepared({self.recipe_id: self.quantity})
+            super().save(*args, **kwargs)
     
 class Product(models.Model):
     recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
@@ -132,9 +193,10 @@ class Product(models.Model):
     @property
     def profit_margin(self):
         """Calculate profit margin percentage"""
-        if self.cost == 0:
+        cost = self.cost
+        if cost == 0:
             return 100.0
-        return float((self.price - Decimal(self.cost)) / self.price * 100)
+        return float((self.price - Decimal(cost)) / self.price * 100)
     
     @property
     def profit(self):
@@ -142,47 +204,553 @@ class Product(models.Model):
         return float(self.price) - self.cost
 
 
+class SaleQuerySet(TimestampedQuerySet):
+    def capture_costs(self):
+        """
+        Snapshot each sale's recipe cost per portion and its line totals in
+        one UPDATE. Used to backfill rows inserted without them.
+        """
+        recipe_cost = Subquery(Product.objects.filter(pk=OuterRef('product')).values('recipe__cost')[:1])
+        return self.update(
+            unit_cost=recipe_cost,
+            total_price=F('quantity') * F('unit_price'),
+            # The SET clause reads pre-update values, so the cost is looked up again here
+            total_cost=F('quantity') * recipe_cost,
+        )
+
+    def checkout(self, lines):
+        """
+        Record a whole order atomically: each affected recipe is checked and
+        decremented once and the sale rows are inserted with one bulk_create.
+        Lines are dicts with a product id, quantity and optional unit_price.
+        Raises ValidationError keyed by line index if any line cannot be filled.
+        """
+        from . import stock
+        from .signals import record_bulk_write
+
+        with transaction.atomic():
+            products = Product.objects.select_related('recipe').in_bulk({line['product'] for line in lines})
+            errors = {}
+            demand = {}
+            for index, line in enumerate(lines):
+                product = products.get(line['product'])
+                if product is None:
+                    errors[index] = f"Product {line['product']} does not exist."
+                    continue
+                demand[product.recipe_id] = demand.get(product.recipe_id, 0) + line['quantity']
+
+            if errors:
+                raise ValidationError(errors)
+
+            try:
+                stock.take_prepared(demand)
+            except stock.InsufficientStock as e:
+                for index, line in enumerate(lines):
+                    product = products[line['product']]
+                    if product.recipe_id in e.shortfalls:
+                        errors[index] = (
+                            f"Cannot sell {demand[product.recipe_id]} {product.name}(s). "
+                            f"Only {e.shortfalls[product.recipe_id]} prepared."
+                        )
+                raise ValidationError(errors)
+
+            now = timezone.now()
+            sales = self.bulk_create([
+                Sale(
+                    product=products[line['product']],
+                    quantity=line['quantity'],
+                    unit_price=line.get('unit_price') or products[line['product']].price,
+                    timestamp=now,
+                ).capture_costs()
+                for line in lines
+            ])
+            SalesRollup.objects.record(sales)
+            # bulk_create sends no post_save
+            record_bulk_write(Sale, [sale.pk for sale in sales])
+        return sales
+
+    def summarize(self, period):
+        """Group sales into periods (a Trunc expression) with revenue, cost and volume totals"""
+        return (
+            self.annotate(period=period)
+            .values('period')
+            .annotate(
+                total_sales=Sum(F('quantity') * F('unit_price')),
+                cost=Sum('total_cost'),
+                transactions=Count('id'),
+                items_sold=Sum('quantity'),
+            )
+            .order_by('period')
+        )
+
+
 class Sale(models.Model):
     """Individual sale record"""
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.IntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Price at time of sale")
     timestamp = models.DateTimeField(default=timezone.now)
+    # Captured when the sale is recorded so later ingredient price changes
+    # do not rewrite historical profit; older rows are filled in by migration
+    unit_cost = models.FloatField(null=True, blank=True, help_text="Recipe cost per portion at time of sale")
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    total_cost = models.FloatField(null=True, blank=True)
+
+    objects = SaleQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='sale_timestamp_idx'),
+            models.Index(fields=['product', 'timestamp'], name='sale_product_timestamp_idx'),
+        ]
     
     def __str__(self):
         return f"{self.quantity} {self.product.name}(s) @ ${self.unit_price} on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
     
-    @property
-    def total_price(self):
-        return self.quantity * self.unit_price
-    
     @property
     def profit(self):
-        """Calculate total profit for this sale using product's profit per unit"""
-        unit_profit = self.product.profit
-        return float(unit_profit * self.quantity)
+        """Profit on this sale at the cost captured when it was recorded"""
+        if self.total_cost is None:
+            return float(self.product.profit * self.quantity)
+        return float(self.total_price) - self.total_cost
+
+    def capture_costs(self):
+        """Snapshot the recipe's current cost per portion and the line totals"""
+        self.unit_cost = self.product.recipe.cost
+        self.update_totals()
+        return self
+
+    def update_totals(self):
+        self.total_price = self.quantity * Decimal(str(self.unit_price))
+        self.total_cost = self.quantity * self.unit_cost
     
     def save(self, *args, **kwargs):
-        if not self.id:
-            recipe = self.product.recipe
-            print(f"Sale: Current prepared quantity for {recipe.name}: {recipe.prepared_quantity}")
+        from . import stock
 
-            if recipe.prepared_quantity < self.quantity:
-                raise ValidationError({
-                    'quantity': f'Cannot sell {self.quantity} {self.product.name}(s). Only {recipe.prepared_quantity} prepared.'
-                })
+        with transaction.atomic():
+            if not self.id:
+                recipe_id = self.product.recipe_id
+                try:
+                    stock.take_prepared({recipe_id: self.quantity})
+                except stock.InsufficientStock as e:
+                    raise ValidationError({
+                        'quantity': f'Cannot sell {self.quantity} {self.product.name}(s). Only {e.shortfalls[recipe_id]} prepared.'
+                    })
 
-            recipe.prepared_quantity -= self.quantity
-            recipe.save()
-            print(f"Sale: After deduction, prepared quantity for {recipe.name}: {recipe.prepared_quantity}")
+                if not self.unit_price:
+                    self.unit_price = self.product.price
+                self.capture_costs()
 
-            if not self.unit_price:
-                self.unit_price = self.product.price
+                super().save(*args, **kwargs)
+                SalesRollup.objects.record([self])
+            else:
+                previous = Sale.objects.select_related('product__recipe').filter(pk=self.pk).first()
+                if self.unit_cost is None or previous is None or previous.product_id != self.product_id:
+                    self.capture_costs()
+                else:
+                    self.update_totals()
+                super().save(*args, **kwargs)
+                if previous is not None:
+                    SalesRollup.objects.record([previous], sign=-1)
+                SalesRollup.objects.record([self])
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            SalesRollup.objects.record([self], sign=-1)
+            return super().delete(*args, **kwargs)
 
-            super().save(*args, **kwargs)
-        else:
-            super().save(*args, **kwargs)
+
+class SalesRollupQuerySet(models.QuerySet):
+    def record(self, sales, sign=1):
+        """Add sales to (or with sign=-1, remove them from) their hourly and daily buckets"""
+        totals = {}
+        for sale in sales:
+            hour = timezone.localtime(sale.timestamp).replace(minute=0, second=0, microsecond=0)
+            revenue = sign * sale.quantity * Decimal(str(sale.unit_price))
+            cost = sale.total_cost
+            if cost is None:
+                cost = sale.quantity * sale.product.recipe.cost
+            cost *= sign
+            for granularity, bucket in ((SalesRollup.HOUR, hour), (SalesRollup.DAY, hour.replace(hour=0))):
+                row = totals.setdefault((granularity, bucket, sale.product_id), [Decimal(0), 0.0, 0, 0])
+                row[0] += revenue
+                row[1] += cost
+                row[2] += sign
+                row[3] += sign * sale.quantity
+
+        existing = {
+            (rollup.granularity, rollup.bucket, rollup.product_id): rollup
+            for rollup in self.select_for_update().filter(
+                granularity__in={key[0] for key in totals},
+                bucket__in={key[1] for key in totals},
+                product_id__in={key[2] for key in totals},
+            )
+        }
+        updated, missing = [], []
+        for key, (revenue, cost, transactions, items_sold) in totals.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                missing.append(SalesRollup(
+                    granularity=key[0], bucket=key[1], product_id=key[2],
+                    revenue=revenue, cost=cost, profit=float(revenue) - cost,
+                    transactions=transactions, items_sold=items_sold,
+                ))
+                continue
+            rollup.revenue = F('revenue') + revenue
+            rollup.cost = F('cost') + cost
+            rollup.profit = F('profit') + (float(revenue) - cost)
+            rollup.transactions = F('transactions') + transactions
+            rollup.items_sold = F('items_sold') + items_sold
+            updated.append(rollup)
+
+        if updated:
+            self.bulk_update(updated, ['revenue', 'cost', 'profit', 'transactions', 'items_sold'])
+        if missing:
+            try:
+                with transaction.atomic():
+                    self.bulk_create(missing)
+            except IntegrityError:
+                # Another writer created some of these buckets first
+                for rollup in missing:
+                    key = {'granularity': rollup.granularity, 'bucket': rollup.bucket, 'product_id': rollup.product_id}
+                    if not self.filter(**key).update(
+                        revenue=F('revenue') + rollup.revenue,
+                        cost=F('cost') + rollup.cost,
+                        profit=F('profit') + rollup.profit,
+                        transactions=F('transactions') + rollup.transactions,
+                        items_sold=F('items_sold') + rollup.items_sold,
+                    ):
+                        self.create(**key, revenue=rollup.revenue, cost=rollup.cost, profit=rollup.profit,
+                                    transactions=rollup.transactions, items_sold=rollup.items_sold)
+        TableVersion.objects.bump(SalesRollup)
+
+    def rebuild(self):
+        """Recreate every bucket from the full Sale history"""
+        with transaction.atomic():
+            self.all().delete()
+            for granularity, trunc in ((SalesRollup.HOUR, TruncHour), (SalesRollup.DAY, TruncDay)):
+                buckets = (
+                    Sale.objects
+                    .annotate(bucket=trunc('timestamp'))
+                    .values('bucket', 'product')
+                    .annotate(
+                        revenue=Sum(F('quantity') * F('unit_price')),
+                        cost=Sum('total_cost'),
+                        transactions=Count('id'),
+                        items_sold=Sum('quantity'),
+                    )
+                    .order_by()
+                )
+                self.bulk_create(
+                    (
+                        SalesRollup(
+                            granularity=granularity,
+                            bucket=row['bucket'],
+                            product_id=row['product'],
+                            revenue=row['revenue'],
+                            cost=row['cost'] or 0,
+                            profit=float(row['revenue']) - (row['cost'] or 0),
+                            transactions=row['transactions'],
+                            items_sold=row['items_sold'],
+                        )
+                        for row in buckets.iterator()
+                    ),
+                    batch_size=1000,
+                )
+            TableVersion.objects.bump(SalesRollup)
+        return self.count()
+
+
+class SalesRollup(models.Model):
+    """Pre-aggregated sales totals per product for one hour or one day"""
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour or day in local time")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.FloatField(default=0, help_text="Cost of goods sold, taken at the time of each sale")
+    profit = models.FloatField(default=0)
+    transactions = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+
+    objects = SalesRollupQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['bucket']
+        unique_together = ('granularity', 'bucket', 'product')
+
+    def __str__(self):
+        return f"{self.product.name} {self.granularity} of {self.bucket.strftime('%Y-%m-%d %H:%M')}"
+
+
+class TableVersionQuerySet(models.QuerySet):
+    def bump(self, *tables):
+        """Advance the version of each model class given, at the end of the request (see bookkeeping)"""
+        from . import bookkeeping
+
+        bookkeeping.bump(*tables)
+
+    def advance(self, labels):
+        """Advance the given version rows now, locking them until commit; writes use bump()"""
+        if self.filter(table__in=labels).update(version=F('version') + 1) < len(labels):
+            self.bulk_create([TableVersion(table=label, version=1) for label in labels], ignore_conflicts=True)
+
+    def current(self, tables):
+        """{label: version} for the given model classes, in one query"""
+        return dict(self.filter(table__in={table._meta.label for table in tables}).values_list('table', 'version'))
+
+
+class TableVersion(models.Model):
+    """A counter per model that changes whenever any of its rows do, for cheap ETags"""
+    TRACKED = (
+        'api.Ingredient', 'api.Recipe', 'api.RecipeIngredient',
+        'api.ProductionRecord', 'api.Product', 'api.Sale', 'api.SalesRollup',
+    )
+
+    table = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = TableVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+
+class ChangeLogQuerySet(models.QuerySet):
+    def record(self, table, pks, deleted=False):
+        """
+        Log rows of a synced model class and push them to live streams, at
+        the end of the request (see bookkeeping). Other tables, such as
+        sales, are only pushed to streams.
+        """
+        from . import bookkeeping
+
+        if pks:
+            bookkeeping.log(table, pks, deleted)
+
+    def since(self, token):
+        """{label: {object_id: deleted}} for entries after token, latest entry per row winning"""
+        changes = {}
+        for table, object_id, deleted in self.filter(pk__gt=token).order_by('pk').values_list(
+            'table', 'object_id', 'deleted'
+        ):
+            changes.setdefault(table, {})[object_id] = deleted
+        return changes
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only record of rows created, updated or deleted, read by the sync
+    endpoint. The entry id doubles as the client's sync token.
+    """
+    SYNCED = ('api.Ingredient', 'api.Recipe', 'api.Product')
+
+    table = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ChangeLogQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.pk} {'deleted' if self.deleted else 'saved'} {self.table} {self.object_id}"
+
+
+class StockAlertQuerySet(models.QuerySet):
+    def record_crossings(self, ingredient_ids):
+        """
+        Append an alert for each ingredient whose low-stock state differs from
+        its latest alert, i.e. that crossed its threshold since then. One
+        query to compare, one insert if anything crossed.
+        """
+        from . import events
+
+        latest = self.filter(ingredient=OuterRef('pk')).order_by('-pk').values('kind')[:1]
+        ingredients = (
+            Ingredient.objects.filter(pk__in=ingredient_ids)
+            .annotate(low=ExpressionWrapper(LOW_STOCK, output_field=BooleanField()), last=Subquery(latest))
+            .values_list('pk', 'quantity', 'min_threshold', 'low', 'last')
+        )
+        alerts = self.bulk_create([
+            StockAlert(
+                ingredient_id=pk,
+                kind=StockAlert.LOW if low else StockAlert.RECOVERED,
+                quantity=quantity,
+                min_threshold=min_threshold,
+            )
+            for pk, quantity, min_threshold, low, last in ingredients
+            if low != (last == StockAlert.LOW)
+        ])
+        if alerts:
+            events.publish_changes(StockAlert, [alert.pk for alert in alerts])
+        return alerts
+
+
+class StockAlert(models.Model):
+    """Append-only record of an ingredient crossing its min_threshold, in either direction"""
+    LOW = 'low'
+    RECOVERED = 'recovered'
+    KIND_CHOICES = [(LOW, 'Dropped to or below threshold'), (RECOVERED, 'Back above threshold')]
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='stock_alerts')
+    kind = models.CharField(max_length=9, choices=KIND_CHOICES)
+    quantity = models.FloatField(help_text="Quantity right after the crossing")
+    min_threshold = models.FloatField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = StockAlertQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-timestamp']
+
+    def __str__(self):
+        return f"{self.ingredient.name} {self.kind} at {self.quantity}"
+
+
+class StockMovementQuerySet(models.QuerySet):
+    def record(self, model, changes, reason, unit_costs=None):
+        """
+        Append one movement per {pk: signed change} of a stocked model class
+        with a single insert, valued at each row's current unit cost unless
+        unit_costs gives them (e.g. for rows being deleted).
+        """
+        changes = {pk: change for pk, change in changes.items() if change}
+        if not changes:
+            return []
+        label = model._meta.label
+        if unit_costs is None:
+            unit_costs = dict(model.objects.filter(pk__in=changes).values_list('pk', StockMovement.STOCKED[label][1]))
+        now = timezone.now()
+        return self.bulk_create([
+            StockMovement(
+                table=label, object_id=pk, change=change, unit_cost=float(unit_costs.get(pk) or 0),
+                reason=reason, timestamp=now,
+            )
+            for pk, change in changes.items()
+        ])
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of every change to ingredient stock and prepared
+    portions. Together with the latest StockSnapshot it gives the stock on
+    hand at any moment.
+    """
+    # Stocked model label -> (quantity field, unit cost field)
+    STOCKED = {
+        'api.Ingredient': ('quantity', 'cost_per_unit'),
+        'api.Recipe': ('prepared_quantity', 'cost'),
+    }
+    OPENING = 'opening'
+    RESTOCK = 'restock'
+    IMPORT = 'import'
+    PRODUCTION = 'production'
+    SALE = 'sale'
+    ADJUSTMENT = 'adjustment'
+    REMOVAL = 'removal'
+    REASON_CHOICES = [
+        (OPENING, 'New item'),
+        (RESTOCK, 'Delivery'),
+        (IMPORT, 'Bulk import'),
+        (PRODUCTION, 'Used or made in production'),
+        (SALE, 'Sold'),
+        (ADJUSTMENT, 'Manual correction'),
+        (REMOVAL, 'Item deleted'),
+    ]
+
+    table = models.CharField(max_length=40)
+    object_id = models.PositiveBigIntegerField()
+    change = models.FloatField()
+    unit_cost = models.FloatField(help_text="Cost per unit when the movement happened")
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['timestamp', 'pk']
+        indexes = [
+            models.Index(fields=['timestamp'], name='movement_timestamp_idx'),
+            models.Index(fields=['table', 'object_id', 'timestamp'], name='movement_item_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.table}#{self.object_id} {self.change:+} ({self.reason})"
+
+
+class StockSnapshotQuerySet(models.QuerySet):
+    def take(self):
+        """
+        Checkpoint every stocked row. The rows are locked first, so no
+        movement can commit with a timestamp on the wrong side of taken_at.
+        """
+        from django.apps import apps
+
+        with transaction.atomic():
+            rows = []
+            for label, (quantity_field, cost_field) in StockMovement.STOCKED.items():
+                rows += [
+                    (label, pk, quantity, cost)
+                    for pk, quantity, cost in apps.get_model(label).objects.select_for_update()
+                    .order_by('pk').values_list('pk', quantity_field, cost_field)
+                ]
+            now = timezone.now()
+            return self.bulk_create(
+                [
+                    StockSnapshot(
+                        taken_at=now, table=label, object_id=pk, quantity=quantity, unit_cost=float(cost or 0)
+                    )
+                    for label, pk, quantity, cost in rows
+                ],
+                batch_size=1000,
+            )
+
+    def on_hand(self, when):
+        """
+        {(label, pk): (quantity, unit_cost)} at the moment when: the rows of
+        the latest snapshot at or before it, plus the movements after that
+        snapshot, read from the timestamp index. Each row is valued at the
+        cost of its last movement, or its snapshot cost if it has none.
+        """
+        latest = self.filter(taken_at__lte=when).order_by('-taken_at').values('taken_at')[:1]
+        stock = {}
+        taken_at = None
+        for taken_at, table, object_id, quantity, unit_cost in self.filter(taken_at=Subquery(latest)).values_list(
+            'taken_at', 'table', 'object_id', 'quantity', 'unit_cost'
+        ):
+            stock[table, object_id] = [quantity, unit_cost]
+
+        movements = StockMovement.objects.filter(timestamp__lte=when)
+        if taken_at is not None:
+            movements = movements.filter(timestamp__gt=taken_at)
+        for table, object_id, change, unit_cost in movements.order_by('timestamp', 'pk').values_list(
+            'table', 'object_id', 'change', 'unit_cost'
+        ):
+            entry = stock.setdefault((table, object_id), [0.0, unit_cost])
+            entry[0] += change
+            entry[1] = unit_cost
+        return {key: tuple(entry) for key, entry in stock.items()}
+
+
+class StockSnapshot(models.Model):
+    """Stock of every ingredient and prepared recipe at one moment, taken daily by snapshot_stock"""
+    taken_at = models.DateTimeField(db_index=True)
+    table = models.CharField(max_length=40)
+    object_id = models.PositiveBigIntegerField()
+    quantity = models.FloatField()
+    unit_cost = models.FloatField()
+
+    objects = StockSnapshotQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-taken_at', 'table', 'object_id']
+
+    def __str__(self):
+        return f"{self.table}#{self.object_id} = {self.quantity} at {self.taken_at}"
@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CatalogPagination(PageNumberPagination):
+    """Page-number pages for the small, mostly static catalog tables"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class TimestampCursorPagination(CursorPagination):
+    """Stable newest-first pages over append-only history tables"""
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,27 @@
+import csv
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def read_csv(text):
+    """Rows of a CSV document with a header line, blank cells left out"""
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    return [
+        {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        for row in reader
+    ]
+
+
+class CSVParser(BaseParser):
+    """Parses a text/csv body into a list of dicts keyed by the header row"""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return read_csv(stream.read().decode(encoding))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ParseError(f'CSV parse error - {e}')
@@ -0,0 +1,117 @@
+"""
+Recipe x ingredient requirement matrices for planning many recipes at once.
+"""
+import numpy as np
+
+from .models import Ingredient, RecipeIngredient
+
+
+def allocate(requirements, stock, targets, weights=None, tolerance=1e-9):
+    """
+    Pick portions x with 0 <= x <= targets and x @ requirements <= stock.
+
+    Recipes compete for shared ingredients, so their isolated max_portions
+    cannot all be made at once. This fills every recipe towards its target
+    at the same rate, freezing a recipe when it reaches its target or when
+    an ingredient it uses runs out (progressive filling), then rounds down
+    to whole portions and spends what is left on the highest-weighted
+    recipes first. Weights default to the targets themselves.
+    """
+    targets = np.asarray(targets, dtype=float)
+    weights = targets if weights is None else np.asarray(weights, dtype=float)
+    uses = requirements > 0
+    remaining = np.asarray(stock, dtype=float).clip(min=0)
+    fill = np.zeros(len(targets))
+    active = targets > 0
+
+    while active.any():
+        direction = np.where(active, targets, 0.0)
+        rate = direction @ requirements
+        limits = [1 - fill[active]]
+        draining = rate > tolerance
+        if draining.any():
+            limits.append(remaining[draining] / rate[draining])
+        step = min(limit.min() for limit in limits)
+        fill[active] += step
+        remaining = (remaining - step * rate).clip(min=0)
+
+        exhausted = draining & (remaining <= tolerance * np.maximum(rate, 1))
+        active &= fill < 1 - tolerance
+        active &= ~uses[:, exhausted].any(axis=1)
+
+    portions = np.floor(fill * targets + tolerance)
+    remaining = np.asarray(stock, dtype=float) - portions @ requirements
+    for i in np.argsort(-weights, kind='stable'):
+        wanted = targets[i] - portions[i]
+        if wanted < 1:
+            continue
+        row = requirements[i]
+        affordable = np.floor(remaining[uses[i]] / row[uses[i]] + tolerance).min() if uses[i].any() else wanted
+        extra = max(0.0, min(wanted, affordable))
+        portions[i] += extra
+        remaining -= extra * row
+    return portions
+
+
+class RequirementMatrix:
+    """Ingredient needed per portion for a set of recipes, alongside current stock"""
+
+    def __init__(self, recipe_ids, ingredient_ids, requirements, stock):
+        self.recipe_ids = list(recipe_ids)
+        self.ingredient_ids = list(ingredient_ids)
+        self.requirements = requirements  # shape (recipes, ingredients)
+        self.stock = stock  # shape (ingredients,)
+        self.recipe_index = {pk: i for i, pk in enumerate(self.recipe_ids)}
+
+    @classmethod
+    def load(cls, recipe_ids, lock=False):
+        """Build the matrix with one query for requirements and one for stock"""
+        recipe_ids = list(recipe_ids)
+        rows = list(
+            RecipeIngredient.objects
+            .filter(recipe__in=recipe_ids, quantity__gt=0)
+            .values_list('recipe_id', 'ingredient_id', 'quantity')
+        )
+        ingredients = Ingredient.objects.filter(pk__in={row[1] for row in rows}).order_by('pk')
+        if lock:
+            ingredients = ingredients.select_for_update()
+        ingredient_ids, stock = zip(*ingredients.values_list('pk', 'quantity')) if rows else ((), ())
+
+        recipe_index = {pk: i for i, pk in enumerate(recipe_ids)}
+        ingredient_index = {pk: i for i, pk in enumerate(ingredient_ids)}
+        requirements = np.zeros((len(recipe_ids), len(ingredient_ids)))
+        if rows:
+            requirements[
+                [recipe_index[recipe_id] for recipe_id, _, _ in rows],
+                [ingredient_index[ingredient_id] for _, ingredient_id, _ in rows],
+            ] = [quantity for _, _, quantity in rows]
+        return cls(recipe_ids, ingredient_ids, requirements, np.array(stock, dtype=float))
+
+    def portions_vector(self, portions):
+        """Turn {recipe_id: portions} into a vector aligned with recipe_ids"""
+        vector = np.zeros(len(self.recipe_ids))
+        for pk, quantity in portions.items():
+            vector[self.recipe_index[pk]] = quantity
+        return vector
+
+    def needed(self, portions):
+        """Total of each ingredient a plan of {recipe_id: portions} consumes"""
+        return self.portions_vector(portions) @ self.requirements
+
+    def allocate(self, targets, weights=None):
+        """Feasible {recipe_id: portions} for {recipe_id: target portions}"""
+        portions = allocate(
+            self.requirements, self.stock, self.portions_vector(targets),
+            None if weights is None else self.portions_vector(weights),
+        )
+        return dict(zip(self.recipe_ids, portions.tolist()))
+
+    def withdrawals(self, portions):
+        """{ingredient_id: amount} to take from stock, clamped so float rounding never overdraws"""
+        amounts = np.minimum(self.needed(portions), np.maximum(self.stock, 0))
+        return dict(zip(self.ingredient_ids, amounts.tolist()))
+
+    def shortfalls(self, portions):
+        """{ingredient_id: available} for every ingredient the plan overdraws"""
+        short = np.flatnonzero(self.needed(portions) > self.stock + 1e-9)
+        return {self.ingredient_ids[i]: float(self.stock[i]) for i in short}
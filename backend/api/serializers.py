@@ -1,13 +1,47 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale
+from .instrumentation import TimedSerializerMixin
+from .models import Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, StockAlert
 
-class IngredientSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """
+    Restrict GET output to the comma-separated ``?fields=`` list. Fields left
+    out are dropped before serialization, so their (possibly expensive)
+    sources are never evaluated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = request.query_params.get('fields')
+        if not requested:
+            return
+        wanted = {name.strip() for name in requested.split(',')}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class IngredientSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ['id', 'name', 'quantity', 'unit', 'min_threshold', 'cost_per_unit', 'is_low_stock']
 
 
-class RecipeIngredientSerializer(serializers.ModelSerializer):
+class StockAlertSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    ingredient_name = serializers.CharField(source='ingredient.name', read_only=True)
+    ingredient_unit = serializers.CharField(source='ingredient.unit', read_only=True)
+
+    class Meta:
+        model = StockAlert
+        fields = ['id', 'ingredient', 'ingredient_name', 'ingredient_unit', 'kind', 'quantity', 'min_threshold', 'timestamp']
+
+
+class RecipeIngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     ingredient_name = serializers.CharField(source='ingredient.name', read_only=True)
     ingredient_unit = serializers.CharField(source='ingredient.unit', read_only=True)
     
@@ -16,33 +50,45 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'ingredient', 'ingredient_name', 'ingredient_unit', 'quantity']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeRequirementSerializer(serializers.Serializer):
+    """One submitted requirement; ingredients are checked together by RecipeSerializer"""
+    ingredient = serializers.IntegerField()
+    quantity = serializers.FloatField()
+
+
+class RecipeSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     ingredients_detail = RecipeIngredientSerializer(source='recipeingredient_set', many=True, read_only=True)
-    recipe_ingredients = RecipeIngredientSerializer(write_only=True, many=True, required=False)
+    recipe_ingredients = RecipeRequirementSerializer(write_only=True, many=True, required=False)
     cost_per_serving = serializers.FloatField(read_only=True)
     can_make = serializers.BooleanField(read_only=True)
     max_portions = serializers.FloatField(read_only=True)
     cost = serializers.FloatField(read_only=True)
     prepared_quantity = serializers.FloatField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = [
-            'id', 'name', 'instructions', 'preparation_time', 'image',
+            'id', 'name', 'instructions', 'preparation_time', 'image', 'image_variants',
             'ingredients_detail', 'recipe_ingredients',
             'can_make', 'max_portions', 'cost','prepared_quantity','cost_per_serving',
         ]
 
+    def validate_recipe_ingredients(self, items):
+        ingredients = [item['ingredient'] for item in items]
+        if len(set(ingredients)) < len(ingredients):
+            raise serializers.ValidationError("Each ingredient can only be listed once.")
+        missing = set(ingredients) - set(Ingredient.objects.filter(pk__in=ingredients).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Unknown ingredients: {sorted(missing)}")
+        return items
+
     def create(self, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredients', [])
-        recipe = Recipe.objects.create(**validated_data)
-
-        for item in ingredients_data:
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=item['ingredient'],
-                quantity=item['quantity']
-            )
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            RecipeIngredient.objects.apply(recipe, self._quantities(ingredients_data))
+        recipe.refresh_from_db(fields=['cost', 'max_portions'])
         return recipe
 
     def update(self, instance, validated_data):
@@ -51,33 +97,57 @@ class RecipeSerializer(serializers.ModelSerializer):
         instance.instructions = validated_data.get('instructions', instance.instructions)
         instance.preparation_time = validated_data.get('preparation_time', instance.preparation_time)
         instance.image = validated_data.get('image', instance.image)
-        instance.save()
-
+        with transaction.atomic():
+            instance.save(update_fields=['name', 'instructions', 'preparation_time', 'image'])
+            if ingredients_data is not None:
+                RecipeIngredient.objects.apply(instance, self._quantities(ingredients_data))
         if ingredients_data is not None:
-            instance.recipeingredient_set.all().delete()
-            for item in ingredients_data:
-                RecipeIngredient.objects.create(
-                    recipe=instance,
-                    ingredient=item['ingredient'],
-                    quantity=item['quantity']
-                )
+            instance.refresh_from_db(fields=['cost', 'max_portions'])
 
         return instance
+
+    def get_image_variants(self, recipe):
+        """{size: {'width', 'height', format: url}}; empty until the background resize finishes"""
+        request = self.context.get('request')
+        variants = {}
+        for size, entry in recipe.image_variants.items():
+            if size == 'source':
+                continue
+            variants[size] = {
+                key: value if key in ('width', 'height') else self._image_url(request, value)
+                for key, value in entry.items()
+            }
+        return variants
+
+    @staticmethod
+    def _image_url(request, path):
+        url = reverse('recipe-image', args=[path.rsplit('/', 1)[-1]])
+        return request.build_absolute_uri(url) if request is not None else url
+
+    @staticmethod
+    def _quantities(items):
+        return {item['ingredient']: item['quantity'] for item in items}
     
     def to_representation(self, instance):
+        if 'ingredients_detail' in self.fields and 'recipeingredient_set' not in getattr(
+            instance, '_prefetched_objects_cache', {}
+        ):
+            # Created and updated recipes come back without the viewset's prefetch
+            prefetch_related_objects([instance], 'recipeingredient_set__ingredient')
         data = super().to_representation(instance)
-        data['cost_per_serving'] = float(instance.cost or 0)
+        if 'cost_per_serving' in self.fields:
+            data['cost_per_serving'] = float(instance.cost or 0)
         return data
 
 
-class ProductionRecordSerializer(serializers.ModelSerializer):
+class ProductionRecordSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     recipe_name = serializers.CharField(source='recipe.name', read_only=True)
     
     class Meta:
         model = ProductionRecord
         fields = ['id', 'recipe', 'recipe_name', 'quantity', 'timestamp', 'notes']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     recipe_name = serializers.CharField(source='recipe.name', read_only=True)
     cost = serializers.FloatField(read_only=True)
     profit = serializers.FloatField(read_only=True)
@@ -86,8 +156,8 @@ class ProductSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['prepared_quantity'] = instance.recipe.prepared_quantity if instance.recipe else 0
-        print(f"Serializing {instance.name}:", data)
+        if 'prepared_quantity' in self.fields:
+            data['prepared_quantity'] = instance.recipe.prepared_quantity if instance.recipe else 0
         return data
     
     class Meta:
@@ -96,7 +166,78 @@ class ProductSerializer(serializers.ModelSerializer):
                  'is_active', 'cost', 'profit', 'profit_margin', 'prepared_quantity', 'created_at']
 
 
-class SaleSerializer(serializers.ModelSerializer):
+class PrepareLineSerializer(serializers.Serializer):
+    recipe = serializers.IntegerField()
+    quantity = serializers.FloatField()
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Quantity must be greater than zero')
+        return value
+
+
+class PrepareBatchSerializer(serializers.Serializer):
+    items = PrepareLineSerializer(many=True, allow_empty=False)
+
+
+class PlanTargetSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.FloatField(min_value=0)
+
+
+class PlanSerializer(serializers.Serializer):
+    targets = PlanTargetSerializer(many=True, required=False)
+    days = serializers.IntegerField(min_value=1, default=7)
+
+
+class ForecastSerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    days = serializers.IntegerField(min_value=1, max_value=28, default=1)
+    history = serializers.IntegerField(min_value=14, max_value=730, default=364)
+    alpha = serializers.FloatField(min_value=0.01, max_value=0.99, default=0.2)
+
+
+class CheckoutLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
+class CheckoutSerializer(serializers.Serializer):
+    items = CheckoutLineSerializer(many=True, allow_empty=False)
+
+
+class BulkRestockLineSerializer(serializers.Serializer):
+    ingredient = serializers.IntegerField(required=False)
+    name = serializers.CharField(max_length=100, required=False)
+    amount = serializers.FloatField()
+
+    def validate(self, data):
+        if 'ingredient' not in data and 'name' not in data:
+            raise serializers.ValidationError("Give either an ingredient id or a name.")
+        if data['amount'] <= 0:
+            raise serializers.ValidationError({'amount': "Amount must be greater than zero."})
+        return data
+
+
+class BulkRestockSerializer(serializers.Serializer):
+    items = BulkRestockLineSerializer(many=True, allow_empty=False)
+
+
+class IngredientImportLineSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100)
+    unit = serializers.CharField(max_length=20, required=False)
+    quantity = serializers.FloatField(min_value=0, required=False)
+    min_threshold = serializers.FloatField(min_value=0, required=False)
+    cost_per_unit = serializers.DecimalField(max_digits=10, decimal_places=5, min_value=0, required=False)
+
+
+class IngredientImportSerializer(serializers.Serializer):
+    items = IngredientImportLineSerializer(many=True, allow_empty=False)
+
+
+class SaleSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     timestamp = serializers.DateTimeField(read_only=True)
     total_price = serializers.FloatField(read_only=True)
@@ -105,8 +246,8 @@ class SaleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sale
         fields = ['id', 'product', 'product_name', 'quantity', 'unit_price', 
-                 'total_price', 'profit', 'timestamp']
-        read_only_fields = ['product_name', 'total_price', 'profit', 'timestamp']
+                 'total_price', 'unit_cost', 'total_cost', 'profit', 'timestamp']
+        read_only_fields = ['product_name', 'total_price', 'unit_cost', 'total_cost', 'profit', 'timestamp']
 
     def create(self, validated_data):
         product = validated_data.get('product')
@@ -0,0 +1,134 @@
+import contextlib
+import contextvars
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from django.apps import apps
+
+from . import cache, images
+from .models import ChangeLogEntry, Ingredient, Recipe, RecipeIngredient, StockAlert, StockMovement, TableVersion
+from .stock import stock_changed
+
+STOCK_FIGURE_INPUTS = {'quantity', 'cost_per_unit'}
+
+# Models whose per-row bookkeeping is skipped because a bulk write records it once
+_bulk_writes = contextvars.ContextVar('bulk_writes', default=frozenset())
+
+
+@contextlib.contextmanager
+def bulk_write(*models):
+    """
+    Silence the per-row receivers below for models while a bulk path
+    deletes or saves through the ORM; the caller then calls
+    record_bulk_write once for the whole batch.
+    """
+    token = _bulk_writes.set(_bulk_writes.get() | set(models))
+    try:
+        yield
+    finally:
+        _bulk_writes.reset(token)
+
+
+def record_bulk_write(model, pks=(), deleted=False):
+    """
+    What every tracked write needs, for paths that send no signals (bulk_create,
+    bulk_update, queryset update): invalidate cached catalog pages, advance
+    the ETag version and log the rows for sync
+    """
+    cache.invalidate(model)
+    TableVersion.objects.bump(model)
+    ChangeLogEntry.objects.record(model, list(pks), deleted=deleted)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_recipes_using_ingredient(sender, instance, created, update_fields=None, **kwargs):
+    """Keep Recipe.cost and Recipe.max_portions in step with ingredient stock and prices"""
+    if created:
+        return
+    if update_fields is not None and not STOCK_FIGURE_INPUTS.intersection(update_fields):
+        return
+    Recipe.objects.filter(recipeingredient__ingredient=instance).refresh_stock_figures()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(stock_changed, sender=Ingredient)
+def record_threshold_crossings(sender, instance=None, pks=None, **kwargs):
+    StockAlert.objects.record_crossings([instance.pk] if instance is not None else pks)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def refresh_recipe_requirements(sender, instance, **kwargs):
+    if sender in _bulk_writes.get():
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).refresh_stock_figures()
+    # Requirements are synced as part of their recipe
+    ChangeLogEntry.objects.record(Recipe, [instance.recipe_id])
+
+
+@receiver(stock_changed, sender=Ingredient)
+@receiver(stock_changed, sender=Recipe)
+def record_stock_movements(sender, changes=None, reason=None, **kwargs):
+    if changes:
+        StockMovement.objects.record(sender, changes, reason)
+
+
+@receiver(pre_save, sender=Ingredient)
+@receiver(pre_save, sender=Recipe)
+def remember_stored_quantity(sender, instance, update_fields=None, **kwargs):
+    """Read the quantity being overwritten so a manual edit is ledgered as the difference"""
+    field = StockMovement.STOCKED[sender._meta.label][0]
+    if instance._state.adding or (update_fields is not None and field not in update_fields):
+        instance._stored_quantity = None
+    else:
+        instance._stored_quantity = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+def record_saved_stock(sender, instance, created, **kwargs):
+    field, cost_field = StockMovement.STOCKED[sender._meta.label]
+    if created:
+        change, reason = getattr(instance, field), StockMovement.OPENING
+    elif getattr(instance, '_stored_quantity', None) is not None:
+        change, reason = getattr(instance, field) - instance._stored_quantity, StockMovement.ADJUSTMENT
+    else:
+        return
+    StockMovement.objects.record(sender, {instance.pk: change}, reason, {instance.pk: getattr(instance, cost_field)})
+
+
+@receiver(pre_delete, sender=Ingredient)
+@receiver(pre_delete, sender=Recipe)
+def record_removed_stock(sender, instance, **kwargs):
+    """Write off what is stored for the row (the instance may be stale), inside the delete's transaction"""
+    field, cost_field = StockMovement.STOCKED[sender._meta.label]
+    stored = sender.objects.filter(pk=instance.pk).values_list(field, cost_field).first()
+    if stored is not None:
+        StockMovement.objects.record(sender, {instance.pk: -stored[0]}, StockMovement.REMOVAL, {instance.pk: stored[1]})
+
+
+@receiver(post_save, sender=Recipe)
+def queue_image_variants(sender, instance, update_fields=None, **kwargs):
+    """Cut resized copies of a newly uploaded photo in the background"""
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance.image and instance.image.name != instance.image_variants.get('source'):
+        images.schedule(instance.pk)
+    elif not instance.image and instance.image_variants:
+        instance.image_variants = {}
+        Recipe.objects.filter(pk=instance.pk).update(image_variants={})
+
+
+def record_table_change(sender, signal, instance=None, pks=None, **kwargs):
+    if sender in _bulk_writes.get():
+        return
+    record_bulk_write(sender, [instance.pk] if instance is not None else pks, deleted=signal is post_delete)
+
+
+# Connected per model rather than for every sender: a receiver without a
+# sender makes Django load rows one by one for every queryset delete()
+for label in TableVersion.TRACKED:
+    model = apps.get_model(label)
+    for signal in (post_save, post_delete, stock_changed):
+        signal.connect(record_table_change, sender=model, dispatch_uid=f'record_table_change:{label}')
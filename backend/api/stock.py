@@ -0,0 +1,167 @@
+"""
+Stock movements applied as single conditional UPDATEs.
+
+Each call is one UPDATE whose WHERE clause carries a ``quantity >= n``
+guard per row and whose SET uses F() arithmetic, so concurrent terminals
+can never oversell: if any guard fails the statement is rolled back and
+the rows that could not be covered are reported as shortfalls.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.dispatch import Signal
+
+from .models import Ingredient, Recipe, RecipeIngredient, StockMovement
+
+# Queryset updates and bulk writes bypass post_save, so this is sent (sender=
+# model class, pks=list of primary keys, changes={pk: signed change in stock},
+# reason=a StockMovement reason) after every change applied through this module.
+stock_changed = Signal()
+
+
+class InsufficientStock(Exception):
+    """Raised when a decrement cannot be covered; nothing from the call is applied"""
+
+    def __init__(self, shortfalls):
+        # {pk: quantity currently available}
+        self.shortfalls = shortfalls
+        super().__init__(f"Insufficient stock for {sorted(shortfalls)}")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _adjusted(model, field, changes):
+    """A CASE expression adding each row's signed change to its current value"""
+    return Case(
+        *[When(pk=pk, then=F(field) + change) for pk, change in changes.items()],
+        output_field=model._meta.get_field(field),
+    )
+
+
+def _decrement(model, field, amounts, reason):
+    amounts = {pk: amount for pk, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    guard = Q()
+    for pk, amount in amounts.items():
+        guard |= Q(pk=pk, **{f'{field}__gte': amount})
+    try:
+        with transaction.atomic():
+            updated = model.objects.filter(guard).update(
+                **{field: _adjusted(model, field, {pk: -amount for pk, amount in amounts.items()})}
+            )
+            if updated < len(amounts):
+                raise _Rollback
+            stock_changed.send(
+                sender=model, pks=list(amounts), changes={pk: -amount for pk, amount in amounts.items()}, reason=reason
+            )
+    except _Rollback:
+        available = dict(model.objects.filter(pk__in=amounts).values_list('pk', field))
+        raise InsufficientStock({
+            pk: available.get(pk, 0) for pk, amount in amounts.items() if available.get(pk, 0) < amount
+        })
+
+
+def _increment(model, field, amounts, reason):
+    amounts = {pk: amount for pk, amount in amounts.items() if amount}
+    if amounts:
+        model.objects.filter(pk__in=amounts).update(**{field: _adjusted(model, field, amounts)})
+        stock_changed.send(sender=model, pks=list(amounts), changes=amounts, reason=reason)
+
+
+def _refresh_recipes_using(ingredient_ids):
+    Recipe.objects.filter(
+        pk__in=RecipeIngredient.objects.filter(ingredient__in=ingredient_ids).values('recipe')
+    ).refresh_stock_figures()
+
+
+def take_prepared(demand, reason=StockMovement.SALE):
+    """Remove {recipe_id: portions} from prepared stock, all or nothing"""
+    _decrement(Recipe, 'prepared_quantity', demand, reason)
+
+
+def add_prepared(supply, reason=StockMovement.PRODUCTION):
+    """Add {recipe_id: portions} to prepared stock"""
+    _increment(Recipe, 'prepared_quantity', supply, reason)
+
+
+def consume_ingredients(requirements, reason=StockMovement.PRODUCTION):
+    """Remove {ingredient_id: amount} from ingredient stock, all or nothing"""
+    with transaction.atomic():
+        _decrement(Ingredient, 'quantity', requirements, reason)
+        _refresh_recipes_using(list(requirements))
+
+
+def restock_ingredients(deliveries, reason=StockMovement.RESTOCK):
+    """Add {ingredient_id: amount} to ingredient stock"""
+    with transaction.atomic():
+        _increment(Ingredient, 'quantity', deliveries, reason)
+        _refresh_recipes_using(list(deliveries))
+
+
+def import_ingredients(lines):
+    """
+    Upsert ingredients by name in one transaction. Each line is a dict with
+    a name and optional unit, quantity, min_threshold and cost_per_unit.
+    Existing rows get the given attributes overwritten and the quantity
+    added to their stock with F(), all in one bulk UPDATE; new rows are
+    inserted with one bulk_create and start at the quantity given.
+    Returns [(ingredient_id, created)] aligned with lines, or raises
+    ValidationError keyed by line index without applying anything.
+    """
+    attributes = ('unit', 'min_threshold', 'cost_per_unit')
+    with transaction.atomic():
+        existing = {
+            ingredient.name: ingredient
+            for ingredient in Ingredient.objects.select_for_update().filter(name__in={line['name'] for line in lines})
+        }
+        errors = {}
+        first_line = {}
+        for index, line in enumerate(lines):
+            if line['name'] in first_line:
+                errors[index] = f"Duplicate of line {first_line[line['name']]}."
+                continue
+            first_line[line['name']] = index
+            if line['name'] not in existing and not line.get('unit'):
+                errors[index] = f"Unit is required to create {line['name']}."
+        if errors:
+            raise ValidationError(errors)
+
+        updated = []
+        for line in lines:
+            ingredient = existing.get(line['name'])
+            if ingredient is None:
+                continue
+            for field in attributes:
+                if field in line:
+                    setattr(ingredient, field, line[field])
+            ingredient.quantity = F('quantity') + line.get('quantity', 0)
+            updated.append(ingredient)
+        Ingredient.objects.bulk_update(updated, ['quantity', *attributes])
+
+        created = Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=line['name'], quantity=line.get('quantity', 0), **{
+                    field: line[field] for field in attributes if field in line
+                })
+                for line in lines if line['name'] not in existing
+            ],
+            # A concurrent import may insert the same name first; keep its stock
+            update_conflicts=True, unique_fields=['name'], update_fields=list(attributes),
+        )
+        if any(ingredient.pk is None for ingredient in created):
+            pks = dict(Ingredient.objects.filter(name__in=[i.name for i in created]).values_list('name', 'pk'))
+            for ingredient in created:
+                ingredient.pk = pks[ingredient.name]
+
+        ids = {ingredient.name: ingredient.pk for ingredient in [*updated, *created]}
+        stock_changed.send(
+            sender=Ingredient,
+            pks=list(ids.values()),
+            changes={ids[line['name']]: line.get('quantity', 0) for line in lines},
+            reason=StockMovement.IMPORT,
+        )
+        _refresh_recipes_using(list(ids.values()))
+    return [(ids[line['name']], line['name'] not in existing) for line in lines]
@@ -0,0 +1,161 @@
+"""
+Synthetic bakery data at realistic volumes, for load tests and benchmarks.
+
+Everything is written with bulk_create in batches, so no model save()
+or signal runs; derived tables (recipe stock figures, sales rollups,
+table versions) are brought up to date once at the end. The same seed
+always produces the same data.
+"""
+import contextlib
+import datetime
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache
+from .models import (
+    Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, SalesRollup, StockSnapshot, TableVersion,
+)
+
+BASE_INGREDIENTS = [
+    ('Flour', 'g'), ('Butter', 'g'), ('Sugar', 'g'), ('Eggs', 'pcs'), ('Milk', 'ml'), ('Yeast', 'g'),
+    ('Salt', 'g'), ('Cream', 'ml'), ('Chocolate', 'g'), ('Almonds', 'g'), ('Vanilla', 'ml'), ('Honey', 'g'),
+    ('Cinnamon', 'g'), ('Raisins', 'g'), ('Cocoa', 'g'), ('Hazelnuts', 'g'), ('Lemon', 'pcs'), ('Oats', 'g'),
+]
+BASE_RECIPES = [
+    'Croissant', 'Baguette', 'Sourdough', 'Brioche', 'Muffin', 'Scone', 'Danish', 'Eclair', 'Tart',
+    'Focaccia', 'Bagel', 'Cookie', 'Cinnamon Roll', 'Pain au Chocolat', 'Madeleine', 'Rye Loaf',
+]
+
+# Opening hours and how busy each one is
+HOURS = np.arange(6, 20)
+HOUR_WEIGHTS = np.array([2, 6, 9, 7, 5, 6, 9, 8, 5, 4, 4, 5, 4, 2], dtype=float)
+WEEKEND_BOOST = 1.4
+
+BATCH_SIZE = 5000
+
+
+def _batched(count, size=50_000):
+    for start in range(0, count, size):
+        yield min(size, count - start)
+
+
+@contextlib.contextmanager
+def _backdated(model, field='timestamp'):
+    """Let bulk_create keep explicit values for an auto_now_add field"""
+    field = model._meta.get_field(field)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def generate(ingredients=2000, recipes=300, sales=1_000_000, days=365, seed=0, log=None):
+    """Fill an empty catalog and a year of history; returns {label: rows written}"""
+    rng = np.random.default_rng(seed)
+    log = log or (lambda message: None)
+    counts = {}
+
+    with transaction.atomic():
+        names = [BASE_INGREDIENTS[i % len(BASE_INGREDIENTS)] for i in range(ingredients)]
+        ingredient_rows = Ingredient.objects.bulk_create([
+            Ingredient(
+                name=f'{name} {i // len(BASE_INGREDIENTS) + 1:04d}',
+                unit=unit,
+                quantity=float(rng.uniform(5_000, 100_000)),
+                min_threshold=float(rng.uniform(500, 5_000)),
+                cost_per_unit=Decimal(f'{rng.uniform(0.001, 0.02):.5f}'),
+            )
+            for i, (name, unit) in enumerate(names)
+        ], batch_size=BATCH_SIZE)
+        counts['ingredients'] = len(ingredient_rows)
+        log(f"{counts['ingredients']} ingredients")
+
+        recipe_rows = Recipe.objects.bulk_create([
+            Recipe(
+                name=f'{BASE_RECIPES[i % len(BASE_RECIPES)]} {i // len(BASE_RECIPES) + 1:03d}',
+                preparation_time=int(rng.integers(10, 240)),
+                prepared_quantity=float(rng.integers(0, 200)),
+            )
+            for i in range(recipes)
+        ], batch_size=BATCH_SIZE)
+        requirements = []
+        for recipe in recipe_rows:
+            picks = rng.choice(len(ingredient_rows), int(rng.integers(5, 21)), replace=False)
+            requirements += [
+                RecipeIngredient(recipe=recipe, ingredient=ingredient_rows[pick], quantity=float(quantity))
+                for pick, quantity in zip(picks, rng.lognormal(3.5, 0.8, len(picks)).round(1))
+            ]
+        RecipeIngredient.objects.bulk_create(requirements, batch_size=BATCH_SIZE)
+        Recipe.objects.refresh_stock_figures()
+        counts['recipes'], counts['recipe ingredients'] = len(recipe_rows), len(requirements)
+        log(f"{counts['recipes']} recipes, {counts['recipe ingredients']} recipe ingredients")
+
+        costs = dict(Recipe.objects.values_list('pk', 'cost'))
+        products = Product.objects.bulk_create([
+            Product(
+                recipe=recipe,
+                name=recipe.name,
+                price=Decimal(f'{max(0.5, costs[recipe.pk] * rng.uniform(2.5, 4)):.2f}'),
+            )
+            for recipe in recipe_rows
+        ], batch_size=BATCH_SIZE)
+        counts['products'] = len(products)
+
+        # A few best sellers and a long tail
+        popularity = 1 / np.arange(1, len(products) + 1) ** 0.8
+        popularity = rng.permutation(popularity / popularity.sum())
+        start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=days)
+        weekdays = np.array([(start + datetime.timedelta(days=d)).weekday() for d in range(days)])
+        day_weights = np.where(weekdays >= 5, WEEKEND_BOOST, 1.0)
+        day_weights /= day_weights.sum()
+
+        def timestamps(size):
+            offsets = (
+                rng.choice(days, size, p=day_weights) * 86400
+                + rng.choice(HOURS, size, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum()) * 3600
+                + rng.uniform(0, 3600, size)
+            )
+            return [start + datetime.timedelta(seconds=float(offset)) for offset in offsets]
+
+        counts['sales'] = 0
+        for size in _batched(sales):
+            picks = rng.choice(len(products), size, p=popularity)
+            quantities = rng.choice([1, 1, 1, 2, 2, 3, 6], size)
+            Sale.objects.bulk_create(
+                (
+                    Sale(product=products[pick], quantity=int(quantity), unit_price=products[pick].price, timestamp=when)
+                    for pick, quantity, when in zip(picks, quantities, timestamps(size))
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            counts['sales'] += size
+            log(f"{counts['sales']} sales")
+        Sale.objects.capture_costs()
+
+        # Roughly one batch baked for every 25 sales
+        productions = max(1, sales // 25)
+        picks = rng.choice(len(products), productions, p=popularity)
+        with _backdated(ProductionRecord):
+            ProductionRecord.objects.bulk_create(
+                (
+                    ProductionRecord(recipe=recipe_rows[pick], quantity=float(quantity), timestamp=when)
+                    for pick, quantity, when in zip(picks, rng.integers(10, 50, productions), timestamps(productions))
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        counts['production records'] = productions
+
+        counts['sales rollups'] = SalesRollup.objects.rebuild()
+        log(f"{counts['sales rollups']} sales rollup buckets")
+        # Rows were bulk inserted without ledger entries; start the ledger from here
+        StockSnapshot.objects.take()
+
+        tracked = [Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, SalesRollup]
+        TableVersion.objects.bump(*tracked)
+        for model in tracked:
+            cache.invalidate(model)
+    return counts
@@ -1,3 +1,1450 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import math
+import re
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import events, images, stock
+from .instrumentation import registry
+from .models import (
+    ChangeLogEntry, Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, SalesRollup, StockAlert,
+    StockMovement, StockSnapshot, TableVersion,
+)
+from .forecasting import fit
+from .planning import allocate
+from .synthetic import generate
+
+
+def make_catalog():
+    """A two-ingredient recipe costing 0.70 per portion, sold at 2.50"""
+    flour = Ingredient.objects.create(name='Flour', quantity=1000, unit='g', cost_per_unit=Decimal('0.002'))
+    butter = Ingredient.objects.create(name='Butter', quantity=500, unit='g', cost_per_unit=Decimal('0.01'))
+    recipe = Recipe.objects.create(name='Croissant')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity=100)
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=butter, quantity=50)
+    Recipe.objects.filter(pk=recipe.pk).update(prepared_quantity=10000)
+    recipe.refresh_from_db()
+    product = Product.objects.create(recipe=recipe, name='Croissant', price=Decimal('2.50'))
+    return product
+
+
+def record_sale(product, quantity, when):
+    return Sale.objects.bulk_create([
+        Sale(product=product, quantity=quantity, unit_price=product.price, timestamp=when).capture_costs()
+    ])[0]
+
+
+class SaleReportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.start = timezone.make_aware(datetime.datetime(2025, 3, 3, 12, 0))  # a Monday
+
+    def report(self, period, start, end):
+        return self.client.get('/api/sales/report/', {
+            'period': period,
+            'start_date': start.strftime('%Y-%m-%d'),
+            'end_date': end.strftime('%Y-%m-%d'),
+        })
+
+    def test_daily_totals(self):
+        record_sale(self.product, 2, self.start)
+        record_sale(self.product, 1, self.start + datetime.timedelta(hours=1))
+
+        response = self.report('day', self.start, self.start)
+
+        self.assertEqual(response.status_code, 200)
+        [row] = response.data['data']
+        self.assertEqual(row['period'], '2025-03-03')
+        self.assertEqual(row['transactions'], 2)
+        self.assertEqual(row['items_sold'], 3)
+        self.assertAlmostEqual(row['total_sales'], 7.5)
+        self.assertAlmostEqual(row['cost'], 2.1)
+        self.assertAlmostEqual(row['profit'], 5.4)
+
+    def test_date_range_is_inclusive_of_the_whole_end_day(self):
+        day = self.start.replace(hour=0)
+        record_sale(self.product, 1, day - datetime.timedelta(microseconds=1))
+        record_sale(self.product, 2, day)
+        record_sale(self.product, 3, day + datetime.timedelta(days=1, microseconds=-1))
+        record_sale(self.product, 4, day + datetime.timedelta(days=1))
+
+        [row] = self.report('day', self.start, self.start).data['data']
+        self.assertEqual(row['items_sold'], 5)
+
+    def test_date_range_uses_timestamp_indexes(self):
+        day = self.start.date()
+        self.assertIn('sale_timestamp_idx', Sale.objects.on_dates(day, day).explain())
+        self.assertIn(
+            'sale_product_timestamp_idx',
+            Sale.objects.on_dates(day, day).filter(product=self.product).explain(),
+        )
+
+    def test_week_and_month_periods_cover_every_day(self):
+        for offset in range(10):
+            record_sale(self.product, 1, self.start + datetime.timedelta(days=offset))
+        end = self.start + datetime.timedelta(days=9)
+
+        weeks = self.report('week', self.start, end).data['data']
+        self.assertEqual([row['transactions'] for row in weeks], [7, 3])
+        self.assertAlmostEqual(weeks[0]['cost'], 7 * 0.7)
+
+        [month] = self.report('month', self.start, end).data['data']
+        self.assertEqual(month['transactions'], 10)
+        self.assertAlmostEqual(month['cost'], 10 * 0.7)
+
+    def test_query_count_is_independent_of_range(self):
+        for offset in range(90):
+            record_sale(self.product, 1, self.start + datetime.timedelta(days=offset))
+
+        counts = []
+        for days in (1, 7, 90):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.report('day', self.start, self.start + datetime.timedelta(days=days - 1))
+            self.assertEqual(len(response.data['data']), days)
+            counts.append(len(queries))
+
+        self.assertEqual(counts, [1, 1, 1])
+
+    def test_invalid_period(self):
+        response = self.report('year', self.start, self.start)
+        self.assertEqual(response.status_code, 400)
+
+
+class SaleCostSnapshotTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def test_price_changes_do_not_rewrite_past_profit(self):
+        response = self.client.post(
+            '/api/sales/', {'product': self.product.pk, 'quantity': 2, 'unit_price': '2.50'}, format='json'
+        )
+        self.assertEqual((response.data['unit_cost'], response.data['total_cost']), (0.7, 1.4))
+
+        butter = Ingredient.objects.get(name='Butter')
+        butter.cost_per_unit = Decimal('0.05')
+        butter.save()
+
+        sale = Sale.objects.get()
+        self.assertAlmostEqual(sale.profit, 3.6)
+        today = timezone.localdate().isoformat()
+        [row] = self.client.get(
+            '/api/sales/report/', {'period': 'day', 'start_date': today, 'end_date': today}
+        ).data['data']
+        self.assertAlmostEqual(row['cost'], 1.4)
+
+    def test_backfill_command(self):
+        Sale.objects.bulk_create([Sale(product=self.product, quantity=3, unit_price=Decimal('2.00'))])
+        call_command('backfill_sale_costs', stdout=io.StringIO())
+
+        sale = Sale.objects.get()
+        self.assertEqual(sale.total_price, Decimal('6.00'))
+        self.assertAlmostEqual(sale.total_cost, 2.1)
+        self.assertAlmostEqual(sale.profit, 3.9)
+        self.assertFalse(ChangeLogEntry.objects.filter(table='api.Sale').exists())
+
+
+class RecipeStockFigureTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.recipe = make_catalog().recipe
+        self.flour = Ingredient.objects.get(name='Flour')
+        self.butter = Ingredient.objects.get(name='Butter')
+
+    def figures(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.cost, self.recipe.max_portions
+
+    def test_figures_follow_ingredient_changes(self):
+        self.assertEqual(self.figures(), (0.7, 10.0))
+
+        self.butter.cost_per_unit = Decimal('0.02')
+        self.butter.quantity = 100
+        self.butter.save()
+        self.assertEqual(self.figures(), (1.2, 2.0))
+
+        self.flour.quantity = 0
+        self.flour.save()
+        self.assertEqual(self.figures(), (1.2, 0.0))
+        self.assertFalse(self.recipe.can_make)
+
+    def test_figures_follow_requirement_changes(self):
+        requirement = RecipeIngredient.objects.get(recipe=self.recipe, ingredient=self.butter)
+        requirement.quantity = 25
+        requirement.save()
+        self.assertEqual(self.figures(), (0.45, 10.0))
+
+        requirement.delete()
+        self.assertEqual(self.figures(), (0.2, 10.0))
+
+        self.flour.delete()
+        self.assertEqual(self.figures(), (0.0, 0.0))
+
+    def test_recipe_create_returns_stored_figures(self):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Shortbread',
+            'recipe_ingredients': [
+                {'ingredient': self.flour.pk, 'quantity': 200},
+                {'ingredient': self.butter.pk, 'quantity': 100},
+            ],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertAlmostEqual(response.data['cost'], 1.4)
+        self.assertEqual(response.data['max_portions'], 5.0)
+        self.assertTrue(response.data['can_make'])
+
+    def test_recipe_update_applies_only_the_differences(self):
+        sugar = Ingredient.objects.create(name='Sugar', quantity=1000, unit='g', cost_per_unit=Decimal('0.001'))
+        flour_row = RecipeIngredient.objects.get(recipe=self.recipe, ingredient=self.flour)
+
+        response = self.client.patch(f'/api/recipes/{self.recipe.pk}/', {'recipe_ingredients': [
+            {'ingredient': self.flour.pk, 'quantity': 100},
+            {'ingredient': sugar.pk, 'quantity': 50},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.data['cost'], 0.25)
+        self.assertEqual(
+            sorted(row['ingredient_name'] for row in response.data['ingredients_detail']), ['Flour', 'Sugar']
+        )
+        # Unchanged rows are kept, and adding requirements leaves prepared stock alone
+        self.assertTrue(RecipeIngredient.objects.filter(pk=flour_row.pk, quantity=100).exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.prepared_quantity, 10000)
+
+    def test_recipe_update_rejects_repeated_ingredients(self):
+        response = self.client.patch(f'/api/recipes/{self.recipe.pk}/', {'recipe_ingredients': [
+            {'ingredient': self.flour.pk, 'quantity': 100},
+            {'ingredient': self.flour.pk, 'quantity': 50},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_recipe_update_query_count_is_independent_of_ingredient_count(self):
+        spices = [
+            Ingredient.objects.create(name=f'Spice {n}', quantity=100, unit='g', cost_per_unit=Decimal('0.1'))
+            for n in range(20)
+        ]
+
+        def queries_for(ingredients, quantity):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.put(f'/api/recipes/{self.recipe.pk}/', {
+                    'name': 'Croissant',
+                    'recipe_ingredients': [{'ingredient': i.pk, 'quantity': quantity} for i in ingredients],
+                }, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        # Each call removes, changes and adds rows
+        small = queries_for([self.flour, *spices[:2]], 5)
+        few_removed = queries_for([self.flour, self.butter], 1)
+        large = queries_for([self.flour, *spices], 6)
+        self.assertEqual(small, large)
+        self.assertEqual(RecipeIngredient.objects.filter(recipe=self.recipe).count(), 21)
+        # Deleting twenty requirements costs no more than deleting two
+        self.assertEqual(few_removed, queries_for([self.flour, self.butter], 2))
+
+    def test_recipe_list_query_count_is_independent_of_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/recipes/')
+        for n in range(10):
+            recipe = Recipe.objects.create(name=f'Roll {n}')
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=self.flour, quantity=10)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=self.butter, quantity=5)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/recipes/')
+
+        self.assertEqual(response.data['count'], 11)
+        self.assertEqual(len(small), len(large))
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def sell(self, quantity, when=None):
+        return Sale.objects.create(
+            product=self.product, quantity=quantity, unit_price=self.product.price,
+            timestamp=when or timezone.now(),
+        )
+
+    def test_sales_are_added_to_hour_and_day_buckets(self):
+        self.sell(2)
+        self.sell(1)
+
+        for granularity in (SalesRollup.HOUR, SalesRollup.DAY):
+            rollup = SalesRollup.objects.get(granularity=granularity)
+            self.assertEqual(rollup.revenue, Decimal('7.50'))
+            self.assertAlmostEqual(rollup.cost, 2.1)
+            self.assertAlmostEqual(rollup.profit, 5.4)
+            self.assertEqual(rollup.transactions, 2)
+            self.assertEqual(rollup.items_sold, 3)
+
+    def test_edits_and_deletes_are_reversed(self):
+        sale = self.sell(2)
+        sale.quantity = 4
+        sale.save()
+        self.sell(1).delete()
+
+        rollup = SalesRollup.objects.get(granularity=SalesRollup.DAY)
+        self.assertEqual(rollup.revenue, Decimal('10.00'))
+        self.assertEqual(rollup.transactions, 1)
+        self.assertEqual(rollup.items_sold, 4)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        now = timezone.now()
+        for days_ago in (0, 0, 1, 3, 9):
+            self.sell(days_ago + 1, now - datetime.timedelta(days=days_ago))
+        incremental = sorted(SalesRollup.objects.values_list(
+            'granularity', 'bucket', 'revenue', 'transactions', 'items_sold'))
+
+        SalesRollup.objects.rebuild()
+
+        rebuilt = sorted(SalesRollup.objects.values_list(
+            'granularity', 'bucket', 'revenue', 'transactions', 'items_sold'))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_dashboard_reads_rollups(self):
+        now = timezone.now()
+        self.sell(2, now)
+        self.sell(1, now - datetime.timedelta(days=3))
+        self.sell(5, now - datetime.timedelta(days=30))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/sales/dashboard/')
+
+        self.assertEqual(response.status_code, 200)
+        # ETag version lookup, then day and hour rollups
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(response.data['today']['transactions'], 1)
+        self.assertAlmostEqual(response.data['today']['revenue'], 5.0)
+        self.assertAlmostEqual(response.data['today']['profit'], 3.6)
+        self.assertEqual(response.data['week']['transactions'], 2)
+        self.assertAlmostEqual(response.data['week']['revenue'], 7.5)
+        self.assertEqual(len(response.data['chart_data']), 2)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.recipe = self.product.recipe
+        Recipe.objects.filter(pk=self.recipe.pk).update(prepared_quantity=5)
+        self.muffin = Product.objects.create(
+            recipe=Recipe.objects.create(name='Muffin', prepared_quantity=3), name='Muffin', price=Decimal('1.75'),
+        )
+
+    def checkout(self, items):
+        return self.client.post('/api/sales/checkout/', {'items': items}, format='json')
+
+    def test_records_every_line(self):
+        response = self.checkout([
+            {'product': self.product.pk, 'quantity': 2},
+            {'product': self.muffin.pk, 'quantity': 3, 'unit_price': '1.50'},
+            {'product': self.product.pk, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['ok'] * 3)
+        self.assertEqual(response.data['lines'][1]['sale']['unit_price'], '1.50')
+        self.assertEqual(Sale.objects.count(), 3)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.prepared_quantity, 2)
+        self.assertEqual(SalesRollup.objects.get(granularity=SalesRollup.DAY, product=self.product).items_sold, 3)
+
+    def test_lines_for_the_same_recipe_share_its_stock(self):
+        response = self.checkout([
+            {'product': self.product.pk, 'quantity': 3},
+            {'product': self.muffin.pk, 'quantity': 1},
+            {'product': self.product.pk, 'quantity': 3},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['error', 'ok', 'error'])
+        self.assertFalse(Sale.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.prepared_quantity, 5)
+
+    def test_unknown_product(self):
+        response = self.checkout([{'product': 999, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['lines'][0]['status'], 'error')
+
+    def test_query_count_is_independent_of_cart_size(self):
+        def queries_for(lines):
+            Recipe.objects.update(prepared_quantity=100)
+            SalesRollup.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.checkout(lines).status_code, 201)
+            return len(queries)
+
+        small = queries_for([{'product': self.product.pk, 'quantity': 1}, {'product': self.muffin.pk, 'quantity': 1}])
+        large = queries_for([{'product': self.product.pk, 'quantity': 1}, {'product': self.muffin.pk, 'quantity': 1}] * 10)
+        self.assertEqual(small, large)
+
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.recipe = self.product.recipe
+        self.flour = Ingredient.objects.get(name='Flour')
+        self.butter = Ingredient.objects.get(name='Butter')
+
+    def test_shortfall_leaves_stock_untouched(self):
+        with self.assertRaises(stock.InsufficientStock) as raised:
+            stock.consume_ingredients({self.flour.pk: 500, self.butter.pk: 600})
+
+        self.assertEqual(raised.exception.shortfalls, {self.butter.pk: 500})
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.quantity, 1000)
+
+    def test_sale_beyond_prepared_stock_is_rejected(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(prepared_quantity=1)
+
+        with self.assertRaises(ValidationError):
+            Sale.objects.create(product=self.product, quantity=2, unit_price=self.product.price)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.prepared_quantity, 1)
+
+    def test_prepare_consumes_ingredients_and_adds_portions_once(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(prepared_quantity=0)
+
+        response = self.client.post(f'/api/recipes/{self.recipe.pk}/prepare/', {'quantity': 4}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.flour.refresh_from_db()
+        self.assertEqual(self.recipe.prepared_quantity, 4)
+        self.assertEqual(self.recipe.max_portions, 6)
+        self.assertEqual(self.flour.quantity, 600)
+        self.assertEqual(ProductionRecord.objects.get().quantity, 4)
+
+    def test_restock(self):
+        response = self.client.post(f'/api/ingredients/{self.butter.pk}/restock/', {'amount': 500}, format='json')
+
+        self.assertEqual(response.data['quantity'], 1000)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.max_portions, 10)
+
+
+class BulkIngredientTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.recipe = make_catalog().recipe
+        self.flour = Ingredient.objects.get(name='Flour')
+        self.butter = Ingredient.objects.get(name='Butter')
+
+    def test_bulk_restock_by_id_and_name(self):
+        response = self.client.post('/api/ingredients/bulk-restock/', {'items': [
+            {'ingredient': self.butter.pk, 'amount': 200},
+            {'name': 'Flour', 'amount': 500},
+            {'name': 'Butter', 'amount': 300},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['restocked'] * 3)
+        self.assertEqual(response.data['lines'][0]['ingredient']['quantity'], 1000)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.max_portions, 15)
+
+    def test_bulk_restock_rejects_the_whole_batch(self):
+        response = self.client.post('/api/ingredients/bulk-restock/', [
+            {'name': 'Flour', 'amount': 500},
+            {'name': 'Sugar', 'amount': 100},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['ok', 'error'])
+
+        response = self.client.post('/api/ingredients/bulk-restock/', [
+            {'name': 'Flour', 'amount': 500},
+            {'name': 'Butter', 'amount': -1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['lines'][1]['errors'], ['amount: Amount must be greater than zero.'])
+
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.quantity, 1000)
+
+    def test_csv_import_creates_and_adds_to_existing_stock(self):
+        body = 'name,unit,quantity,min_threshold,cost_per_unit\nButter,,250,100,0.02\nSugar,g,800,,0.001\n'
+        response = self.client.post('/api/ingredients/import/', body, content_type='text/csv')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['updated', 'created'])
+        self.butter.refresh_from_db()
+        self.assertEqual((self.butter.quantity, self.butter.unit, self.butter.min_threshold), (750, 'g', 100))
+        self.assertEqual(Ingredient.objects.get(name='Sugar').quantity, 800)
+        self.recipe.refresh_from_db()
+        self.assertAlmostEqual(self.recipe.cost, 1.2)
+        self.assertTrue(ChangeLogEntry.objects.filter(object_id=self.butter.pk).exists())
+
+    def test_json_and_file_imports(self):
+        response = self.client.post('/api/ingredients/import/', {'items': [{'name': 'Eggs', 'unit': 'pcs', 'quantity': 12}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        upload = SimpleUploadedFile('delivery.csv', b'name,quantity\nEggs,6\n', content_type='text/csv')
+        response = self.client.post('/api/ingredients/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Ingredient.objects.get(name='Eggs').quantity, 18)
+
+    def test_import_reports_each_bad_line(self):
+        response = self.client.post('/api/ingredients/import/', [
+            {'name': 'Sugar', 'quantity': 5},
+            {'name': 'Flour', 'quantity': 5},
+            {'name': 'Flour', 'quantity': 5},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([line['status'] for line in response.data['lines']], ['error', 'ok', 'error'])
+        self.assertFalse(Ingredient.objects.filter(name='Sugar').exists())
+
+    def test_malformed_batches_are_plain_400s(self):
+        for url in ('/api/ingredients/bulk-restock/', '/api/ingredients/import/'):
+            for body in ({}, {'items': None}, 'Flour'):
+                response = self.client.post(url, body, format='json')
+                self.assertEqual(response.status_code, 400, (url, body))
+                self.assertNotIn('lines', response.data)
+
+    def test_import_query_count_is_independent_of_batch_size(self):
+        def queries_for(count):
+            lines = [{'name': f'Spice {i}', 'unit': 'g', 'quantity': 1} for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post('/api/ingredients/import/', lines, format='json').status_code, 200)
+            return len(queries)
+
+        queries_for(20)
+        self.assertEqual(queries_for(2), queries_for(20))
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.day = timezone.make_aware(datetime.datetime(2025, 3, 3, 9, 0))
+        with self.at(0):
+            self.product = make_catalog()
+        self.recipe = self.product.recipe
+        self.flour = Ingredient.objects.get(name='Flour')
+        self.butter = Ingredient.objects.get(name='Butter')
+
+    def at(self, hours):
+        return mock.patch('django.utils.timezone.now', return_value=self.day + datetime.timedelta(hours=hours))
+
+    def movements(self, **filters):
+        return list(StockMovement.objects.filter(**filters).values_list('table', 'object_id', 'change', 'reason'))
+
+    def test_every_movement_is_ledgered(self):
+        self.client.post(f'/api/recipes/{self.recipe.pk}/prepare/', {'quantity': 2}, format='json')
+        self.client.post('/api/sales/checkout/', {'items': [{'product': self.product.pk, 'quantity': 3}]}, format='json')
+        self.client.patch(f'/api/ingredients/{self.butter.pk}/', {'quantity': 450}, format='json')
+        flour = self.flour.pk
+        self.flour.delete()
+
+        self.assertEqual(self.movements(reason=StockMovement.OPENING), [
+            ('api.Ingredient', flour, 1000, 'opening'), ('api.Ingredient', self.butter.pk, 500, 'opening'),
+        ])
+        self.assertEqual(self.movements(reason__in=['production', 'sale']), [
+            ('api.Ingredient', flour, -200, 'production'), ('api.Ingredient', self.butter.pk, -100, 'production'),
+            ('api.Recipe', self.recipe.pk, 2, 'production'), ('api.Recipe', self.recipe.pk, -3, 'sale'),
+        ])
+        self.assertEqual(self.movements(reason__in=['adjustment', 'removal']), [
+            ('api.Ingredient', self.butter.pk, 50, 'adjustment'), ('api.Ingredient', flour, -800, 'removal'),
+        ])
+
+    def test_direct_recipe_edits_are_ledgered(self):
+        self.recipe.refresh_from_db()
+        self.recipe.prepared_quantity = 9990
+        self.recipe.save()
+        self.recipe.instructions = 'No change in stock'
+        self.recipe.save()
+
+        self.assertEqual(self.movements(table='api.Recipe', reason=StockMovement.ADJUSTMENT), [
+            ('api.Recipe', self.recipe.pk, -10, 'adjustment'),
+        ])
+
+    def test_point_in_time_stock_from_snapshot_and_later_movements(self):
+        with self.at(2):
+            StockSnapshot.objects.take()
+        with self.at(24):
+            stock.restock_ingredients({self.butter.pk: 500})
+        with self.at(48):
+            stock.consume_ingredients({self.flour.pk: 300})
+        # A stray row older than the snapshot proves it is not replayed again
+        StockMovement.objects.create(
+            table='api.Ingredient', object_id=self.flour.pk, change=5, unit_cost=0, reason='adjustment',
+            timestamp=self.day + datetime.timedelta(hours=1),
+        )
+
+        def on_hand(hours):
+            stock_at = StockSnapshot.objects.on_hand(self.day + datetime.timedelta(hours=hours))
+            return stock_at[('api.Ingredient', self.flour.pk)][0], stock_at[('api.Ingredient', self.butter.pk)][0]
+
+        self.assertEqual(on_hand(0.5), (1000, 500))
+        self.assertEqual(on_hand(30), (1000, 1000))
+        with self.assertNumQueries(2):
+            self.assertEqual(on_hand(50), (700, 1000))
+
+    def test_stock_on_hand_endpoint_values_stock(self):
+        with self.at(24):
+            stock.restock_ingredients({self.butter.pk: 500})
+
+        response = self.client.get('/api/stock-on-hand/', {'date': '2025-03-03'})
+        self.assertEqual([(row['name'], row['quantity']) for row in response.data['ingredients']], [
+            ('Flour', 1000), ('Butter', 500),
+        ])
+        self.assertAlmostEqual(response.data['total_value'], 7.0)
+
+        response = self.client.get('/api/stock-on-hand/', {'at': '2025-03-04T12:00:00'})
+        self.assertAlmostEqual(response.data['total_value'], 12.0)
+        self.assertEqual(self.client.get('/api/stock-on-hand/', {'date': 'monday'}).status_code, 400)
+
+
+class ConcurrentSaleTests(TransactionTestCase):
+    terminals = 8
+    attempts_per_terminal = 10
+
+    def test_concurrent_sales_never_oversell(self):
+        product = make_catalog()
+        Recipe.objects.filter(pk=product.recipe_id).update(prepared_quantity=25)
+        sold = []
+        rejected = []
+
+        def terminal():
+            try:
+                for _ in range(self.attempts_per_terminal):
+                    while True:
+                        try:
+                            Sale.objects.create(product_id=product.pk, quantity=1, unit_price=product.price)
+                            sold.append(1)
+                        except ValidationError:
+                            rejected.append(1)
+                        except OperationalError:
+                            continue  # database busy, retry
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=terminal) for _ in range(self.terminals)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(sold), 25)
+        self.assertEqual(len(rejected), self.terminals * self.attempts_per_terminal - 25)
+        self.assertEqual(Sale.objects.count(), 25)
+        self.assertEqual(Recipe.objects.get(pk=product.recipe_id).prepared_quantity, 0)
+
+
+class PrepareBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.croissant = make_catalog().recipe
+        self.flour = Ingredient.objects.get(name='Flour')
+        self.butter = Ingredient.objects.get(name='Butter')
+        self.scone = Recipe.objects.create(name='Scone')
+        RecipeIngredient.objects.create(recipe=self.scone, ingredient=self.flour, quantity=200)
+        Recipe.objects.update(prepared_quantity=0)
+
+    def prepare(self, items):
+        return self.client.post('/api/recipes/prepare-batch/', {'items': items}, format='json')
+
+    def test_prepares_every_recipe(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.prepare([
+                {'recipe': self.croissant.pk, 'quantity': 4},
+                {'recipe': self.scone.pk, 'quantity': 2, 'notes': 'morning'},
+                {'recipe': self.croissant.pk, 'quantity': 1},
+            ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['productions']), 3)
+        self.flour.refresh_from_db()
+        self.butter.refresh_from_db()
+        self.assertEqual(self.flour.quantity, 1000 - 5 * 100 - 2 * 200)
+        self.assertEqual(self.butter.quantity, 500 - 5 * 50)
+        self.assertEqual(
+            dict(Recipe.objects.values_list('name', 'prepared_quantity')),
+            {'Croissant': 5, 'Scone': 2},
+        )
+        self.assertEqual(Recipe.objects.get(pk=self.croissant.pk).max_portions, 1)
+
+        with CaptureQueriesContext(connection) as more:
+            self.assertEqual(self.prepare([{'recipe': self.croissant.pk, 'quantity': 0.1}] * 10).status_code, 200)
+        self.assertEqual(len(queries), len(more))
+
+    def test_infeasible_plan_changes_nothing(self):
+        response = self.prepare([
+            {'recipe': self.croissant.pk, 'quantity': 6},
+            {'recipe': self.scone.pk, 'quantity': 3},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['shortfalls'], [
+            {'ingredient': self.flour.pk, 'ingredient_name': 'Flour', 'needed': 1200.0, 'available': 1000.0},
+        ])
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.quantity, 1000)
+        self.assertFalse(ProductionRecord.objects.exists())
+
+    def test_recipe_without_ingredients_is_rejected(self):
+        water = Recipe.objects.create(name='Water')
+        response = self.prepare([
+            {'recipe': self.croissant.pk, 'quantity': 1},
+            {'recipe': water.pk, 'quantity': 2},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Water', response.data['error'])
+        self.assertEqual(Recipe.objects.get(pk=water.pk).prepared_quantity, 0)
+        self.assertFalse(ProductionRecord.objects.exists())
+
+    def test_unknown_recipe(self):
+        response = self.prepare([{'recipe': 999, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductionPlanTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.croissant = make_catalog()
+        self.flour = Ingredient.objects.get(name='Flour')
+        scone_recipe = Recipe.objects.create(name='Scone')
+        RecipeIngredient.objects.create(recipe=scone_recipe, ingredient=self.flour, quantity=200)
+        self.scone = Product.objects.create(recipe=scone_recipe, name='Scone', price=Decimal('2.00'))
+
+    def test_allocation_respects_shared_stock(self):
+        requirements = np.array([[100.0, 50.0], [200.0, 0.0]])
+        portions = allocate(requirements, np.array([1000.0, 500.0]), np.array([6.0, 3.0]))
+
+        self.assertEqual(portions.tolist(), [6.0, 2.0])
+        self.assertTrue((portions @ requirements <= [1000.0, 500.0]).all())
+
+    def test_allocation_on_random_catalog_is_feasible(self):
+        rng = np.random.default_rng(7)
+        requirements = np.where(rng.random((200, 150)) < 0.05, rng.uniform(1, 50, (200, 150)), 0.0)
+        stock = rng.uniform(100, 5000, 150)
+        targets = rng.integers(0, 100, 200).astype(float)
+
+        portions = allocate(requirements, stock, targets)
+
+        self.assertTrue((portions >= 0).all())
+        self.assertTrue((portions <= targets).all())
+        self.assertTrue((portions @ requirements <= stock + 1e-6).all())
+        self.assertTrue((portions == np.floor(portions)).all())
+
+    def test_plan_for_explicit_targets(self):
+        response = self.client.post('/api/products/plan/', {'targets': [
+            {'product': self.croissant.pk, 'quantity': 6},
+            {'product': self.scone.pk, 'quantity': 3},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        portions = {row['recipe_name']: row['portions'] for row in response.data['plan']}
+        self.assertEqual(portions, {'Croissant': 6.0, 'Scone': 2.0})
+        flour = next(row for row in response.data['ingredients'] if row['ingredient'] == self.flour.pk)
+        self.assertEqual(flour['used'], 1000.0)
+
+    def test_plan_from_recent_sales(self):
+        Sale.objects.create(product=self.croissant, quantity=14, unit_price=self.croissant.price)
+
+        response = self.client.post('/api/products/plan/', {'days': 7}, format='json')
+
+        self.assertEqual(response.data['plan'], [{
+            'recipe': self.croissant.recipe_id, 'recipe_name': 'Croissant',
+            'target': 2, 'portions': 2.0, 'max_portions': 10.0,
+        }])
+
+
+class ForecastTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.croissant = make_catalog()
+        Recipe.objects.filter(pk=self.croissant.recipe_id).update(prepared_quantity=5)
+        # Eight weeks of 10 a day, 30 on Saturdays
+        today = timezone.localdate()
+        Sale.objects.bulk_create([
+            Sale(
+                product=self.croissant, quantity=30 if day.weekday() == 5 else 10, unit_price=self.croissant.price,
+                timestamp=timezone.make_aware(datetime.datetime.combine(day, datetime.time(12))),
+            ).capture_costs()
+            for day in (today - datetime.timedelta(days=offset) for offset in range(1, 57))
+        ])
+        SalesRollup.objects.rebuild()
+        self.saturday = today + datetime.timedelta(days=(5 - today.weekday()) % 7 or 7)
+
+    def test_fit_recovers_weekday_pattern(self):
+        rng = np.random.default_rng(3)
+        weekdays = np.arange(364) % 7
+        sales = rng.poisson([10, 10, 10, 10, 20, 30, 5], (200, 52, 7)).reshape(200, 364).astype(float)
+        sales[:100] *= 2
+        # Launched in the last two months: leading days without sales are ignored
+        sales[150:, :300] = 0
+
+        level, profile = fit(sales, weekdays, alpha=0.2)
+
+        expected = np.array([10, 10, 10, 10, 20, 30, 5]) / 95 * 7
+        self.assertTrue(np.allclose(profile.mean(axis=1), 1))
+        self.assertTrue((abs(profile[:150] - expected) < 0.25).all())
+        self.assertAlmostEqual(level[:100].mean() / 95 * 7, 2, delta=0.1)
+        self.assertAlmostEqual(level[100:].mean() / 95 * 7, 1, delta=0.1)
+
+    def test_recommends_forecast_minus_prepared(self):
+        response = self.client.get('/api/products/forecast/', {'date': self.saturday, 'history': 56})
+
+        self.assertEqual(response.status_code, 200)
+        [recipe] = response.data['recipes']
+        self.assertAlmostEqual(recipe['forecast'], 30, delta=0.5)
+        self.assertEqual(recipe['prepared_quantity'], 5)
+        self.assertEqual(recipe['recommended'], math.ceil(recipe['forecast'] - 5))
+        [product] = response.data['products']
+        self.assertEqual(product['product'], self.croissant.pk)
+
+        week = self.client.get('/api/products/forecast/', {'date': self.saturday, 'days': 7, 'history': 56})
+        self.assertAlmostEqual(week.data['recipes'][0]['forecast'], 90, delta=1.5)
+
+    def test_fit_is_cached_until_a_sale(self):
+        params = {'date': self.saturday, 'history': 56}
+        with self.assertNumQueries(5):
+            first = self.client.get('/api/products/forecast/', params)
+        cache_hit = self.client.get('/api/products/forecast/', params, HTTP_IF_NONE_MATCH='"stale"')
+        with self.assertNumQueries(3):
+            self.client.get('/api/products/forecast/', params, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(cache_hit.data, first.data)
+
+        Sale.objects.create(product=self.croissant, quantity=1, unit_price=self.croissant.price)
+        with self.assertNumQueries(5):
+            self.client.get('/api/products/forecast/', params)
+
+    def test_rejects_bad_parameters(self):
+        response = self.client.get('/api/products/forecast/', {'alpha': 2, 'history': 3})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'alpha', 'history'})
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        start = timezone.now() - datetime.timedelta(days=1)
+        for minute in range(7):
+            record_sale(self.product, 1, start + datetime.timedelta(minutes=minute))
+
+    def test_sales_are_cursor_paginated_newest_first(self):
+        seen = []
+        url = '/api/sales/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            seen.extend(sale['id'] for sale in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, list(Sale.objects.order_by('-timestamp', '-id').values_list('id', flat=True)))
+
+    def test_catalog_is_page_number_paginated(self):
+        response = self.client.get('/api/ingredients/', {'page_size': 1, 'page': 2})
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([row['name'] for row in response.data['results']], ['Flour'])
+
+    def test_sparse_fieldsets(self):
+        response = self.client.get('/api/sales/', {'fields': 'id,quantity'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'quantity'})
+
+        response = self.client.get('/api/recipes/', {'fields': 'id,name'})
+        self.assertEqual(response.data['results'], [{'id': self.product.recipe_id, 'name': 'Croissant'}])
+
+        response = self.client.get('/api/products/', {'fields': 'name,price'})
+        self.assertEqual(response.data['results'], [{'name': 'Croissant', 'price': '2.50'}])
+
+    def test_production_records(self):
+        self.client.post(f'/api/recipes/{self.product.recipe_id}/prepare/', {'quantity': 2}, format='json')
+
+        response = self.client.get('/api/production-records/')
+
+        self.assertEqual(response.data['results'][0]['recipe_name'], 'Croissant')
+        self.assertEqual(response.data['results'][0]['quantity'], 2)
+
+
+class ListQueryCountTests(TestCase):
+    """
+    Every list endpoint costs a fixed number of queries, however many rows
+    it returns. Each count includes the ETag version lookup.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def grow(self, copies):
+        flour = Ingredient.objects.get(name='Flour')
+        for n in range(copies):
+            recipe = Recipe.objects.create(name=f'Loaf {n}', prepared_quantity=10)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity=10)
+            product = Product.objects.create(recipe=recipe, name=f'Loaf {n}', price=Decimal('4.00'))
+            Sale.objects.create(product=product, quantity=1, unit_price=product.price)
+            ProductionRecord.objects.create(recipe=recipe, quantity=1)
+            Ingredient.objects.create(name=f'Seed {n}', quantity=1, unit='g')
+
+    def assertListQueries(self, url, expected):
+        for copies in (0, 5):
+            self.grow(copies)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_ingredients(self):
+        self.assertListQueries('/api/ingredients/', 3)
+
+    def test_recipes(self):
+        self.assertListQueries('/api/recipes/', 5)
+
+    def test_recipe_ingredients(self):
+        self.assertListQueries('/api/recipe-ingredients/', 3)
+
+    def test_products(self):
+        self.assertListQueries('/api/products/', 3)
+
+    def test_sales(self):
+        self.assertListQueries('/api/sales/', 2)
+
+    def test_production_records(self):
+        self.assertListQueries('/api/production-records/', 2)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeat_reads_are_served_from_cache(self):
+        self.assertEqual(self.get('/api/products/')['X-Cache'], 'MISS')
+        # Only the ETag version lookup
+        with self.assertNumQueries(1):
+            response = self.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['name'], 'Croissant')
+        self.assertEqual(self.get('/api/cache-stats/').data['hits'], 1)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.get('/api/ingredients/')
+        self.assertEqual(self.get('/api/ingredients/?fields=name')['X-Cache'], 'MISS')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', '192.168.1.20'])
+    def test_host_is_part_of_the_key(self):
+        self.get('/api/ingredients/?page_size=1')
+        response = self.client.get('/api/ingredients/?page_size=1', HTTP_HOST='192.168.1.20:8000')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.data['next'].startswith('http://192.168.1.20:8000/'))
+
+    def test_saving_an_ingredient_invalidates_dependent_endpoints(self):
+        for url in ('/api/ingredients/', '/api/recipes/', '/api/products/'):
+            self.get(url)
+        butter = Ingredient.objects.get(name='Butter')
+        butter.cost_per_unit = 0.02
+        butter.save()
+        for url in ('/api/ingredients/', '/api/recipes/', '/api/products/'):
+            self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        self.assertAlmostEqual(self.get(f'/api/products/{self.product.pk}/').data['cost'], 1.2)
+
+    def test_stock_movements_invalidate_without_post_save(self):
+        self.get(f'/api/recipes/{self.product.recipe_id}/')
+        stock.take_prepared({self.product.recipe_id: 4})
+        response = self.get(f'/api/recipes/{self.product.recipe_id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['prepared_quantity'], 9996)
+
+    def test_unrelated_writes_keep_ingredients_cached(self):
+        self.get('/api/ingredients/')
+        response = self.client.post('/api/sales/checkout/', {'items': [{'product': self.product.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get('/api/ingredients/')['X-Cache'], 'HIT')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def revalidate(self, url, tag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=tag)
+
+    def test_each_touched_version_advances_once_per_request(self):
+        tables = ['api.Recipe', 'api.Sale', 'api.SalesRollup']
+        before = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'version'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/sales/', {'product': self.product.pk, 'quantity': 1, 'unit_price': '2.50'}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 201)
+        after = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'version'))
+        self.assertEqual({table: after[table] - before.get(table, 0) for table in tables}, dict.fromkeys(tables, 1))
+        self.assertEqual(sum('UPDATE "api_tableversion"' in query['sql'] for query in queries), 2)
+
+    def test_unchanged_list_answers_304_without_serializing(self):
+        tag = self.client.get('/api/recipes/')['ETag']
+        self.assertTrue(tag.startswith('"'))
+        with self.assertNumQueries(1):
+            response = self.revalidate('/api/recipes/', tag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], tag)
+
+    def test_tag_changes_with_dependent_tables(self):
+        tag = self.client.get('/api/products/')['ETag']
+        Ingredient.objects.filter(name='Butter').get().save()
+        self.assertEqual(self.revalidate('/api/products/', tag).status_code, 200)
+
+    def test_tag_ignores_unrelated_tables(self):
+        tag = self.client.get('/api/ingredients/')['ETag']
+        Product.objects.filter(pk=self.product.pk).get().save()
+        self.assertEqual(self.revalidate('/api/ingredients/', tag).status_code, 304)
+
+    def test_tag_depends_on_query_string(self):
+        tag = self.client.get('/api/ingredients/')['ETag']
+        self.assertNotEqual(self.client.get('/api/ingredients/?fields=name')['ETag'], tag)
+
+    def test_dashboard_changes_after_checkout(self):
+        tag = self.client.get('/api/sales/dashboard/')['ETag']
+        self.assertEqual(self.revalidate('/api/sales/dashboard/', tag).status_code, 304)
+        self.client.post('/api/sales/checkout/', {'items': [{'product': self.product.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(self.revalidate('/api/sales/dashboard/', tag).status_code, 200)
+        self.assertEqual(self.revalidate('/api/sales/', self.client.get('/api/sales/')['ETag']).status_code, 304)
+
+    def test_stock_movement_changes_recipe_tag(self):
+        url = f'/api/recipes/{self.product.recipe_id}/'
+        tag = self.client.get(url)['ETag']
+        stock.add_prepared({self.product.recipe_id: 1})
+        self.assertEqual(self.revalidate(url, tag).status_code, 200)
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.token = self.client.get('/api/sync/').data['token']
+
+    def sync(self):
+        response = self.client.get('/api/sync/', {'since': self.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['reset'])
+        self.token = response.data['token']
+        return response.data['changes']
+
+    def test_no_changes(self):
+        changes = self.sync()
+        self.assertTrue(all(not feed['updated'] and not feed['deleted'] for feed in changes.values()))
+
+    def test_checkout_returns_only_the_rows_it_moved(self):
+        Product.objects.create(recipe=self.product.recipe, name='Day-old Croissant', price=Decimal('1.00'))
+        Ingredient.objects.create(name='Salt', quantity=100, unit='g')
+        self.sync()
+
+        self.client.post('/api/sales/checkout/', {'items': [{'product': self.product.pk, 'quantity': 2}]}, format='json')
+        changes = self.sync()
+        self.assertEqual(set(changes), {'ingredients', 'recipes', 'products'})
+        self.assertEqual([recipe['prepared_quantity'] for recipe in changes['recipes']['updated']], [9998])
+        self.assertEqual(len(changes['products']['updated']), 2)
+        self.assertEqual(changes['ingredients']['updated'], [])
+
+    def test_ingredient_change_expands_to_recipes_and_products(self):
+        stock.consume_ingredients({Ingredient.objects.get(name='Butter').pk: 100})
+        changes = self.sync()
+        self.assertEqual([row['name'] for row in changes['ingredients']['updated']], ['Butter'])
+        self.assertEqual(changes['recipes']['updated'][0]['max_portions'], 8)
+        self.assertEqual(changes['products']['updated'][0]['id'], self.product.pk)
+
+    def test_deletes_are_reported(self):
+        salt = Ingredient.objects.create(name='Salt', quantity=100, unit='g')
+        pk = salt.pk
+        salt.delete()
+        changes = self.sync()
+        self.assertEqual(changes['ingredients'], {'updated': [], 'deleted': [pk]})
+
+    def test_request_bookkeeping_is_written_once_in_lock_order(self):
+        scone = Product.objects.create(recipe=self.product.recipe, name='Scone', price=Decimal('2.00'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/sales/checkout/', {'items': [
+                {'product': self.product.pk, 'quantity': 1},
+                {'product': scone.pk, 'quantity': 1},
+            ]}, format='json')
+
+        versions = [query['sql'] for query in queries if 'api_tableversion' in query['sql']]
+        self.assertEqual(len(versions), 2)
+        self.assertIn("'api.ChangeLogEntry'", versions[0])
+        self.assertEqual(sum('INSERT INTO "api_changelogentry"' in query['sql'] for query in queries), 1)
+
+    def test_changes_are_paged(self):
+        for n in range(5):
+            Ingredient.objects.create(name=f'Seed {n}', quantity=1, unit='g')
+
+        names = []
+        while True:
+            response = self.client.get('/api/sync/', {'since': self.token, 'limit': 2})
+            self.token = response.data['token']
+            names.append([row['name'] for row in response.data['changes']['ingredients']['updated']])
+            if not response.data['has_more']:
+                break
+        self.assertEqual(names, [['Seed 0', 'Seed 1'], ['Seed 2', 'Seed 3'], ['Seed 4']])
+
+    def test_entries_outside_the_feeds_are_not_read(self):
+        ChangeLogEntry.objects.bulk_create([ChangeLogEntry(table='api.Sale', object_id=n) for n in range(1, 6)])
+        Ingredient.objects.create(name='Salt', quantity=100, unit='g')
+
+        response = self.client.get('/api/sync/', {'since': self.token, 'limit': 1})
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual([row['name'] for row in response.data['changes']['ingredients']['updated']], ['Salt'])
+
+    def test_pruned_token_asks_for_reset(self):
+        Ingredient.objects.create(name='Salt', quantity=100, unit='g')
+        Ingredient.objects.create(name='Sugar', quantity=100, unit='g')
+        ChangeLogEntry.objects.filter(pk__lte=self.token + 1).delete()
+        response = self.client.get('/api/sync/', {'since': self.token})
+        self.assertTrue(response.data['reset'])
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        for n in range(10):
+            Ingredient.objects.create(name=f'Seed {n}', quantity=1, unit='g')
+        self.sync()
+        Ingredient.objects.filter(name='Seed 0').get().save()
+        with CaptureQueriesContext(connection) as queries:
+            changes = self.sync()
+        self.assertEqual(len(changes['ingredients']['updated']), 1)
+        self.assertLessEqual(len(queries), 5)
+
+
+class EventStreamTests(TestCase):
+    """Events published by request threads reach streams running on an event loop"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.loop = asyncio.new_event_loop()
+        self.stream = events.broker.subscribe()
+        self.next_event = self.loop.create_task(anext(self.stream))
+        self.loop.run_until_complete(asyncio.sleep(0))  # registers the subscriber
+
+    def tearDown(self):
+        self.disconnect()
+        self.loop.close()
+
+    def disconnect(self):
+        # Cancelling the pending read is how the server drops a stream
+        self.next_event.cancel()
+        self.loop.run_until_complete(asyncio.gather(self.next_event, return_exceptions=True))
+
+    def receive(self):
+        message = self.loop.run_until_complete(asyncio.wait_for(self.next_event, 1))
+        self.next_event = self.loop.create_task(anext(self.stream))
+        fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+    def test_checkout_is_pushed_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post('/api/sales/checkout/', {'items': [{'product': self.product.pk, 'quantity': 2}]}, format='json')
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertFalse(self.next_event.done())
+
+        for callback in callbacks:
+            callback()
+        event, data = self.receive()
+        self.assertEqual(event, 'sale')
+        self.assertEqual(data['updated'][0]['quantity'], 2)
+
+    def test_ingredient_quantity_changes_are_pushed(self):
+        butter = Ingredient.objects.get(name='Butter')
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.consume_ingredients({butter.pk: 100})
+        event, data = self.receive()
+        self.assertEqual(event, 'ingredient')
+        self.assertEqual(data['updated'][0]['quantity'], 400)
+
+    def test_deletes_are_pushed(self):
+        salt = Ingredient.objects.create(name='Salt', quantity=1, unit='g')
+        pk = salt.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            salt.delete()
+        self.assertEqual(self.receive(), ('ingredient', {'updated': [], 'deleted': [pk]}))
+
+    def test_slow_stream_is_told_to_resync(self):
+        for n in range(events.QUEUE_SIZE + 1):
+            events.broker.publish('sale', {'n': n})
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.receive(), ('resync', {}))
+
+    def test_stream_is_declined_outside_asgi(self):
+        response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_nothing_is_queued_without_subscribers(self):
+        self.disconnect()
+        self.assertFalse(events.broker.has_subscribers())
+        with mock.patch.object(events, '_publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Salt', quantity=1, unit='g')
+        publish.assert_not_called()
+
+
+class LowStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.butter = Ingredient.objects.get(name='Butter')
+        Ingredient.objects.filter(pk=self.butter.pk).update(min_threshold=300)
+
+    def kinds(self):
+        return list(StockAlert.objects.filter(ingredient=self.butter).order_by('pk').values_list('kind', flat=True))
+
+    def test_low_stock_lists_only_low_items(self):
+        for n in range(5):
+            Ingredient.objects.create(name=f'Seed {n}', quantity=10, unit='g', min_threshold=n * 5)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/ingredients/low-stock/')
+        self.assertEqual([row['name'] for row in response.data], ['Seed 2', 'Seed 3', 'Seed 4'])
+
+    def test_low_stock_query_reads_the_partial_index(self):
+        plan = Ingredient.objects.low_stock().explain()
+        self.assertIn('ingredient_low_stock_idx', plan)
+
+    def test_prepare_and_restock_record_each_crossing_once(self):
+        recipe = self.product.recipe
+        self.client.post(f'/api/recipes/{recipe.pk}/prepare/', {'quantity': 3}, format='json')  # 500 -> 350
+        self.assertEqual(self.kinds(), [])
+        self.client.post(f'/api/recipes/{recipe.pk}/prepare/', {'quantity': 2}, format='json')  # 350 -> 250
+        self.client.post(f'/api/recipes/{recipe.pk}/prepare/', {'quantity': 1}, format='json')  # 250 -> 200
+        self.assertEqual(self.kinds(), [StockAlert.LOW])
+        self.assertEqual(StockAlert.objects.get().quantity, 250)
+
+        self.client.post(f'/api/ingredients/{self.butter.pk}/restock/', {'amount': 500}, format='json')
+        self.assertEqual(self.kinds(), [StockAlert.LOW, StockAlert.RECOVERED])
+
+    def test_raising_the_threshold_is_a_crossing(self):
+        self.butter.refresh_from_db()
+        self.butter.min_threshold = 1000
+        self.butter.save()
+        response = self.client.get('/api/stock-alerts/', {'ingredient': self.butter.pk})
+        self.assertEqual([(row['ingredient_name'], row['kind']) for row in response.data['results']], [('Butter', 'low')])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite connection tuning')
+class SQLiteTuningTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_new_connections_are_tuned(self):
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generates_a_consistent_catalog_and_history(self):
+        counts = generate(ingredients=40, recipes=12, sales=500, days=30, seed=1)
+        self.assertEqual(Ingredient.objects.count(), 40)
+        self.assertEqual(Sale.objects.count(), 500)
+        per_recipe = Recipe.objects.annotate(n=Count('recipeingredient')).values_list('n', flat=True)
+        self.assertTrue(all(5 <= n <= 20 for n in per_recipe))
+        self.assertTrue(Recipe.objects.filter(cost__gt=0).count() == 12)
+        self.assertEqual(
+            SalesRollup.objects.filter(granularity=SalesRollup.DAY).aggregate(n=Sum('transactions'))['n'], 500
+        )
+        self.assertLess(ProductionRecord.objects.earliest('timestamp').timestamp, timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(counts['sales'], 500)
+
+    def test_same_seed_same_data(self):
+        generate(ingredients=20, recipes=5, sales=50, days=7, seed=3)
+        first = list(Sale.objects.order_by('pk').values_list('product__name', 'quantity', 'timestamp'))
+        Sale.objects.all().delete()
+        ProductionRecord.objects.all().delete()
+        Product.objects.all().delete()
+        Recipe.objects.all().delete()
+        Ingredient.objects.all().delete()
+        generate(ingredients=20, recipes=5, sales=50, days=7, seed=3)
+        second = list(Sale.objects.order_by('pk').values_list('product__name', 'quantity', 'timestamp'))
+        self.assertEqual([row[:2] for row in first], [row[:2] for row in second])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.product = make_catalog()
+
+    def timings(self, response):
+        return {
+            part.split(';')[0]: part for part in (p.strip() for p in response['Server-Timing'].split(','))
+        }
+
+    def test_server_timing_reports_queries_and_phases(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'serialize', 'render', 'app', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+    def test_serializer_time_is_reported_apart_from_the_view(self):
+        with mock.patch('rest_framework.serializers.ModelSerializer.to_representation', autospec=True) as represent:
+            represent.side_effect = lambda serializer, instance: time.sleep(0.02) or {'id': instance.pk}
+            response = self.client.get(f'/api/products/{self.product.pk}/')
+        serialize = float(self.timings(response)['serialize'].split('dur=')[1])
+        self.assertGreaterEqual(serialize, 20)
+
+        text = self.client.get('/api/_metrics').content.decode()
+        total = re.search(r'bakery_serialize_seconds_total\{view="product-detail",method="GET"\} (\S+)', text)
+        self.assertGreaterEqual(float(total.group(1)), 0.02)
+
+    def test_metrics_are_aggregated_per_view(self):
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        self.client.get(f'/api/products/{self.product.pk}/')
+        self.client.get('/api/products/999/')
+
+        text = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('bakery_requests_total{view="product-list",method="GET",status="200"} 2', text)
+        self.assertIn('bakery_requests_total{view="product-detail",method="GET",status="404"} 1', text)
+        self.assertIn('bakery_request_duration_seconds_count{view="product-list",method="GET"} 2', text)
+        self.assertIn('bakery_request_duration_seconds_bucket{view="product-list",method="GET",le="+Inf"} 2', text)
+        self.assertRegex(text, r'bakery_response_bytes_total\{view="product-list",method="GET"\} [1-9]')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_catalog()
+        self.day = timezone.make_aware(datetime.datetime(2025, 3, 3, 12, 0))
+        record_sale(self.product, 2, self.day)
+        record_sale(self.product, 1, self.day + datetime.timedelta(days=1))
+        record_sale(self.product, 4, self.day - datetime.timedelta(days=1))
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_sales_csv_is_oldest_first_with_names_and_costs(self):
+        lines = self.export('/api/sales/export/', format='csv').splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,product,product_name,recipe_name,quantity,unit_price,total,unit_cost,cost,profit')
+        self.assertEqual(len(lines), 4)
+        first = lines[1].split(',')
+        self.assertEqual(first[3:8], ['Croissant', 'Croissant', '4', '2.50', '10.00'])
+        self.assertAlmostEqual(float(first[9]), 2.8)
+        self.assertAlmostEqual(float(first[10]), 7.2)
+
+    def test_sales_ndjson_within_date_range(self):
+        day = self.day.date().isoformat()
+        rows = [json.loads(line) for line in self.export(
+            '/api/sales/export/', format='ndjson', start_date=day, end_date=day
+        ).splitlines()]
+        self.assertEqual([row['quantity'] for row in rows], [2])
+        self.assertEqual(rows[0]['unit_price'], '2.50')
+
+    def test_csv_is_the_default_and_accept_header_is_honoured(self):
+        response = self.client.get('/api/production-records/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        response = self.client.get('/api/production-records/export/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+    def test_production_export(self):
+        ProductionRecord.objects.create(recipe=self.product.recipe, quantity=3, notes='morning')
+        [row] = [json.loads(line) for line in self.export('/api/production-records/export/', format='ndjson').splitlines()]
+        self.assertEqual((row['recipe_name'], row['quantity'], row['notes']), ('Croissant', 3, 'morning'))
+        self.assertAlmostEqual(row['cost'], 2.1)
+
+    def test_bad_dates(self):
+        response = self.client.get('/api/sales/export/', {'format': 'csv', 'start_date': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_streams_in_chunks_from_one_query(self):
+        with mock.patch('api.views.EXPORT_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.export('/api/sales/export/', format='ndjson').splitlines()), 3)
+        self.assertEqual(len([q for q in queries if 'api_sale' in q['sql']]), 1)
+
+
+class RecipeImageTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, size=(2000, 1000), mode='RGBA'):
+        buffer = io.BytesIO()
+        Image.new(mode, size, (200, 120, 40, 128)[:len(mode)]).save(buffer, 'PNG')
+        return SimpleUploadedFile('bun.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_queues_variants_after_commit(self):
+        with mock.patch.object(images, '_run') as run, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {'name': 'Bun', 'image': self.upload()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        images._worker.submit(lambda: None).result()
+        run.assert_called_once_with(response.data['id'])
+        self.assertEqual(response.data['image_variants'], {})
+
+    def test_variants_are_resized_hashed_and_cached_for_good(self):
+        with mock.patch.object(images, 'schedule'):
+            recipe = Recipe.objects.create(name='Bun', image=self.upload())
+        images.generate(recipe.pk)
+
+        variants = self.client.get(f'/api/recipes/{recipe.pk}/').data['image_variants']
+        self.assertEqual(set(variants), set(images.SIZES))
+        self.assertEqual((variants['large']['width'], variants['large']['height']), (1280, 640))
+        self.assertEqual((variants['thumb']['width'], variants['thumb']['height']), (240, 120))
+
+        response = self.client.get(variants['thumb']['webp'])
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (240, 120)))
+        self.assertEqual(self.client.get(variants['thumb']['jpeg'])['Content-Type'], 'image/jpeg')
+
+    def test_replaced_photo_is_not_overwritten_by_a_stale_job(self):
+        with mock.patch.object(images, 'schedule'):
+            recipe = Recipe.objects.create(name='Bun', image=self.upload())
+
+        def replace_while_rendering(source):
+            Recipe.objects.filter(pk=recipe.pk).update(image='recipe_images/other.png')
+            return {}
+
+        with mock.patch.object(images, 'render', side_effect=replace_while_rendering):
+            self.assertIsNone(images.generate(recipe.pk))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+
+    def test_unknown_variant(self):
+        self.assertEqual(self.client.get('/api/recipe-images/1-thumb.abc.webp').status_code, 404)
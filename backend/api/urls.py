@@ -1,16 +1,26 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .instrumentation import metrics_view
 from .views import (
-    IngredientViewSet, RecipeViewSet, RecipeIngredientViewSet,ProductViewSet, SaleViewSet
+    IngredientViewSet, RecipeViewSet, RecipeIngredientViewSet, ProductionRecordViewSet, ProductViewSet, SaleViewSet,
+    StockAlertViewSet, cache_stats, events, recipe_image, stock_on_hand, sync,
 )
 
 router = DefaultRouter()
 router.register(r'ingredients', IngredientViewSet)
+router.register(r'stock-alerts', StockAlertViewSet)
 router.register(r'recipes', RecipeViewSet)
 router.register(r'recipe-ingredients', RecipeIngredientViewSet)
+router.register(r'production-records', ProductionRecordViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'sales', SaleViewSet, basename='sale')
 
 urlpatterns = [
+    path('cache-stats/', cache_stats, name='cache-stats'),
+    path('_metrics', metrics_view, name='metrics'),
+    path('sync/', sync, name='sync'),
+    path('stock-on-hand/', stock_on_hand, name='stock-on-hand'),
+    path('events/', events, name='events'),
+    path('recipe-images/<str:name>', recipe_image, name='recipe-image'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,21 +1,105 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Sum, Count, F, ExpressionWrapper, DecimalField, Avg
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.db.models import Sum, Q, ExpressionWrapper, DecimalField, Avg, Max, Min
 from django.db.models.functions import TruncDate, TruncWeek, TruncMonth, ExtractYear
 from datetime import datetime, timedelta
+import csv
+import io
+import json
+import logging
+import math
 from django.utils import timezone
 
-from .models import Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale
+from . import cache, images, stock
+from .cache import CachedResponseMixin
+from .conditional import ConditionalGetMixin, conditional
+from .events import broker
+from .forecasting import Forecast
+from .pagination import CatalogPagination, TimestampCursorPagination
+from .planning import RequirementMatrix
+from .parsers import CSVParser, read_csv
+from .renderers import CSVRenderer, NDJSONRenderer
+from .signals import record_bulk_write
+from .models import (
+    ChangeLogEntry, Ingredient, Recipe, RecipeIngredient, ProductionRecord, Product, Sale, SalesRollup, StockAlert,
+    StockSnapshot,
+)
 from .serializers import (
     IngredientSerializer, RecipeSerializer, 
-    RecipeIngredientSerializer, ProductionRecordSerializer, ProductSerializer, SaleSerializer
+    RecipeIngredientSerializer, ProductionRecordSerializer, ProductSerializer, SaleSerializer,
+    CheckoutSerializer, PrepareBatchSerializer, PlanSerializer, ForecastSerializer, StockAlertSerializer,
+    BulkRestockSerializer, IngredientImportSerializer,
 )
 
-class IngredientViewSet(viewsets.ModelViewSet):
+logger = logging.getLogger(__name__)
+
+BATCH_PARSERS = [JSONParser, CSVParser, MultiPartParser]
+
+
+def _batch_lines(request):
+    """Lines of a batch upload: a JSON list or {"items": [...]}, a CSV body, or a CSV file field"""
+    upload = request.FILES.get('file')
+    if upload is not None:
+        try:
+            return read_csv(upload.read().decode('utf-8'))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ParseError(f'CSV parse error - {e}')
+    if isinstance(request.data, list):
+        return request.data
+    if isinstance(request.data, dict):
+        return request.data.get('items')
+    raise ParseError('Expected a list of lines or {"items": [...]}')
+
+
+def _batch_rejected(message, lines, errors):
+    """400 with a line-by-line report when any line of a batch fails"""
+    return Response({
+        'error': message,
+        'lines': [
+            {
+                'line': index,
+                'name': line.get('name') if isinstance(line, dict) else None,
+                'status': 'error' if index in errors else 'ok',
+                'errors': errors.get(index, []),
+            }
+            for index, line in enumerate(lines)
+        ],
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _line_errors(serializer):
+    """{line index: [messages]} from a batch serializer's errors, or None if the batch itself is malformed"""
+    items = serializer.errors.get('items')
+    if isinstance(items, list):
+        items = dict(enumerate(items))
+    # {"items": null} or a missing list gives flat messages, not one dict per line
+    if not isinstance(items, dict) or not all(
+        isinstance(index, int) and isinstance(line, dict) for index, line in items.items()
+    ):
+        return None
+    return {
+        index: [
+            message if field == 'non_field_errors' else f'{field}: {message}'
+            for field, messages in line.items() for message in messages
+        ]
+        for index, line in items.items() if line
+    }
+
+
+class IngredientViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    cache_namespace = 'ingredients'
+    etag_tables = (Ingredient,)
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    pagination_class = CatalogPagination
     
     @action(detail=True, methods=['post'])
     def restock(self, request, pk=None):
@@ -28,15 +112,119 @@ class IngredientViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        ingredient.quantity += amount
-        ingredient.save()
+        stock.restock_ingredients({ingredient.pk: amount})
+        ingredient.refresh_from_db()
         
         return Response(IngredientSerializer(ingredient).data)
 
+    @action(detail=False, methods=['post'], url_path='bulk-restock', parser_classes=BATCH_PARSERS)
+    def bulk_restock(self, request):
+        """
+        Add a whole delivery to stock in one UPDATE. Lines name an ingredient
+        by id or name; if any line is invalid nothing is restocked.
+        """
+        lines = _batch_lines(request)
+        serializer = BulkRestockSerializer(data={'items': lines})
+        if not serializer.is_valid():
+            errors = _line_errors(serializer)
+            if errors is None:
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return _batch_rejected('Restock failed, no stock was added', lines, errors)
+        items = serializer.validated_data['items']
+
+        ids = {item['ingredient'] for item in items if 'ingredient' in item}
+        names = {item['name'] for item in items if 'ingredient' not in item}
+        found = Ingredient.objects.filter(Q(pk__in=ids) | Q(name__in=names)).values_list('pk', 'name')
+        by_id = dict(found)
+        by_name = {name: pk for pk, name in by_id.items()}
+
+        errors = {}
+        deliveries = {}
+        for index, item in enumerate(items):
+            pk = item['ingredient'] if 'ingredient' in item else by_name.get(item['name'])
+            if pk not in by_id:
+                errors[index] = [f"Ingredient {item.get('ingredient', item.get('name'))} does not exist."]
+                continue
+            deliveries[pk] = deliveries.get(pk, 0) + item['amount']
+        if errors:
+            return _batch_rejected('Restock failed, no stock was added', lines, errors)
+
+        stock.restock_ingredients(deliveries)
+        ingredients = Ingredient.objects.in_bulk(deliveries)
+        return Response({
+            'lines': [
+                {
+                    'line': index,
+                    'status': 'restocked',
+                    'amount': item['amount'],
+                    'ingredient': IngredientSerializer(
+                        ingredients[item['ingredient'] if 'ingredient' in item else by_name[item['name']]]
+                    ).data,
+                }
+                for index, item in enumerate(items)
+            ],
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=BATCH_PARSERS)
+    def import_ingredients(self, request):
+        """
+        Create or update ingredients by name. Given attributes are overwritten
+        and quantity is added to the stock of existing ingredients; all lines
+        are applied together or not at all.
+        """
+        lines = _batch_lines(request)
+        serializer = IngredientImportSerializer(data={'items': lines})
+        if not serializer.is_valid():
+            errors = _line_errors(serializer)
+            if errors is None:
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return _batch_rejected('Import failed, no ingredients were changed', lines, errors)
+        items = serializer.validated_data['items']
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+        try:
+            results = stock.import_ingredients(items)
+        except ValidationError as e:
+            return _batch_rejected('Import failed, no ingredients were changed', lines, e.message_dict)
+
+        ingredients = Ingredient.objects.in_bulk([pk for pk, _ in results])
+        return Response({
+            'lines': [
+                {
+                    'line': index,
+                    'status': 'created' if created else 'updated',
+                    'ingredient': IngredientSerializer(ingredients[pk]).data,
+                }
+                for index, (pk, created) in enumerate(results)
+            ],
+        })
+
+    @action(detail=False, methods=['get'], url_path='low-stock')
+    @conditional(Ingredient)
+    def low_stock(self, request):
+        """Ingredients at or below their minimum threshold"""
+        return Response(self.get_serializer(Ingredient.objects.low_stock(), many=True).data)
+
+
+class StockAlertViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """Threshold crossings, newest first"""
+    # Alerts are only written alongside an ingredient change
+    etag_tables = (Ingredient,)
+    queryset = StockAlert.objects.select_related('ingredient')
+    serializer_class = StockAlertSerializer
+    pagination_class = TimestampCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        ingredient = self.request.query_params.get('ingredient')
+        return queryset.filter(ingredient=ingredient) if ingredient else queryset
+
+
+class RecipeViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    cache_namespace = 'recipes'
+    etag_tables = (Recipe, RecipeIngredient, Ingredient)
+    queryset = Recipe.objects.prefetch_related('recipeingredient_set__ingredient')
     serializer_class = RecipeSerializer
+    pagination_class = CatalogPagination
     
     @action(detail=True, methods=['post'])
     def prepare(self, request, pk=None):
@@ -66,46 +254,288 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            for requirement in recipe.recipeingredient_set.all():
-                total_needed = requirement.quantity * quantity
-                ingredient = requirement.ingredient
-                ingredient.quantity -= total_needed
-                ingredient.save()
-                
-            
-            production = ProductionRecord.objects.create(
-                recipe=recipe,
-                quantity=quantity,
-                notes=notes
+        try:
+            with transaction.atomic():
+                stock.consume_ingredients({
+                    requirement.ingredient_id: requirement.quantity * quantity
+                    for requirement in recipe.recipeingredient_set.all()
+                })
+                production = ProductionRecord.objects.create(
+                    recipe=recipe,
+                    quantity=quantity,
+                    notes=notes
+                )
+        except stock.InsufficientStock:
+            recipe.refresh_from_db(fields=['max_portions'])
+            return Response(
+                {'error': f'Cannot make {quantity} {recipe.name}(s). Maximum available: {recipe.max_portions:.2f}'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            recipe.prepared_quantity += quantity
-            recipe.save()
         return Response({
             'message': f'Successfully produced {quantity} {recipe.name}(s)',
             'production': ProductionRecordSerializer(production).data
         })
 
 
-class RecipeIngredientViewSet(viewsets.ModelViewSet):
-    queryset = RecipeIngredient.objects.all()
+    @action(detail=False, methods=['post'], url_path='prepare-batch')
+    def prepare_batch(self, request):
+        """Prepare many recipes at once, checking the whole plan against stock in one pass"""
+        serializer = PrepareBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+
+        portions = {}
+        for item in items:
+            portions[item['recipe']] = portions.get(item['recipe'], 0) + item['quantity']
+        recipes = Recipe.objects.in_bulk(portions)
+        missing = sorted(set(portions) - set(recipes))
+        if missing:
+            return Response(
+                {'error': f'Unknown recipes: {missing}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            with transaction.atomic():
+                matrix = RequirementMatrix.load(portions, lock=True)
+                # As with /prepare/, a recipe that uses nothing cannot be made
+                empty = [pk for pk in matrix.recipe_ids if not matrix.requirements[matrix.recipe_index[pk]].any()]
+                if empty:
+                    return Response(
+                        {'error': f"No ingredients set for: {', '.join(recipes[pk].name for pk in empty)}"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                needed = dict(zip(matrix.ingredient_ids, matrix.needed(portions).tolist()))
+                shortfalls = matrix.shortfalls(portions)
+                if shortfalls:
+                    raise stock.InsufficientStock(shortfalls)
+
+                stock.consume_ingredients(matrix.withdrawals(portions))
+                stock.add_prepared(portions)
+                productions = ProductionRecord.objects.bulk_create([
+                    ProductionRecord(recipe=recipes[item['recipe']], quantity=item['quantity'], notes=item['notes'])
+                    for item in items
+                ])
+                record_bulk_write(ProductionRecord, [production.pk for production in productions])
+        except stock.InsufficientStock as e:
+            names = dict(Ingredient.objects.filter(pk__in=e.shortfalls).values_list('pk', 'name'))
+            return Response({
+                'error': 'Not enough ingredients for this plan, nothing was prepared',
+                'shortfalls': [
+                    {'ingredient': pk, 'ingredient_name': names.get(pk), 'needed': needed[pk], 'available': available}
+                    for pk, available in e.shortfalls.items()
+                ],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': f'Successfully produced {len(portions)} recipe(s)',
+            'productions': ProductionRecordSerializer(productions, many=True).data
+        })
+
+
+class RecipeIngredientViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    etag_tables = (RecipeIngredient, Ingredient)
+    queryset = RecipeIngredient.objects.select_related('ingredient').order_by('id')
     serializer_class = RecipeIngredientSerializer
-   
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    pagination_class = CatalogPagination
+
+
+class ProductionRecordViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    etag_tables = (ProductionRecord, Recipe)
+    queryset = ProductionRecord.objects.select_related('recipe')
+    serializer_class = ProductionRecordSerializer
+    pagination_class = TimestampCursorPagination
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream production history as CSV or NDJSON, optionally between start_date and end_date"""
+        queryset, error = _export_range(request, ProductionRecord.objects.all())
+        if error:
+            return error
+        rows = (
+            (pk, timezone.localtime(timestamp).isoformat(), recipe_id, recipe_name, quantity,
+             round(unit_cost, 4), round(quantity * unit_cost, 4), notes)
+            for pk, timestamp, recipe_id, recipe_name, quantity, unit_cost, notes in queryset.values_list(
+                'id', 'timestamp', 'recipe_id', 'recipe__name', 'quantity', 'recipe__cost', 'notes'
+            ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        columns = ['id', 'timestamp', 'recipe', 'recipe_name', 'quantity', 'unit_cost', 'cost', 'notes']
+        return _export_response(request, 'production', columns, rows)
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    cache_namespace = 'products'
+    etag_tables = (Product, Recipe, RecipeIngredient, Ingredient)
+    queryset = Product.objects.select_related('recipe')
     serializer_class = ProductSerializer
+    pagination_class = CatalogPagination
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        for product in queryset:
-            print(f"Product: {product.name}, prepared_quantity: {product.recipe.prepared_quantity}")
-        return queryset
+    @action(detail=False, methods=['post'])
+    def plan(self, request):
+        """
+        Suggest how many portions of each recipe to make when recipes compete
+        for the same ingredients. Targets are given per product, or default to
+        the average daily units sold over the last `days` days.
+        """
+        serializer = PlanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        targets = {}
+        if data.get('targets'):
+            products = Product.objects.in_bulk({target['product'] for target in data['targets']})
+            missing = sorted({target['product'] for target in data['targets']} - set(products))
+            if missing:
+                return Response(
+                    {'error': f'Unknown products: {missing}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            for target in data['targets']:
+                recipe_id = products[target['product']].recipe_id
+                targets[recipe_id] = targets.get(recipe_id, 0) + target['quantity']
+        else:
+            since = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=data['days'])
+            demand = (
+                SalesRollup.objects
+                .filter(granularity=SalesRollup.DAY, bucket__gte=since, product__is_active=True)
+                .values('product__recipe')
+                .annotate(sold=Sum('items_sold'))
+            )
+            targets = {row['product__recipe']: math.ceil(row['sold'] / data['days']) for row in demand}
+
+        matrix = RequirementMatrix.load(targets)
+        plan = matrix.allocate(targets)
+        used = matrix.needed(plan)
+        recipes = Recipe.objects.in_bulk(targets)
+        ingredients = Ingredient.objects.in_bulk(matrix.ingredient_ids)
+
+        return Response({
+            'plan': [
+                {
+                    'recipe': pk,
+                    'recipe_name': recipes[pk].name,
+                    'target': targets[pk],
+                    'portions': plan[pk],
+                    'max_portions': recipes[pk].max_portions,
+                }
+                for pk in matrix.recipe_ids
+            ],
+            'ingredients': [
+                {
+                    'ingredient': pk,
+                    'ingredient_name': ingredients[pk].name,
+                    'available': float(matrix.stock[i]),
+                    'used': float(used[i]),
+                }
+                for i, pk in enumerate(matrix.ingredient_ids)
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    @conditional(SalesRollup, Product, Recipe)
+    def forecast(self, request):
+        """
+        Expected sales per product and recipe over `days` days from `date`
+        (today by default), fitted on the last `history` days of sales, and
+        how many portions of each recipe to prepare on top of what is ready.
+        """
+        serializer = ForecastSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        start = data.get('date') or timezone.localdate()
+        dates = [start + timedelta(days=offset) for offset in range(data['days'])]
+
+        forecast = Forecast.cached(data['history'], data['alpha'])
+        demand = forecast.demand(dates)
+        by_recipe = forecast.demand_by_recipe(dates)
+        recipes = Recipe.objects.only('name', 'prepared_quantity').in_bulk(by_recipe)
 
+        return Response({
+            'date': start,
+            'days': data['days'],
+            'recipes': [
+                {
+                    'recipe': pk,
+                    'recipe_name': recipes[pk].name,
+                    'forecast': round(expected, 2),
+                    'prepared_quantity': recipes[pk].prepared_quantity,
+                    'recommended': max(0, math.ceil(round(expected - recipes[pk].prepared_quantity, 6))),
+                }
+                for pk, expected in by_recipe.items()
+            ],
+            'products': [
+                {
+                    'product': pk,
+                    'product_name': name,
+                    'recipe': recipe_id,
+                    'forecast': round(float(expected), 2),
+                }
+                for pk, recipe_id, name, expected in zip(
+                    forecast.product_ids, forecast.recipe_ids, forecast.names, demand
+                )
+            ],
+        })
 
-class SaleViewSet(viewsets.ModelViewSet):
-    queryset = Sale.objects.all()
+
+class SaleViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    etag_tables = (Sale, Product)
+    queryset = Sale.objects.select_related('product')
     serializer_class = SaleSerializer
+    pagination_class = TimestampCursorPagination
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """Record every line of a cart in one transaction"""
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data['items']
+
+        try:
+            sales = Sale.objects.checkout(lines)
+        except ValidationError as e:
+            errors = e.message_dict
+            return Response({
+                'error': 'Checkout failed, no sales were recorded',
+                'lines': [
+                    {
+                        'line': index,
+                        'product': line['product'],
+                        'quantity': line['quantity'],
+                        'status': 'error' if index in errors else 'ok',
+                        'errors': errors.get(index, []),
+                    }
+                    for index, line in enumerate(lines)
+                ],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'lines': [
+                {'line': index, 'status': 'ok', 'sale': sale}
+                for index, sale in enumerate(SaleSerializer(sales, many=True).data)
+            ],
+        }, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream sales as CSV or NDJSON, optionally between start_date and end_date"""
+        queryset, error = _export_range(request, Sale.objects.all())
+        if error:
+            return error
+        rows = (
+            (pk, timezone.localtime(timestamp).isoformat(), product_id, product_name, recipe_name, quantity,
+             unit_price, quantity * unit_price, *_sale_costs(quantity, unit_price, unit_cost, total_cost))
+            for pk, timestamp, product_id, product_name, recipe_name, quantity, unit_price, unit_cost, total_cost
+            in queryset.values_list(
+                'id', 'timestamp', 'product_id', 'product__name', 'product__recipe__name',
+                'quantity', 'unit_price', 'unit_cost', 'total_cost',
+            ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        columns = [
+            'id', 'timestamp', 'product', 'product_name', 'recipe_name', 'quantity',
+            'unit_price', 'total', 'unit_cost', 'cost', 'profit',
+        ]
+        return _export_response(request, 'sales', columns, rows)
+
     @action(detail=False, methods=['get'])
     def report(self, request):
         """Generate sales and profit report by time period"""
@@ -117,10 +547,7 @@ class SaleViewSet(viewsets.ModelViewSet):
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
             
-            queryset = Sale.objects.filter(
-                timestamp__date__gte=start_date,
-                timestamp__date__lte=end_date
-            )
+            queryset = Sale.objects.on_dates(start_date, end_date)
             
             if period == 'day':
                 trunc_function = TruncDate('timestamp')
@@ -137,24 +564,16 @@ class SaleViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            sales_by_period = queryset.annotate(
-                period=trunc_function
-            ).values('period').annotate(
-                total_sales=Sum(F('quantity') * F('unit_price')),
-                transactions=Count('id'),
-                items_sold=Sum('quantity')
-            ).order_by('period')
-
             result = []
-            for period_data in sales_by_period:
-                period_sales = queryset.filter(timestamp__date=period_data['period'])
-                cost = sum(sale.quantity * float(sale.product.recipe.cost) for sale in period_sales)
+            for period_data in queryset.summarize(trunc_function):
                 revenue = float(period_data['total_sales'] or 0)
+                cost = float(period_data['cost'] or 0)
                 profit = revenue - cost
 
                 result.append({
                     'period': period_data['period'].strftime(date_format),
                     'transactions': period_data['transactions'],
+                    'items_sold': period_data['items_sold'] or 0,
                     'total_sales': revenue,
                     'cost': cost,
                     'profit': profit,
@@ -170,7 +589,8 @@ class SaleViewSet(viewsets.ModelViewSet):
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        except Exception as e:
+        except Exception:
+            logger.exception("report failed period=%s", request.query_params.get('period'))
             return Response(
                 {'error': 'An unexpected error occurred'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -178,80 +598,293 @@ class SaleViewSet(viewsets.ModelViewSet):
 
 
     @action(detail=False, methods=['get'])
+    @conditional(SalesRollup)
     def dashboard(self, request):
         try:
-            today = timezone.now().date()
+            today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
             week_ago = today - timedelta(days=7)
 
-            sales = self.queryset
-
-            today_sales = sales.filter(timestamp__date=today)
-            today_revenue = today_sales.aggregate(
-                revenue=Sum(F('quantity') * F('unit_price')),
-                transactions=Count('id')
+            days = list(
+                SalesRollup.objects.filter(granularity=SalesRollup.DAY, bucket__gte=week_ago)
+                .values('bucket')
+                .annotate(revenue=Sum('revenue'), profit=Sum('profit'), transactions=Sum('transactions'))
+                .order_by('bucket')
             )
-
-            today_cost = sum(
-                sale.quantity * float(sale.product.recipe.cost)
-                for sale in today_sales
+            hours = (
+                SalesRollup.objects.filter(granularity=SalesRollup.HOUR, bucket__gte=today)
+                .values('bucket')
+                .annotate(revenue=Sum('revenue'), profit=Sum('profit'), transactions=Sum('transactions'))
+                .order_by('bucket')
             )
-            today_revenue_val = float(today_revenue['revenue'] or 0)
-            today_profit = today_revenue_val - today_cost
-            today_margin = (today_profit / today_revenue_val * 100) if today_revenue_val > 0 else 0
-
-            week_sales = sales.filter(timestamp__date__gte=week_ago)
-            week_revenue = week_sales.aggregate(
-                revenue=Sum(F('quantity') * F('unit_price')),
-                transactions=Count('id')
-            )
-
-            week_cost = sum(
-                sale.quantity * float(sale.product.recipe.cost)
-                for sale in week_sales
-            )
-            week_revenue_val = float(week_revenue['revenue'] or 0)
-            week_profit = week_revenue_val - week_cost
-            week_margin = (week_profit / week_revenue_val * 100) if week_revenue_val > 0 else 0
-
-            last_week = timezone.now() - timedelta(days=7)
-            chart_data = (
-                Sale.objects.filter(timestamp__gte=last_week)
-                .annotate(period=TruncDate('timestamp'))
-                .values('period')
-                .annotate(
-                    total_sales=Sum(F('quantity') * F('unit_price')),
-                    transactions=Count('id')
-                )
-                .order_by('period')
-            )
-
-            for day in chart_data:
-                day_sales = Sale.objects.filter(timestamp__date=day['period'])
-                cost = sum(
-                    sale.quantity * float(sale.product.recipe.cost)
-                    for sale in day_sales
-                )
-                day['profit'] = float(day['total_sales'] or 0) - cost
 
             return Response({
-                'today': {
-                    'revenue': today_revenue_val,
-                    'profit': today_profit,
-                    'profit_margin': today_margin,
-                    'transactions': today_revenue['transactions'] or 0
-                },
-                'week': {
-                    'revenue': week_revenue_val,
-                    'profit': week_profit,
-                    'profit_margin': week_margin,
-                    'transactions': week_revenue['transactions'] or 0
-                },
-                'chart_data': list(chart_data)
+                'today': _rollup_totals(row for row in days if row['bucket'] >= today),
+                'week': _rollup_totals(days),
+                'chart_data': [
+                    {
+                        'period': timezone.localtime(row['bucket']).date(),
+                        'total_sales': float(row['revenue'] or 0),
+                        'transactions': row['transactions'],
+                        'profit': row['profit'] or 0,
+                    }
+                    for row in days
+                ],
+                'hourly': [
+                    {
+                        'period': timezone.localtime(row['bucket']).strftime('%H:%M'),
+                        'total_sales': float(row['revenue'] or 0),
+                        'transactions': row['transactions'],
+                        'profit': row['profit'] or 0,
+                    }
+                    for row in hours
+                ],
             })
 
-        except Exception as e:
-            print(f"Dashboard error: {str(e)}")
+        except Exception:
+            logger.exception("dashboard failed")
             return Response(
                 {'error': 'Error generating dashboard metrics'},
                 status=500
-            )
\ No newline at end of file
+            )
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _export_range(request, queryset):
+    """Oldest-first rows, limited to start_date..end_date when both are given; (queryset, error response)"""
+    start_date_str = request.query_params.get('start_date')
+    end_date_str = request.query_params.get('end_date')
+    if start_date_str or end_date_str:
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except (ValueError, TypeError):
+            return None, Response(
+                {'error': 'start_date and end_date must both be given as YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = queryset.on_dates(start_date, end_date)
+    return queryset.order_by('timestamp', 'id'), None
+
+
+def _sale_costs(quantity, unit_price, unit_cost, total_cost):
+    """unit_cost, cost and profit export columns; blank for sales not yet backfilled"""
+    if unit_cost is None:
+        return None, None, None
+    return round(unit_cost, 4), round(total_cost, 4), round(float(quantity * unit_price) - total_cost, 4)
+
+
+def _export_response(request, name, columns, rows):
+    """
+    Stream rows (tuples matching columns) in the negotiated format. Rows are
+    pulled lazily from the database cursor and flushed every
+    EXPORT_CHUNK_SIZE rows, so memory stays flat however many there are.
+    """
+    if request.accepted_renderer.format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def encode(row):
+            writer.writerow(row)
+            line = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return line
+        header = encode(columns)
+    else:
+        def encode(row):
+            return json.dumps(dict(zip(columns, row)), default=str) + '\n'
+        header = ''
+
+    def stream():
+        chunk = [header]
+        for row in rows:
+            chunk.append(encode(row))
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+        yield ''.join(chunk)
+
+    response = StreamingHttpResponse(stream(), content_type=request.accepted_renderer.media_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="{name}-{timezone.localdate().isoformat()}.{request.accepted_renderer.format}"'
+    )
+    return response
+
+
+def _rollup_totals(rows):
+    """Collapse rollup rows into the revenue/profit summary the dashboard cards show"""
+    revenue = profit = 0.0
+    transactions = 0
+    for row in rows:
+        revenue += float(row['revenue'] or 0)
+        profit += row['profit'] or 0
+        transactions += row['transactions'] or 0
+    return {
+        'revenue': revenue,
+        'profit': profit,
+        'profit_margin': (profit / revenue * 100) if revenue > 0 else 0,
+        'transactions': transactions,
+    }
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """Hit/miss counters for the catalog response cache"""
+    return Response(cache.stats())
+
+
+@api_view(['GET'])
+def stock_on_hand(request):
+    """
+    Ingredient stock and prepared portions as they stood at ?at= (an ISO
+    datetime) or at the end of ?date= (YYYY-MM-DD), with their value.
+    Defaults to now.
+    """
+    at, date = request.query_params.get('at'), request.query_params.get('date')
+    try:
+        if at:
+            when = datetime.fromisoformat(at)
+            if timezone.is_naive(when):
+                when = timezone.make_aware(when)
+        elif date:
+            day = datetime.strptime(date, '%Y-%m-%d').date()
+            when = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time())) - timedelta(microseconds=1)
+        else:
+            when = timezone.now()
+    except ValueError:
+        return Response(
+            {'error': 'Give at as an ISO datetime or date as YYYY-MM-DD'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    on_hand = StockSnapshot.objects.on_hand(when)
+    ingredients = Ingredient.objects.in_bulk([pk for table, pk in on_hand if table == 'api.Ingredient'])
+    recipes = Recipe.objects.only('name').in_bulk([pk for table, pk in on_hand if table == 'api.Recipe'])
+    rows = {'api.Ingredient': [], 'api.Recipe': []}
+    for (table, pk), (quantity, unit_cost) in sorted(on_hand.items()):
+        if round(quantity, 9) == 0:
+            continue
+        row = {'id': pk, 'quantity': quantity, 'unit_cost': unit_cost, 'value': round(quantity * unit_cost, 4)}
+        if table == 'api.Ingredient':
+            ingredient = ingredients.get(pk)
+            row.update(name=ingredient and ingredient.name, unit=ingredient and ingredient.unit)
+        else:
+            recipe = recipes.get(pk)
+            row.update(name=recipe and recipe.name)
+        rows[table].append(row)
+
+    return Response({
+        'at': when,
+        'ingredients': rows['api.Ingredient'],
+        'prepared': rows['api.Recipe'],
+        'total_value': round(sum(row['value'] for table_rows in rows.values() for row in table_rows), 2),
+    })
+
+
+SYNC_FEEDS = (
+    ('ingredients', IngredientViewSet),
+    ('recipes', RecipeViewSet),
+    ('products', ProductViewSet),
+)
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 5000
+
+
+@api_view(['GET'])
+def sync(request):
+    """
+    Rows created, updated or deleted since the client's token, per model.
+
+    Without a token (or when the log no longer reaches back that far) only
+    a fresh token is returned with reset=true, and the client reloads in full.
+    At most `limit` log entries are read per call; with has_more=true the
+    client asks again from the returned token. Recipe and product figures
+    derived from ingredient stock are not logged row by row; they are
+    expanded here from the ingredient changes.
+    """
+    bounds = ChangeLogEntry.objects.aggregate(oldest=Min('pk'), latest=Max('pk'))
+    oldest, latest = bounds['oldest'], bounds['latest'] or 0
+    since = request.query_params.get('since')
+    if since is None:
+        return Response({'token': latest, 'reset': True, 'has_more': False, 'changes': {}})
+    try:
+        since = int(since)
+        limit = min(int(request.query_params.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1:
+        return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if since > latest or (oldest is not None and since < oldest - 1):
+        return Response({'token': latest, 'reset': True, 'has_more': False, 'changes': {}})
+
+    # Only the feeds' tables are read, so limit caps all the work done here
+    entries = ChangeLogEntry.objects.filter(
+        pk__lte=latest, table__in=[viewset.queryset.model._meta.label for _, viewset in SYNC_FEEDS],
+    )
+    token = entries.filter(pk__gt=since).order_by('pk').values_list('pk', flat=True)[limit - 1:limit].first() or latest
+    logged = entries.filter(pk__lte=token).since(since)
+    changed = {
+        model._meta.label: logged.get(model._meta.label, {})
+        for model in (viewset.queryset.model for _, viewset in SYNC_FEEDS)
+    }
+    ingredients = [pk for pk, deleted in changed['api.Ingredient'].items() if not deleted]
+    if ingredients:
+        for pk in RecipeIngredient.objects.filter(ingredient__in=ingredients).values_list('recipe', flat=True):
+            changed['api.Recipe'].setdefault(pk, False)
+    recipes = [pk for pk, deleted in changed['api.Recipe'].items() if not deleted]
+    if recipes:
+        for pk in Product.objects.filter(recipe__in=recipes).values_list('pk', flat=True):
+            changed['api.Product'].setdefault(pk, False)
+
+    changes = {}
+    for key, viewset in SYNC_FEEDS:
+        rows = changed[viewset.queryset.model._meta.label]
+        upserted = [pk for pk, deleted in rows.items() if not deleted]
+        instances = list(viewset.queryset.filter(pk__in=upserted)) if upserted else []
+        found = {instance.pk for instance in instances}
+        changes[key] = {
+            'updated': viewset.serializer_class(instances, many=True, context={'request': request}).data,
+            # Saved then deleted before this read counts as deleted
+            'deleted': sorted(pk for pk in rows if pk not in found),
+        }
+    return Response({'token': token, 'reset': False, 'has_more': token < latest, 'changes': changes})
+
+
+async def events(request):
+    """
+    Server-sent events for committed sales, production and ingredient
+    changes. A plain async Django view: it holds no thread while idle
+    when served over ASGI. Under WSGI (runserver) a stream would pin a
+    worker thread forever, so it answers 204, which tells EventSource
+    not to reconnect, and clients fall back to polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+    async def stream():
+        yield 'retry: 3000\n\n'
+        async for message in broker.subscribe():
+            yield message or ': keep-alive\n\n'
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def recipe_image(request, name):
+    """
+    A resized recipe photo. Names carry a hash of the file's bytes and never
+    change meaning, so clients and proxies may keep them for a year.
+    """
+    extension = name.rsplit('.', 1)[-1]
+    path = f'{images.DIRECTORY}/{name}'
+    if '/' in name or extension not in images.CONTENT_TYPES or not default_storage.exists(path):
+        raise Http404
+    response = FileResponse(default_storage.open(path, 'rb'), content_type=images.CONTENT_TYPES[extension])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -7,7 +7,26 @@ const API = axios.create({
   },
 });
 
-export const getIngredients = () => API.get("/ingredients/");
+// Catalog lists are paginated; collect every page so callers get a plain array
+const getAllPages = async (path, params = {}) => {
+  const results = [];
+  for (let page = 1; ; page += 1) {
+    const { data } = await API.get(path, {
+      params: { ...params, page, page_size: 1000 },
+    });
+    results.push(...data.results);
+    if (!data.next) return { data: results };
+  }
+};
+
+// Cursor-paginated history lists return { results, cursor } for "load more"
+const getCursorPage = async (path, cursor, params = {}) => {
+  const { data } = await API.get(path, { params: { ...params, cursor } });
+  const next = data.next ? new URL(data.next).searchParams.get("cursor") : null;
+  return { data: { results: data.results, cursor: next } };
+};
+
+export const getIngredients = () => getAllPages("/ingredients/");
 export const getIngredient = (id) => API.get(`/ingredients/${id}/`);
 export const createIngredient = (data) => API.post("/ingredients/", data);
 export const updateIngredient = (id, data) =>
@@ -15,9 +34,20 @@ export const updateIngredient = (id, data) =>
 export const deleteIngredient = (id) => API.delete(`/ingredients/${id}/`);
 export const restockIngredient = (id, amount) =>
   API.post(`/ingredients/${id}/restock/`, { amount });
+// items: [{ ingredient | name, amount }]; applied all together or not at all
+export const bulkRestockIngredients = (items) =>
+  API.post("/ingredients/bulk-restock/", { items });
+// file: a CSV File with name,unit,quantity,min_threshold,cost_per_unit columns
+export const importIngredients = (file) => {
+  const form = new FormData();
+  form.append("file", file);
+  return API.post("/ingredients/import/", form);
+};
+export const getLowStockIngredients = () => API.get("/ingredients/low-stock/");
+export const getStockAlerts = (cursor) => getCursorPage("/stock-alerts/", cursor);
 
 // Recipes API
-export const getRecipes = () => API.get("/recipes/");
+export const getRecipes = () => getAllPages("/recipes/");
 export const getRecipe = (id) => API.get(`/recipes/${id}/`);
 export const createRecipe = (data) => API.post("/recipes/", data);
 export const updateRecipe = (id, data) => API.put(`/recipes/${id}/`, data);
@@ -27,16 +57,28 @@ export const prepareRecipe = (id, quantity, notes) =>
     quantity: parseFloat(quantity),
     notes,
   });
+export const prepareRecipesBatch = (items) =>
+  API.post("/recipes/prepare-batch/", {
+    items: items.map((item) => ({
+      recipe: parseInt(item.recipe),
+      quantity: parseFloat(item.quantity),
+      notes: item.notes || "",
+    })),
+  });
 
 // Products API
-export const getProducts = () => API.get("/products/");
+export const getProducts = () => getAllPages("/products/");
 export const getProduct = (id) => API.get(`/products/${id}/`);
 export const createProduct = (data) => API.post("/products/", data);
 export const updateProduct = (id, data) => API.put(`/products/${id}/`, data);
 export const deleteProduct = (id) => API.delete(`/products/${id}/`);
+export const planProduction = (targets, days) =>
+  API.post("/products/plan/", targets ? { targets } : { days: days || 7 });
+export const getForecast = (params) =>
+  API.get("/products/forecast/", { params });
 
 // Sales API
-export const getSales = () => API.get("/sales/");
+export const getSales = (cursor) => getCursorPage("/sales/", cursor);
 export const createSale = (data) => {
   console.log("Creating sale with data:", data);
   return API.post("/sales/", {
@@ -45,6 +87,14 @@ export const createSale = (data) => {
     unit_price: parseFloat(data.unit_price),
   });
 };
+export const checkout = (items) =>
+  API.post("/sales/checkout/", {
+    items: items.map((item) => ({
+      product: parseInt(item.product),
+      quantity: parseInt(item.quantity),
+      unit_price: parseFloat(item.unit_price).toFixed(2),
+    })),
+  });
 export const getSaleReport = (period, startDate, endDate) => {
   const params = new URLSearchParams({
     period: period || "day",
@@ -54,9 +104,27 @@ export const getSaleReport = (period, startDate, endDate) => {
   return API.get(`/sales/report/?${params.toString()}`);
 };
 export const getDashboardData = () => API.get("/sales/dashboard/");
+// Streamed downloads, opened as plain links rather than fetched into memory
+export const salesExportUrl = (format, startDate, endDate) => {
+  const params = new URLSearchParams({ format });
+  if (startDate && endDate) {
+    params.set("start_date", startDate);
+    params.set("end_date", endDate);
+  }
+  return `/api/sales/export/?${params.toString()}`;
+};
+export const productionExportUrl = (format) =>
+  `/api/production-records/export/?format=${format}`;
+
+// Sync API: rows changed since a token returned by the previous call
+export const syncChanges = (since) =>
+  API.get("/sync/", { params: since == null ? {} : { since } });
+
+// Live updates: server-sent "sale", "production", "ingredient", "stock_alert" and "resync" events
+export const openEventStream = () => new EventSource("/api/events/");
 
 // RecipeIngredients API
-export const getRecipeIngredients = () => API.get("/recipe-ingredients/");
+export const getRecipeIngredients = () => getAllPages("/recipe-ingredients/");
 export const getRecipeIngredient = (id) =>
   API.get(`/recipe-ingredients/${id}/`);
 export const createRecipeIngredient = (data) =>
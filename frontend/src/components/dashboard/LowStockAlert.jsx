@@ -1,12 +1,36 @@
-import React from "react";
+import React, { useState, useEffect } from "react";
 import { Link } from "react-router-dom";
+import { getLowStockIngredients } from "../../api/api";
 import { useAppContext } from "../../context/AppContext";
 
 const LowStockAlert = () => {
-  const { ingredients, loading } = useAppContext();
+  const { subscribe } = useAppContext();
+  const [lowStockItems, setLowStockItems] = useState([]);
+  const [loading, setLoading] = useState(true);
 
-  const lowStockItems = ingredients.filter(
-    (item) => item.quantity <= item.min_threshold
+  // The server keeps an index of just the low items; refetch when stock moves
+  const fetchLowStock = async () => {
+    try {
+      const { data } = await getLowStockIngredients();
+      setLowStockItems(data);
+    } catch (err) {
+      console.error(err);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  useEffect(() => {
+    fetchLowStock();
+  }, []);
+
+  useEffect(
+    () =>
+      subscribe((type) => {
+        if (type === "ingredient" || type === "stock_alert" || type === "resync")
+          fetchLowStock();
+      }),
+    [subscribe]
   );
 
   if (loading) {
@@ -39,7 +39,23 @@ const RecipeList = () => {
           <li key={recipe.id}>
             <div className="px-4 py-4 sm:px-6">
               <div className="flex items-center justify-between">
-                <div className="truncate">
+                {recipe.image_variants?.thumb && (
+                  <picture className="mr-4 flex-shrink-0">
+                    <source
+                      srcSet={recipe.image_variants.thumb.webp}
+                      type="image/webp"
+                    />
+                    <img
+                      src={recipe.image_variants.thumb.jpeg}
+                      width={recipe.image_variants.thumb.width}
+                      height={recipe.image_variants.thumb.height}
+                      alt=""
+                      loading="lazy"
+                      className="h-12 w-12 rounded object-cover"
+                    />
+                  </picture>
+                )}
+                <div className="flex-1 truncate">
                   <p className="text-sm font-medium text-blue-600 truncate">
                     {recipe.name}
                   </p>
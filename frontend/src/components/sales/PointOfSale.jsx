@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from "react";
 import { useAppContext } from "../../context/AppContext";
-import { createSale } from "../../api/api";
+import { checkout } from "../../api/api";
 import LoadingSpinner from "../common/LoadingSpinner";
 import AlertMessage from "../common/AlertMessage";
 import { formatCurrency } from "../../utils/format";
@@ -113,14 +113,12 @@ const PointOfSale = () => {
     setMessage({ type: "", text: "" });
 
     try {
-      await Promise.all(
-        cart.map((item) =>
-          createSale({
-            product: item.product.id,
-            quantity: parseInt(item.quantity),
-            unit_price: parseFloat(item.unit_price),
-          })
-        )
+      await checkout(
+        cart.map((item) => ({
+          product: item.product.id,
+          quantity: item.quantity,
+          unit_price: item.unit_price,
+        }))
       );
 
       setMessage({
@@ -134,9 +132,12 @@ const PointOfSale = () => {
       setMessage({
         type: "error",
         text:
-          err.response?.data?.detail ||
-          err.response?.data?.error ||
-          "Failed to process sale",
+          [
+            err.response?.data?.detail || err.response?.data?.error,
+            ...(err.response?.data?.lines || []).flatMap((line) => line.errors),
+          ]
+            .filter(Boolean)
+            .join(" ") || "Failed to process sale",
       });
     } finally {
       setProcessing(false);
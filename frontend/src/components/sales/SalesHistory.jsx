@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from "react";
-import { getSales } from "../../api/api";
+import { getSales, salesExportUrl } from "../../api/api";
 import { format } from "date-fns";
 import LoadingSpinner from "../common/LoadingSpinner";
 import AlertMessage from "../common/AlertMessage";
@@ -9,37 +9,44 @@ const SalesHistory = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
   const [sales, setSales] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchSales();
   }, []);
 
-  const fetchSales = async () => {
+  const fetchSales = async (nextCursor = null) => {
     try {
-      setLoading(true);
-      const { data } = await getSales();
+      if (nextCursor) {
+        setLoadingMore(true);
+      } else {
+        setLoading(true);
+      }
+      const { data } = await getSales(nextCursor);
       console.log("Raw sales data:", data);
 
-      setSales(
-        data.map((sale) => {
-          const timestamp = sale.timestamp || sale.created_at;
-          console.log("Processing sale:", { id: sale.id, timestamp });
+      const page = data.results.map((sale) => {
+        const timestamp = sale.timestamp || sale.created_at;
+        console.log("Processing sale:", { id: sale.id, timestamp });
 
-          return {
-            ...sale,
-            timestamp: timestamp ? new Date(timestamp).toISOString() : null,
-            total_price: parseFloat(sale.total_price || 0),
-            profit: parseFloat(sale.profit || 0),
-            unit_price: parseFloat(sale.unit_price || 0),
-          };
-        })
-      );
+        return {
+          ...sale,
+          timestamp: timestamp ? new Date(timestamp).toISOString() : null,
+          total_price: parseFloat(sale.total_price || 0),
+          profit: parseFloat(sale.profit || 0),
+          unit_price: parseFloat(sale.unit_price || 0),
+        };
+      });
+      setSales((previous) => (nextCursor ? [...previous, ...page] : page));
+      setCursor(data.cursor);
       setError("");
     } catch (err) {
       setError("Failed to fetch sales history");
       console.error("Sales fetch error:", err);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -54,6 +61,11 @@ const SalesHistory = () => {
         <p className="mt-1 max-w-2xl text-sm text-gray-500">
           Recent sales transactions
         </p>
+        <p className="mt-2 text-sm">
+          <a href={salesExportUrl("csv")} className="text-blue-500 hover:text-blue-700">
+            Export all sales (CSV)
+          </a>
+        </p>
       </div>
 
       {error && <AlertMessage type="error" message={error} />}
@@ -125,6 +137,18 @@ const SalesHistory = () => {
           </table>
         </div>
       </div>
+
+      {cursor && (
+        <div className="px-6 py-4 text-center">
+          <button
+            onClick={() => fetchSales(cursor)}
+            disabled={loadingMore}
+            className="text-blue-600 hover:text-blue-800 disabled:text-gray-400"
+          >
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -1,10 +1,36 @@
-import React, { createContext, useState, useEffect, useContext } from "react";
+import React, {
+  createContext,
+  useState,
+  useEffect,
+  useContext,
+  useRef,
+  useCallback,
+} from "react";
 import * as api from "../api/api";
 
 const AppContext = createContext();
 
+const LIVE_EVENTS = ["sale", "production", "ingredient", "stock_alert", "resync"];
+// Without a live stream (the server is not running under ASGI) poll instead
+const POLL_INTERVAL = 15000;
+
 export const useAppContext = () => useContext(AppContext);
 
+// Replace changed rows in place, append new ones and drop deleted ids
+const applyChanges = (rows, { updated, deleted }) => {
+  if (!updated.length && !deleted.length) return rows;
+  const changed = new Map(updated.map((row) => [row.id, row]));
+  const removed = new Set(deleted);
+  const merged = rows
+    .filter((row) => !removed.has(row.id))
+    .map((row) => {
+      const next = changed.get(row.id);
+      changed.delete(row.id);
+      return next || row;
+    });
+  return [...merged, ...changed.values()];
+};
+
 export const AppProvider = ({ children }) => {
   const [ingredients, setIngredients] = useState([]);
   const [recipes, setRecipes] = useState([]);
@@ -12,6 +38,9 @@ export const AppProvider = ({ children }) => {
   const [loading, setLoading] = useState(false);
   const [loaded, setLoaded] = useState(false); // NEW
   const [error, setError] = useState(null);
+  const syncToken = useRef(null);
+  const liveListeners = useRef(new Set());
+  const pendingSync = useRef(null);
 
   const fetchIngredients = async () => {
     const { data } = await api.getIngredients();
@@ -36,11 +65,45 @@ export const AppProvider = ({ children }) => {
     setProducts(data);
   };
 
+  const reloadAll = async () => {
+    // Take the token first so changes made during the reload are replayed
+    const { data } = await api.syncChanges();
+    await Promise.all([fetchIngredients(), fetchRecipes(), fetchProducts()]);
+    syncToken.current = data.token;
+  };
+
+  // Resolves to whether anything had changed since the last sync
+  const syncData = async () => {
+    // Long absences come back in pages; keep going until caught up
+    let more = true;
+    let changed = false;
+    while (more) {
+      const { data } = await api.syncChanges(syncToken.current);
+      if (data.reset) {
+        await reloadAll();
+        return true;
+      }
+      setIngredients((rows) => applyChanges(rows, data.changes.ingredients));
+      setRecipes((rows) => applyChanges(rows, data.changes.recipes));
+      setProducts((rows) => applyChanges(rows, data.changes.products));
+      changed =
+        changed ||
+        Object.values(data.changes).some(({ updated, deleted }) => updated.length || deleted.length);
+      syncToken.current = data.token;
+      more = data.has_more;
+    }
+    return changed;
+  };
+
   const refreshData = async () => {
     try {
       setLoading(true);
       setError(null);
-      await Promise.all([fetchIngredients(), fetchRecipes(), fetchProducts()]);
+      if (syncToken.current === null) {
+        await reloadAll();
+      } else {
+        await syncData();
+      }
       setLoaded(true);
     } catch (err) {
       setError("Failed to fetch app data");
@@ -55,6 +118,52 @@ export const AppProvider = ({ children }) => {
     refreshData();
   }, []);
 
+  // Pages register here to hear about live events, e.g. to refetch the dashboard
+  const subscribe = useCallback((handler) => {
+    liveListeners.current.add(handler);
+    return () => liveListeners.current.delete(handler);
+  }, []);
+
+  useEffect(() => {
+    // Bursts of events (a whole checkout) collapse into one background sync.
+    // Without a live event to pass on, pages hear "resync" when the sync finds changes.
+    const scheduleSync = (notify = false) => {
+      if (pendingSync.current || syncToken.current === null) return;
+      pendingSync.current = setTimeout(async () => {
+        pendingSync.current = null;
+        try {
+          if ((await syncData()) && notify) {
+            liveListeners.current.forEach((handler) => handler("resync"));
+          }
+        } catch (err) {
+          console.error(err);
+        }
+      }, 250);
+    };
+
+    const source = api.openEventStream();
+    // Catch up on anything missed while disconnected
+    source.onopen = () => scheduleSync(true);
+    LIVE_EVENTS.forEach((type) =>
+      source.addEventListener(type, () => {
+        scheduleSync();
+        liveListeners.current.forEach((handler) => handler(type));
+      })
+    );
+    let poll = null;
+    source.onerror = () => {
+      // Closed for good (204) rather than reconnecting after a drop
+      if (source.readyState === EventSource.CLOSED && !poll) {
+        poll = setInterval(() => scheduleSync(true), POLL_INTERVAL);
+      }
+    };
+    return () => {
+      source.close();
+      clearInterval(poll);
+      clearTimeout(pendingSync.current);
+    };
+  }, []);
+
   const value = {
     ingredients,
     recipes,
@@ -63,6 +172,7 @@ export const AppProvider = ({ children }) => {
     loaded,
     error,
     refreshData,
+    subscribe,
   };
 
   return <AppContext.Provider value={value}>{children}</AppContext.Provider>;
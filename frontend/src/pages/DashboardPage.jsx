@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from "react";
 import { getDashboardData } from "../api/api";
+import { useAppContext } from "../context/AppContext";
 import LoadingSpinner from "../components/common/LoadingSpinner";
 import AlertMessage from "../components/common/AlertMessage";
 import DashboardMetrics from "../components/dashboard/DashboardMetrics";
@@ -10,14 +11,24 @@ const DashboardPage = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
   const [dashboardData, setDashboardData] = useState(null);
+  const { subscribe } = useAppContext();
 
   useEffect(() => {
     fetchDashboardData();
   }, []);
 
-  const fetchDashboardData = async () => {
+  // Refresh the figures in place whenever a sale is pushed
+  useEffect(
+    () =>
+      subscribe((type) => {
+        if (type === "sale" || type === "resync") fetchDashboardData(true);
+      }),
+    [subscribe]
+  );
+
+  const fetchDashboardData = async (quiet = false) => {
     try {
-      setLoading(true);
+      if (!quiet) setLoading(true);
       const { data } = await getDashboardData();
       console.log("Dashboard data:", {
         fullData: data,